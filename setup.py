@@ -9,10 +9,12 @@ setuptools.setup(
     version='0.0.1',
     packages=setuptools.find_packages('src'),
     package_dir={'': 'src'},
+    package_data={'ssv': ['data/MarzTemplates.json']},
     install_requires=[
         "altair",
         "astropy",
         "pandas",
+        "scipy",
         "specutils",
     ],
     python_requires='>=3.6',
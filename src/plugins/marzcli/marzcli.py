@@ -5,23 +5,103 @@ from Naked.toolshed.shell import execute_js, muterun_js
 import sys
 import os
 import json
+from functools import lru_cache
 from pathlib import Path
 from astropy.io import fits
+import time
+from ssv.cache import RedshiftCache, redshift_cache_key
+from ssv.marzworkers import marz_result, marz_result_to_dict, parse_marz_output, redshift_batch
+
+# Number of redshift candidates asked of Marz; more than one passes --numAutomatic to the Marz CLI,
+# and a Marz CLI without that option still reports (and is parsed as) the best fit alone. The flag
+# and the AutoZ2, AutoTN2, ... columns read for further candidates are unverified against Marz
+DEFAULT_MARZ_CANDIDATES = 1
 
 class MarzCLI(plugin_collection.Plugin):
-    """Marz CLI plugin; can be used to find the best fit of redshift and template to the input spectrum
-    """
+    """Marz CLI plugin; can be used to find the best fit of redshift and template to the input spectrum"""
+
     def __init__(self):
         super().__init__()
         self.description = 'MarzCLI'
 
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def template_signature():
+        """Return a hash of the Marz scripts and templates installed with the plugin
+
+        Cached results are keyed on it, so they are refitted when Marz or its templates change.
+        It is computed once per process, so restart after updating Marz or its templates
+        """
+        import hashlib
+
+        plugin_dir = Path(os.path.abspath(__file__)).parent
+        digest = hashlib.sha1()
+        for path in sorted(plugin_dir.rglob('*')):
+            if path.is_file() and path.suffix in ('.js', '.json', '.sh'):
+                digest.update(str(path.relative_to(plugin_dir)).encode())
+                digest.update(path.read_bytes())
+        return digest.hexdigest()
+
+    def _run_marzcli(self, spectrum_json, candidates=DEFAULT_MARZ_CANDIDATES):
+        """Fit one spectrum (as Marz JSON) with a fresh Marz CLI process, returning a MarzResult"""
+        from subprocess import run, PIPE, STDOUT
+
+        plugin_dir = os.path.dirname(os.path.abspath(__file__))
+
+        marzcli_path = plugin_dir + '/marzcli.js'
+        cmd = plugin_dir + '/marzcli.sh ' + marzcli_path
+        if int(candidates) > 1:
+            cmd += f' --numAutomatic={int(candidates)}'
+
+        start = time.perf_counter()
+        if sys.version_info[:3] >= (3,7):
+            proc = run(cmd, shell=True, input=spectrum_json, text=True, stdout=PIPE, stderr=STDOUT, close_fds=True)
+        else:
+            proc = run(cmd, shell=True, input=spectrum_json, universal_newlines=True, stdout=PIPE, stderr=STDOUT, close_fds=True)
+        return parse_marz_output(proc.stdout, seconds=time.perf_counter() - start)
+
+    def result(self, argument, candidates=DEFAULT_MARZ_CANDIDATES, cache=False):
+        """Fit a spectrum, returning everything Marz reported
+
+        Given a `cache`, results are persisted in it (keyed by the serialised spectrum, the Marz
+        installation and `candidates`), so asking again, e.g. to re-rank the candidates, does not
+        run Marz again.
+
+        Parameters
+        ----------
+        argument : SpectrumList
+            The spectrum to be fit, as read from its file
+        candidates : int, optional
+            Number of candidates Marz is asked for, by default only the best fit
+        cache : bool or RedshiftCache, optional
+            Where results are persisted; True uses a RedshiftCache in the ssv cache directory
+            (see `ssv.cache.default_cache_dir`), False (the default) persists nothing
+
+        Returns
+        -------
+        MarzResult
+            Best redshift, template, cross-correlation strength and QOP, all the candidates,
+            the seconds the fit took and the other fields of the Marz output
+        """
+        cache = self._cache(cache)
+        spectrum_json = utils.dumpMarzJSON(SimpleSpectrum('fits2JSON', argument))
+        if cache is None:
+            return self._run_marzcli(spectrum_json, candidates)
+        key = redshift_cache_key(spectrum_json, self._signature(candidates))
+        cached = cache.lookup(key)
+        if cached is not None:
+            return marz_result(cached[0])
+        result = self._run_marzcli(spectrum_json, candidates)
+        cache.store(key, marz_result_to_dict(result), result.seconds)
+        return result
+
     def reduce(self, argument):
         """Implementation of the Marz CLI
 
         Parameters
         ----------
-        argument : str
-            Path to the FITS file containing the spectrum to be fit
+        argument : SpectrumList
+            The spectrum to be fit, as read from its file
 
         Returns
         -------
@@ -30,34 +110,53 @@ class MarzCLI(plugin_collection.Plugin):
         String
             The name of the fitted template of the input spectrum
         """
+        result = self.result(argument)
 
-        import os
-        from subprocess import run, Popen, PIPE, STDOUT
-
-        spectrum = SimpleSpectrum('fits2JSON', argument)
-        spectrum_json = json.dumps(utils.toMarzJSON(spectrum), indent=2)
+        print("="*20 + " Marz CLI Plugin " + "="*20)
+        for candidate in result.candidates:
+            print(f"z = {candidate.z:.5f}  {candidate.template}  xcor = {candidate.value:.3f}")
+        print(f"BEST REDSHIFT = {result.z}")
+        print(f"BEST TEMPLATE = {result.template}")
+        return result.z, result.template
 
-        plugin_dir = os.path.dirname(os.path.abspath(__file__))
+    @staticmethod
+    def _cache(cache):
+        if cache is True:
+            return RedshiftCache()
+        return cache or None
 
-        marzcli_path = plugin_dir + '/marzcli.js'
-        cmd = plugin_dir + '/marzcli.sh ' + marzcli_path
+    def _signature(self, candidates):
+        return f'{self.template_signature()}:{int(candidates)}'
 
-        if sys.version_info[:3] >= (3,7):
-            proc = run(cmd, shell=True, input=spectrum_json, text=True, stdout=PIPE, stderr=STDOUT, close_fds=True)
-        else:
-            proc = run(cmd, shell=True, input=spectrum_json, universal_newlines=True, stdout=PIPE, stderr=STDOUT, close_fds=True)
-        
-        lines = proc.stdout.split('\n')
+    def reduce_many(self, arguments, workers=None, cache=False, candidates=DEFAULT_MARZ_CANDIDATES):
+        """Fit many spectra concurrently, reusing cached results
 
+        Parameters
+        ----------
+        arguments : iterable
+            Paths of spectra files and/or SimpleSpectrum objects
+        workers : int, optional
+            Number of spectra fitted at once (each by its own Marz CLI process), by default the
+            number of CPUs
+        cache : bool or RedshiftCache, optional
+            Where results are cached, keyed by the serialised spectrum and `template_signature`;
+            True uses a RedshiftCache in the ssv cache directory, False (the default) disables it.
+            The full MarzResult of each spectrum is persisted, see `result`
+        candidates : int, optional
+            Number of candidates Marz is asked for, by default only the best fit
 
-        print("="*20 + " Marz CLI Plugin " + "="*20)
-        for line in lines[:-6:-1]:
-            print(line)
-        
-        tokens = lines[-5].split(',')
-        bestfit_redshift = float(tokens[8])
-        bestfit_template = tokens[7].strip()
-        print(f"BEST REDSHIFT = {bestfit_redshift}")
-        print(f"BEST TEMPLATE = {bestfit_template}")
-        return bestfit_redshift, bestfit_template
+        Returns
+        -------
+        astropy.table.Table
+            One row per argument with its path, best fit z, template and xcor, the seconds the
+            fit took, whether it was cached and any error, see `ssv.marzworkers.redshift_batch`
+        """
+        def redshift(spectrum_json):
+            return marz_result_to_dict(self._run_marzcli(spectrum_json, candidates))
 
+        cache = self._cache(cache)
+        return redshift_batch(
+            arguments, redshift, cache=cache,
+            template_signature=self._signature(candidates) if cache is not None else '',
+            workers=workers,
+        )
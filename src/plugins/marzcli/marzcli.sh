@@ -1,3 +1,3 @@
 #!/bin/bash
 # python fits2json.py | 
-node $1 --verbose  --numCPUs=0  /dev/stdin 
+node $1 --verbose  --numCPUs=0  "${@:2}" /dev/stdin 
@@ -0,0 +1,126 @@
+import ssv.plugin_collection as plugin_collection
+import ssv.utils as utils
+from ssv.cache import RedshiftCache
+from ssv.marzworkers import redshift_batch
+from ssv.redshift import CrossCorrelator, DEFAULT_CANDIDATES, DEFAULT_TEMPLATE_FILE
+import hashlib
+import json
+import os
+from pathlib import Path
+
+# Marz template file used instead of the templates shipped with ssv
+TEMPLATES_ENVIRONMENT_VARIABLE = 'SSV_TEMPLATES'
+
+class CrossCorrelation(plugin_collection.Plugin):
+    """Cross-correlation plugin; finds the best fit redshift and template in-process, without Node or Marz
+
+    Templates are read from $SSV_TEMPLATES, or the Marz templates shipped with ssv, and prepared
+    once into a cached TemplateBank shared by all instances (and processes).
+    """
+    correlator = None
+    template_file = None
+
+    def __init__(self):
+        super().__init__()
+        self.description = 'XCorr'
+
+    @classmethod
+    def get_correlator(cls, template_file=None):
+        """Return the shared CrossCorrelator, preparing the templates on first use
+
+        Parameters
+        ----------
+        template_file : str or Path, optional
+            Marz template file, by default $SSV_TEMPLATES or the Marz templates shipped with ssv
+
+        Returns
+        -------
+        CrossCorrelator
+        """
+        if template_file is None:
+            template_file = os.environ.get(TEMPLATES_ENVIRONMENT_VARIABLE) or DEFAULT_TEMPLATE_FILE
+        template_file = Path(template_file)
+        if cls.correlator is None or cls.template_file != template_file:
+            if not template_file.exists():
+                raise FileNotFoundError(
+                    f'No Marz template file {template_file}; pass template_file or set '
+                    f'${TEMPLATES_ENVIRONMENT_VARIABLE} to the path of a MarzTemplates.json')
+            cls.correlator = CrossCorrelator(template_file)
+            cls.template_file = template_file
+        return cls.correlator
+
+    @staticmethod
+    def _spectrum(argument):
+        """The spectrum to fit: the reduced trace of a file or SpectrumList, or the argument itself"""
+        if isinstance(argument, (str, os.PathLike)):
+            argument = utils.read_spectra_file(argument)
+        if isinstance(argument, list):
+            reduced = [s for s in argument if s.meta.get('purpose') in ('reduced', 'combined')]
+            argument = (reduced or argument)[0]
+        return argument
+
+    def candidates(self, argument, candidates=DEFAULT_CANDIDATES):
+        """Return the best redshift candidates of a spectrum
+
+        Parameters
+        ----------
+        argument : str, Path, SpectrumList, Spectrum1D or SimpleSpectrum
+            The spectrum, or the file containing it
+        candidates : int, optional
+            Number of candidates
+
+        Returns
+        -------
+        list of RedshiftCandidate
+            Redshift, template and correlation value of the highest peaks, best first
+        """
+        return self.get_correlator().redshift(self._spectrum(argument), candidates)
+
+    def reduce(self, argument):
+        """Fit a spectrum
+
+        Parameters
+        ----------
+        argument : str, Path, SpectrumList, Spectrum1D or SimpleSpectrum
+            The spectrum, or the file containing it
+
+        Returns
+        -------
+        Float
+            The fitted redshift of the input spectrum
+        String
+            The name of the fitted template of the input spectrum
+        """
+        best = self.candidates(argument, 1)[0]
+        return best.z, best.template
+
+    def reduce_many(self, arguments, workers=None, cache=False):
+        """Fit many spectra, reusing cached results
+
+        Parameters
+        ----------
+        arguments : iterable
+            Paths of spectra files and/or SimpleSpectrum objects
+        workers : int, optional
+            Number of spectra fitted at once, by default the number of CPUs
+        cache : bool or RedshiftCache, optional
+            Where results are cached, keyed by the serialised spectrum and the template file;
+            True uses a RedshiftCache in the ssv cache directory, False (the default) disables it
+
+        Returns
+        -------
+        astropy.table.Table
+            See `ssv.marzworkers.redshift_batch`
+        """
+        if cache is True:
+            cache = RedshiftCache()
+        elif cache is False:
+            cache = None
+        correlator = self.get_correlator()
+
+        def redshift(spectrum_json):
+            best = correlator.redshift(json.loads(spectrum_json), 1)[0]
+            return {'z': best.z, 'template': best.template}
+
+        signature = 'xcorr:' + hashlib.sha1(self.template_file.read_bytes()).hexdigest()
+        return redshift_batch(arguments, redshift, cache=cache, template_signature=signature, workers=workers)
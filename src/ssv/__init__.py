@@ -2,6 +2,7 @@
 from . import ssvloaders
 from . import marz
 from . import marzJSON
+from . import marzBinary
 #import dc_loaders as loaders
 from .plotting import plot_spectra
 from .helpers import (
@@ -0,0 +1,227 @@
+"""
+Streaming access to the fibres of reduced AAOmega/2dF frames.
+
+The Data Central AAOmega loader builds a Spectrum1D, WCS and header copy for
+every fibre of a frame before returning. `iter_aaomega_fibres` instead yields
+the fibres one at a time (or only those asked for), reading each row with
+``hdu.section`` so that only that fibre is read from disk.
+"""
+from collections import ChainMap, Counter
+
+import numpy as np
+import astropy.io.fits as fits
+import astropy.units as u
+from astropy.nddata import VarianceUncertainty
+from specutils import Spectrum1D
+
+from .ssvloaders import compute_wcs_from_keys_and_values, guess_label_from_header
+
+AAOMEGA_2DF_FLUX_UNIT = u.Unit("count")
+AAOMEGA_2DF_WCS_SETTINGS = {
+    "pixel_reference_point_keyword": "CRPIX1",
+    "pixel_reference_point_value_keyword": "CRVAL1",
+    "pixel_width_keyword": "CDELT1",
+    "wavelength_unit": "Angstrom",
+}
+AAOMEGA_SCIENCE_INDEX = 0
+AAOMEGA_FIBRE_TABLE = "FIBRES"
+AAOMEGA_VARIANCE = "VARIANCE"
+AAOMEGA_RWSS = "RWSS"
+# Fibre types in the fibre table that are loaded by default: P(rogram) and
+# S(ky). U(nused), F(iducial) and N(o fibre) are skipped unless asked for.
+AAOMEGA_FIBRE_PURPOSES = {"P": "reduced", "S": "sky"}
+
+# (header keyword, fibre table column, comment), as set by the Data Central loader
+FIBRE_HEADER_COLUMNS = [
+    ("OBJECT", "NAME", "Name of target observed by fibre"),
+    ("OBJCOM", "COMMENT", "Comment from configure .fld file for target"),
+    ("OBJMAG", "MAGNITUDE", "Magnitude of target observed by fibre"),
+    ("OBJTYPE", "TYPE", "Type of target observed by fibre"),
+    ("OBJPIV", "PIVOT", "Pivot number used to observe target"),
+    ("OBJPID", "PID", "Program ID from configure .fld file"),
+    ("OBJX", "X", "X coord of target observed by fibre (microns)"),
+    ("OBJY", "Y", "Y coord of target observed by fibre (microns)"),
+    ("OBJXERR", "XERR", "X coord error of target observed by fibre (microns)"),
+    ("OBJYERR", "YERR", "Y coord error of target observed by fibre (microns)"),
+    ("OBJTHETA", "THETA", "Angle of fibre used to observe target"),
+    ("OBJRETR", "RETRACTOR", "Retractor number used to observe target"),
+    ("OBJWLEN", "WLEN", "Retractor of target observed by fibre"),
+]
+
+
+def _fibre_value(fibre_table, column, index):
+    value = fibre_table[column][index]
+    if isinstance(value, str):
+        return value.strip()
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _fibre_header(primary_header, fibre_table, index):
+    """Header of one fibre: the primary header plus its row of the fibre table"""
+    header = primary_header.copy()
+    header["FLDNAME"] = (primary_header["OBJECT"], "Name of 2dF .fld file")
+    header["FLDRA"] = (primary_header["MEANRA"], "Right Ascension of 2dF field")
+    header["FLDDEC"] = (primary_header["MEANDEC"], "Declination of 2dF field")
+    # RA and DEC are stored in radians in the fibre table
+    header["RA"] = (
+        _fibre_value(fibre_table, "RA", index) * 180.0 / np.pi,
+        "Right Ascension of fibre from configure .fld file",
+    )
+    header["DEC"] = (
+        _fibre_value(fibre_table, "DEC", index) * 180.0 / np.pi,
+        "Declination of fibre from configure .fld file",
+    )
+    for keyword, column, comment in FIBRE_HEADER_COLUMNS:
+        # WLEN was only added around 2005
+        if column in fibre_table.columns.names:
+            header[keyword] = (_fibre_value(fibre_table, column, index), comment)
+    return header
+
+
+def aaomega_fibre_table(file_obj):
+    """Return the fibre table of a reduced AAOmega/2dF frame
+
+    Parameters
+    ----------
+    file_obj : str, Path or HDUList
+        The frame
+
+    Returns
+    -------
+    astropy.table.Table
+        One row per fibre (row of the science image), with the target name,
+        position (in radians), type and so on
+    """
+    from astropy.table import Table
+
+    if isinstance(file_obj, fits.HDUList):
+        return Table(file_obj[AAOMEGA_FIBRE_TABLE].data)
+    with fits.open(file_obj) as hdulist:
+        return Table(hdulist[AAOMEGA_FIBRE_TABLE].data)
+
+
+def _select_fibres(fibre_table, fibres):
+    """Fibre indices to load, in order"""
+    types = [str(t).strip() for t in fibre_table["TYPE"]]
+    if fibres is None:
+        return [i for i, t in enumerate(types) if t in AAOMEGA_FIBRE_PURPOSES]
+    if isinstance(fibres, (str, int, np.integer)):
+        fibres = [fibres]
+    names = [str(name).strip() for name in fibre_table["NAME"]]
+    indices = []
+    for fibre in fibres:
+        if isinstance(fibre, str):
+            matches = [i for i, name in enumerate(names) if name == fibre.strip()]
+            if not matches:
+                raise ValueError(f"No fibre named {fibre!r}")
+            indices.extend(matches)
+        else:
+            if not -len(names) <= fibre < len(names):
+                raise ValueError(f"Fibre index {fibre} out of range")
+            indices.append(int(fibre) % len(names))
+    return indices
+
+
+def iter_aaomega_fibres(file_obj, fibres=None):
+    """Yield the fibres of a reduced AAOmega/2dF frame one at a time
+
+    The spectra match those of the Data Central AAOmega loader (purpose,
+    fibre_index, header, label, variance and RWSS science_sky spectrum in the
+    meta), but each fibre only costs reading its own rows, and fibres that
+    have been consumed can be released, so a whole frame can be processed in
+    constant memory.
+
+    Parameters
+    ----------
+    file_obj : str, Path or HDUList
+        The frame. An HDUList is left open
+    fibres : int, str or list, optional
+        Fibre indices (rows of the science image) and/or target names to load,
+        in the order they should be yielded. By default all program and sky
+        fibres, in file order
+
+    Yields
+    ------
+    Spectrum1D
+        One spectrum per fibre
+
+    Raises
+    ------
+    ValueError
+        If a requested fibre name or index is not in the frame
+    """
+    if not isinstance(file_obj, fits.HDUList):
+        with fits.open(file_obj) as hdulist:
+            yield from iter_aaomega_fibres(hdulist, fibres=fibres)
+        return
+
+    hdulist = file_obj
+    hdu_names = [hdu.name.strip() for hdu in hdulist]
+    science = hdulist[AAOMEGA_SCIENCE_INDEX]
+    variance = hdulist[AAOMEGA_VARIANCE] if AAOMEGA_VARIANCE in hdu_names else None
+    rwss = hdulist[AAOMEGA_RWSS] if AAOMEGA_RWSS in hdu_names else None
+    primary_header = science.header
+    fibre_table = hdulist[AAOMEGA_FIBRE_TABLE].data
+    indices = _select_fibres(fibre_table, fibres)
+
+    # Every fibre shares the wavelength solution of the primary header
+    wcs = compute_wcs_from_keys_and_values(primary_header, **AAOMEGA_2DF_WCS_SETTINGS)
+
+    # Labels are made unique the way add_labels does for a full load, which
+    # only needs the names from the fibre table
+    loaded = _select_fibres(fibre_table, None)
+    labels = {}
+    for index in set(loaded) | set(indices):
+        name = _fibre_value(fibre_table, "NAME", index)
+        try:
+            labels[index] = guess_label_from_header(ChainMap({"OBJECT": name}, primary_header))
+        except ValueError:
+            labels[index] = None
+    counts = Counter(labels[index] for index in loaded if labels[index] is not None)
+    if sum(counts.values()) != len(counts):
+        for position, index in enumerate(loaded, start=1):
+            if labels[index] is not None:
+                labels[index] += " #" + str(position)
+
+    for index in indices:
+        header = _fibre_header(primary_header, fibre_table, index)
+        fibre_type = str(fibre_table["TYPE"][index]).strip()
+        meta = {
+            "header": header,
+            "purpose": AAOMEGA_FIBRE_PURPOSES.get(fibre_type),
+            "fibre_index": index,
+        }
+        if labels[index] is not None:
+            meta["label"] = labels[index]
+        spectrum = Spectrum1D(
+            wcs=wcs, flux=science.section[index] * AAOMEGA_2DF_FLUX_UNIT, meta=meta,
+        )
+        if variance is not None:
+            spectrum.uncertainty = VarianceUncertainty(
+                variance.section[index] * AAOMEGA_2DF_FLUX_UNIT ** 2
+            )
+        if rwss is not None:
+            spectrum.meta["science_sky"] = Spectrum1D(
+                wcs=wcs,
+                flux=rwss.section[index] * AAOMEGA_2DF_FLUX_UNIT,
+                meta={"header": header, "purpose": "science_sky"},
+            )
+        yield spectrum
+
+
+def read_aaomega_fibre(file_obj, fibre):
+    """Read a single fibre of a reduced AAOmega/2dF frame
+
+    Parameters
+    ----------
+    file_obj : str, Path or HDUList
+        The frame
+    fibre : int or str
+        Index (row of the science image) or target name of the fibre
+
+    Returns
+    -------
+    Spectrum1D
+        The fibre, as yielded by `iter_aaomega_fibres`
+    """
+    return next(iter_aaomega_fibres(file_obj, fibres=[fibre]))
@@ -0,0 +1,582 @@
+"""
+On-disk caches shared by the ssv loaders.
+
+Entries are keyed by a file fingerprint (path, size, modification time and
+optionally a hash of the primary header block) so that they are invalidated
+as soon as the underlying file changes.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+FITS_BLOCK_SIZE = 2880
+CACHE_DIR_ENVIRONMENT_VARIABLE = "SSV_CACHE_DIR"
+DEFAULT_FORMAT_CACHE_FILENAME = "formats.sqlite"
+DEFAULT_REDSHIFT_CACHE_FILENAME = "redshifts.sqlite"
+
+
+def default_cache_dir():
+    """Directory used by the ssv caches when no explicit location is given
+
+    Uses ``$SSV_CACHE_DIR`` if set, otherwise ``$XDG_CACHE_HOME/ssv`` (falling
+    back to ``~/.cache/ssv``).
+
+    Returns
+    -------
+    pathlib.Path
+        The cache directory, which is not guaranteed to exist yet
+    """
+    cache_dir = os.environ.get(CACHE_DIR_ENVIRONMENT_VARIABLE)
+    if cache_dir:
+        return Path(cache_dir)
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    if xdg_cache_home:
+        return Path(xdg_cache_home) / "ssv"
+    return Path.home() / ".cache" / "ssv"
+
+
+def file_fingerprint(path, hash_header=False):
+    """Fingerprint a file so cached results can be checked for staleness
+
+    Parameters
+    ----------
+    path : str or Path
+        File to fingerprint
+    hash_header : bool, optional
+        Also hash the first FITS block (the start of the primary header), which
+        catches rewrites that preserve size and mtime, by default False
+
+    Returns
+    -------
+    dict
+        The resolved path, size, mtime (in ns) and header hash (or None)
+    """
+    path = Path(path).resolve()
+    stat = path.stat()
+    header_hash = None
+    if hash_header:
+        with open(path, "rb") as f:
+            header_hash = hashlib.sha1(f.read(FITS_BLOCK_SIZE)).hexdigest()
+    return {
+        "path": str(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "header_hash": header_hash,
+    }
+
+
+class FormatCache:
+    """
+    Persistent cache of the formats identified for a file
+
+    Identification runs every registered identifier against a file, which is
+    slow when the same archive is opened over and over. The cache stores the
+    identified formats in a SQLite database keyed by the file fingerprint and
+    the set of registered identifiers, so it is invalidated both when the
+    file changes and when loaders are (un)registered.
+
+    Attributes
+    ---------
+
+    hits
+        Number of lookups answered from the cache
+
+    misses
+        Number of lookups that required a full identification
+
+    seconds_saved
+        Sum of the identification time recorded for every cache hit
+    """
+    def __init__(self, path=None, hash_header=False):
+        if path is None:
+            path = default_cache_dir() / DEFAULT_FORMAT_CACHE_FILENAME
+        self.path = Path(path)
+        self.hash_header = hash_header
+        self.hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def __str__(self):
+        return f"FormatCache: {self.path}"
+
+    def __getstate__(self):
+        # Connections and locks can't be pickled, e.g. when sent to a
+        # process pool; the copy reconnects on first use
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(
+                str(self.path), check_same_thread=False, timeout=30
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS formats ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                "header_hash TEXT, signature TEXT, formats TEXT, "
+                "seconds REAL)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def lookup(self, path, signature):
+        """Return the cached formats of `path`, or None if absent or stale
+
+        Parameters
+        ----------
+        path : str or Path
+            File that is being identified
+        signature : str
+            Signature of the currently registered identifiers
+
+        Returns
+        -------
+        list or None
+            The cached list of formats, in identification order
+        """
+        fingerprint = file_fingerprint(path, hash_header=self.hash_header)
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT size, mtime_ns, header_hash, signature, formats, "
+                "seconds FROM formats WHERE path = ?",
+                (fingerprint["path"],),
+            ).fetchone()
+            if row is None or tuple(row[:4]) != (
+                fingerprint["size"], fingerprint["mtime_ns"],
+                fingerprint["header_hash"], signature,
+            ):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.seconds_saved += row[5]
+        return json.loads(row[4])
+
+    def store(self, path, signature, formats, seconds=0.0):
+        """Record the formats identified for `path`
+
+        Parameters
+        ----------
+        path : str or Path
+            File that was identified
+        signature : str
+            Signature of the currently registered identifiers
+        formats : list
+            Formats returned by the identification
+        seconds : float, optional
+            Time the identification took, credited to later hits
+        """
+        fingerprint = file_fingerprint(path, hash_header=self.hash_header)
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO formats VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    fingerprint["path"], fingerprint["size"],
+                    fingerprint["mtime_ns"], fingerprint["header_hash"],
+                    signature, json.dumps(list(formats)), seconds,
+                ),
+            )
+            connection.commit()
+
+    def clear(self):
+        """Remove every entry and reset the counters"""
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM formats")
+            connection.commit()
+            self.hits = 0
+            self.misses = 0
+            self.seconds_saved = 0.0
+
+    def stats(self):
+        """Return the hit/miss counters
+
+        Returns
+        -------
+        dict
+            Number of hits and misses, and the identification time saved
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "seconds_saved": self.seconds_saved,
+        }
+
+    def close(self):
+        """Close the underlying database connection"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def redshift_cache_key(spectrum_json, template_signature=""):
+    """Key of a redshift result: a hash of the serialised spectrum and the template set
+
+    Parameters
+    ----------
+    spectrum_json : str
+        The spectrum as Marz JSON, see `ssv.utils.dumpMarzJSON`
+    template_signature : str, optional
+        Identifies the templates (and code) the spectrum is fitted with
+
+    Returns
+    -------
+    str
+        Hex digest that changes whenever the spectrum or the templates do
+    """
+    digest = hashlib.sha1(template_signature.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(spectrum_json.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class RedshiftCache:
+    """
+    Persistent cache of redshift fits
+
+    Results are keyed by the content of the spectrum rather than the file it
+    came from (see `redshift_cache_key`), so re-running a field only fits the
+    spectra that are new or have changed, whatever their path.
+
+    Attributes
+    ---------
+
+    hits
+        Number of lookups answered from the cache
+
+    misses
+        Number of lookups of spectra that had not been fitted
+    """
+    def __init__(self, path=None):
+        if path is None:
+            path = default_cache_dir() / DEFAULT_REDSHIFT_CACHE_FILENAME
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def __str__(self):
+        return f"RedshiftCache: {self.path}"
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(
+                str(self.path), check_same_thread=False, timeout=30
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS redshifts ("
+                "key TEXT PRIMARY KEY, result TEXT, seconds REAL)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def lookup(self, key):
+        """Return the cached result for `key`
+
+        Parameters
+        ----------
+        key : str
+            See `redshift_cache_key`
+
+        Returns
+        -------
+        tuple or None
+            The result and the time the fit took, or None if absent
+        """
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT result, seconds FROM redshifts WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0]), row[1]
+
+    def store(self, key, result, seconds=0.0):
+        """Record the result of a fit
+
+        Parameters
+        ----------
+        key : str
+            See `redshift_cache_key`
+        result : dict
+            The JSON-able result of the fit
+        seconds : float, optional
+            Time the fit took
+        """
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO redshifts VALUES (?, ?, ?)",
+                (key, json.dumps(result), seconds),
+            )
+            connection.commit()
+
+    def clear(self):
+        """Remove every entry and reset the counters"""
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM redshifts")
+            connection.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Return the hit/miss counters
+
+        Returns
+        -------
+        dict
+            Number of hits and misses
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        """Close the underlying database connection"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+SPECTRA_CACHE_DIRNAME = "spectra"
+SPECTRA_CACHE_SUFFIX = ".ssvcache"
+SPECTRA_CACHE_INDEX = "index.json"
+SPECTRA_CACHE_COLUMNS = ["spectral_axis", "flux", "uncertainty", "mask"]
+SPECTRA_CACHE_VERSION = 1
+
+
+def _json_meta(meta):
+    """Split a spectrum's meta into JSON-able values and FITS headers, dropping the rest"""
+    from astropy.io import fits
+    values = {}
+    headers = {}
+    for key, value in meta.items():
+        if isinstance(value, fits.Header):
+            headers[key] = value.tostring()
+            continue
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        values[key] = value
+    return values, headers
+
+
+class SpectraCache:
+    """
+    Columnar on-disk cache of spectra read by `ssv.utils.read_spectra_file`
+
+    Each source file gets a directory holding one ``.npy`` file per column
+    (spectral axis, flux, uncertainty, mask) with all traces concatenated, and
+    an index with the source fingerprint, units, purposes, labels and headers.
+    Cached spectra are memory-mapped copy-on-write, so loading them neither
+    copies the arrays nor parses FITS headers and WCS.
+
+    Parameters
+    ---------
+
+    cache_dir
+        Directory for the cache entries, by default a ``spectra`` directory in
+        `default_cache_dir`
+
+    next_to_source
+        If True, entries are stored next to the source file (in
+        ``<source>.ssvcache``) instead of in `cache_dir`
+
+    hash_header
+        Also compare a hash of the first header block of the source, see
+        `file_fingerprint`
+    """
+    def __init__(self, cache_dir=None, next_to_source=False, hash_header=False):
+        if cache_dir is None:
+            cache_dir = default_cache_dir() / SPECTRA_CACHE_DIRNAME
+        self.cache_dir = Path(cache_dir)
+        self.next_to_source = next_to_source
+        self.hash_header = hash_header
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return f"SpectraCache: {self.cache_dir}"
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def entry_dir(self, path):
+        """Directory holding the cache entry of the source file `path`"""
+        path = Path(path).resolve()
+        if self.next_to_source:
+            return path.with_name(path.name + SPECTRA_CACHE_SUFFIX)
+        key = hashlib.sha1(str(path).encode("utf-8")).hexdigest()
+        return self.cache_dir / key
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def load(self, path):
+        """Load the cached spectra of `path`
+
+        Parameters
+        ----------
+        path : str or Path
+            The source file
+
+        Returns
+        -------
+        specutils.SpectrumList or None
+            The cached spectra, or None if there is no entry or the source changed
+        """
+        import numpy as np
+        from astropy.io import fits
+        from specutils import SpectrumList
+        from .utils import spectrum_from_arrays
+
+        entry_dir = self.entry_dir(path)
+        try:
+            with open(entry_dir / SPECTRA_CACHE_INDEX) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            self._count(False)
+            return None
+        fingerprint = file_fingerprint(path, hash_header=self.hash_header)
+        if index.get("version") != SPECTRA_CACHE_VERSION or index.get("fingerprint") != fingerprint:
+            self._count(False)
+            return None
+
+        columns = {
+            column: np.load(entry_dir / (column + ".npy"), mmap_mode="c")
+            for column in SPECTRA_CACHE_COLUMNS
+        }
+        spectra = SpectrumList()
+        for trace in index["traces"]:
+            window = slice(trace["start"], trace["stop"])
+            meta = dict(trace["meta"])
+            for key, header in trace["headers"].items():
+                meta[key] = fits.Header.fromstring(header)
+            spectra.append(spectrum_from_arrays({
+                "spectral_axis": columns["spectral_axis"][window],
+                "spectral_axis_unit": trace["spectral_axis_unit"],
+                "flux": columns["flux"][window],
+                "flux_unit": trace["flux_unit"],
+                "uncertainty": columns["uncertainty"][window] if trace["uncertainty_type"] else None,
+                "uncertainty_type": trace["uncertainty_type"],
+                "mask": columns["mask"][window] if trace["has_mask"] else None,
+                "meta": meta,
+            }))
+        self._count(True)
+        return spectra
+
+    def store(self, path, spectra):
+        """Write the spectra read from `path` to the cache
+
+        Parameters
+        ----------
+        path : str or Path
+            The source file
+        spectra : specutils.SpectrumList
+            The spectra read from the source
+        """
+        import shutil
+        import numpy as np
+        from .utils import spectrum_to_arrays
+
+        fingerprint = file_fingerprint(path, hash_header=self.hash_header)
+        columns = {column: [] for column in SPECTRA_CACHE_COLUMNS}
+        traces = []
+        start = 0
+        for spectrum in spectra:
+            arrays = spectrum_to_arrays(spectrum)
+            length = len(arrays["spectral_axis"])
+            meta, headers = _json_meta(arrays["meta"])
+            traces.append({
+                "start": start,
+                "stop": start + length,
+                "spectral_axis_unit": arrays["spectral_axis_unit"],
+                "flux_unit": arrays["flux_unit"],
+                "uncertainty_type": arrays["uncertainty_type"],
+                "has_mask": arrays["mask"] is not None,
+                "meta": meta,
+                "headers": headers,
+            })
+            start += length
+            columns["spectral_axis"].append(np.asarray(arrays["spectral_axis"]))
+            columns["flux"].append(np.asarray(arrays["flux"]))
+            columns["uncertainty"].append(
+                np.full(length, np.nan) if arrays["uncertainty"] is None
+                else np.asarray(arrays["uncertainty"])
+            )
+            columns["mask"].append(
+                np.zeros(length, dtype=bool) if arrays["mask"] is None
+                else np.asarray(arrays["mask"], dtype=bool)
+            )
+
+        entry_dir = self.entry_dir(path)
+        tmp_dir = entry_dir.with_name(
+            f"{entry_dir.name}.tmp-{os.getpid()}-{threading.get_ident()}"
+        )
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        for column, arrays in columns.items():
+            data = np.concatenate(arrays) if arrays else np.empty(0)
+            # native byte order, so loading never needs a byteswapped copy
+            np.save(tmp_dir / (column + ".npy"), data.astype(data.dtype.newbyteorder("="), copy=False))
+        with open(tmp_dir / SPECTRA_CACHE_INDEX, "w") as f:
+            json.dump({
+                "version": SPECTRA_CACHE_VERSION,
+                "fingerprint": fingerprint,
+                "traces": traces,
+            }, f)
+        if entry_dir.exists():
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # another writer got there first, their entry is as good as ours
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def stats(self):
+        """Return the hit/miss counters
+
+        Returns
+        -------
+        dict
+            Number of hits and misses
+        """
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,362 @@
+"""
+Air/vacuum and rest frame corrections of spectral axes.
+
+Marz-style frames record the corrections their wavelengths need in header
+keywords: ``VACUUM`` (if absent or false the wavelengths are in air),
+``DO_HELIO`` (shift to the heliocentric frame) and ``DO_CMB`` (then to the
+CMB frame). `header_corrections` reads them into `SpectralCorrection` records,
+computing the frame velocities of all the fibres of a frame in one call, and
+`SpectralAxisCorrector` applies corrections to many spectral axes at once.
+Corrected axes are cached per (grid, correction) pair, since the fibres of a
+frame share a grid.
+
+Corrections are opt-in: pass a `SpectralAxisCorrector` as the ``corrector`` of
+`ssv.utils.read_spectra_file` (or `ssv.utils.read_spectra_files`) to read
+spectra on corrected axes, which are then displayed and redshifted as such.
+"""
+from collections import OrderedDict, namedtuple
+import hashlib
+import threading
+
+import numpy as np
+import astropy.units as u
+import astropy.constants as const
+
+SPEED_OF_LIGHT = const.c.to_value(u.km / u.s)
+# Motion of the Sun relative to the CMB (Planck 2018 dipole), in km/s and galactic degrees
+CMB_DIPOLE_VELOCITY = 369.82
+CMB_DIPOLE_L = 264.021
+CMB_DIPOLE_B = 48.253
+# Frame velocities are rounded to this (km/s, i.e. 1 m/s) so fibres of a frame share cache entries
+VELOCITY_RESOLUTION = 1e-3
+DEFAULT_CORRECTION_CACHE_SIZE = 256
+# Keywords shared by the fibres of a frame, whose corrections are then computed together
+FRAME_KEYWORDS = ["VACUUM", "DO_HELIO", "DO_CMB", "UTMJD", "MJD-OBS", "LONG_OBS", "LAT_OBS", "ALT_OBS"]
+
+SpectralCorrection = namedtuple("SpectralCorrection", ["air_to_vacuum", "velocity"])
+SpectralCorrection.__doc__ = """Correction of a spectral axis
+
+Whether air wavelengths are converted to vacuum, and the velocity (km/s) of the target frame
+relative to the observer; wavelengths are multiplied by ``1 + velocity / c``."""
+NO_CORRECTION = SpectralCorrection(False, 0.0)
+
+
+def _in_angstrom(function):
+    """Apply `function` to wavelengths in Angstrom, accepting and returning Quantities too"""
+    def wrapper(wavelength):
+        if isinstance(wavelength, u.Quantity):
+            unit = wavelength.unit
+            return (function(wavelength.to_value(u.AA)) * u.AA).to(unit)
+        return function(np.asarray(wavelength, dtype=float))
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    return wrapper
+
+
+def _air_refraction(wavelength):
+    """Refractive index of air at (air) wavelengths in Angstrom, as in IDL's airtovac and Marz"""
+    return 1 + 2.735182e-4 + 131.4182 / wavelength ** 2 + 2.76249e8 / wavelength ** 4
+
+
+@_in_angstrom
+def air_to_vacuum(wavelength):
+    """Convert air wavelengths (Angstrom, or a Quantity) to vacuum, as Marz does"""
+    return wavelength * _air_refraction(wavelength)
+
+
+@_in_angstrom
+def vacuum_to_air(wavelength):
+    """Convert vacuum wavelengths (Angstrom, or a Quantity) to air, inverting `air_to_vacuum`"""
+    air = wavelength
+    # the index varies slowly with wavelength, so a few fixed point iterations converge
+    for _ in range(3):
+        air = wavelength / _air_refraction(air)
+    return air
+
+
+def _header_flag(header, keyword):
+    value = header.get(keyword, False)
+    if isinstance(value, str):
+        return value.strip().upper() in ("T", "TRUE", "Y", "YES", "1")
+    return bool(value)
+
+
+def heliocentric_velocity(ra, dec, mjd, location):
+    """Heliocentric correction of targets observed from `location` at `mjd`
+
+    Parameters
+    ----------
+    ra, dec : float or numpy.ndarray
+        Position of the targets, in degrees
+    mjd : float
+        Time of the observation (UTC)
+    location : astropy.coordinates.EarthLocation
+        The observatory
+
+    Returns
+    -------
+    numpy.ndarray
+        Velocity (km/s) to add to the observed radial velocity of each target
+    """
+    from astropy.coordinates import SkyCoord
+    from astropy.time import Time
+
+    coordinates = SkyCoord(ra=np.atleast_1d(ra) * u.deg, dec=np.atleast_1d(dec) * u.deg)
+    velocity = coordinates.radial_velocity_correction(
+        kind="heliocentric", obstime=Time(mjd, format="mjd", scale="utc"), location=location
+    )
+    return velocity.to_value(u.km / u.s)
+
+
+def cmb_velocity(ra, dec):
+    """Velocity (km/s) to add to heliocentric radial velocities of targets at `ra`, `dec` (degrees) for the CMB frame"""
+    from astropy.coordinates import SkyCoord
+
+    apex = SkyCoord(l=CMB_DIPOLE_L * u.deg, b=CMB_DIPOLE_B * u.deg, frame="galactic")
+    targets = SkyCoord(ra=np.atleast_1d(ra) * u.deg, dec=np.atleast_1d(dec) * u.deg)
+    return CMB_DIPOLE_VELOCITY * np.cos(targets.separation(apex).radian)
+
+
+def _position(header):
+    """RA and DEC (degrees) of the target of a header, or of its field"""
+    ra = header["RA"] if "RA" in header else header.get("MEANRA")
+    dec = header["DEC"] if "DEC" in header else header.get("MEANDEC")
+    return ra, dec
+
+
+def header_corrections(header, ra=None, dec=None):
+    """Corrections requested by the keywords of a Marz-style header
+
+    Parameters
+    ----------
+    header : astropy.io.fits.Header or dict
+        The (primary) header of the frame
+    ra, dec : float or array-like, optional
+        Positions (degrees) of the fibres, by default the RA/DEC of the header, or the mean
+        position of the field (MEANRA/MEANDEC); only needed for frame corrections
+
+    Returns
+    -------
+    list of SpectralCorrection
+        One correction per fibre (a single one if `ra` and `dec` are scalars)
+
+    Raises
+    ------
+    KeyError
+        If a frame correction is requested but the header lacks the time, site or position
+    """
+    air = not _header_flag(header, "VACUUM")
+    helio = _header_flag(header, "DO_HELIO")
+    cmb = _header_flag(header, "DO_CMB")
+    if ra is None or dec is None:
+        ra, dec = _position(header)
+    count = np.size(ra) if ra is not None else 1
+    velocity = np.zeros(count)
+    if helio or cmb:
+        if ra is None or dec is None:
+            raise KeyError("No RA/DEC to compute the frame correction for")
+    if helio:
+        from astropy.coordinates import EarthLocation
+
+        location = EarthLocation.from_geodetic(
+            lon=header["LONG_OBS"] * u.deg, lat=header["LAT_OBS"] * u.deg,
+            height=header.get("ALT_OBS", 0) * u.m,
+        )
+        mjd = header["UTMJD"] if "UTMJD" in header else header["MJD-OBS"]
+        velocity += heliocentric_velocity(ra, dec, mjd, location)
+    if cmb:
+        velocity += cmb_velocity(ra, dec)
+    return [SpectralCorrection(air, float(v)) for v in velocity]
+
+
+def _normalise(correction):
+    velocity = round(float(correction.velocity) / VELOCITY_RESOLUTION) * VELOCITY_RESOLUTION
+    return SpectralCorrection(bool(correction.air_to_vacuum), velocity)
+
+
+class SpectralAxisCorrector:
+    """
+    Applies `SpectralCorrection` records to spectral axes, caching the results
+
+    Each distinct (grid, correction) pair is computed once: in `correct_many`,
+    all the axes still to compute are converted in one vectorised pass, and
+    the corrected axes are kept (read-only) in an LRU cache.
+
+    Parameters
+    ---------
+
+    maxsize
+        Number of corrected axes kept
+
+    Attributes
+    ---------
+
+    hits
+        Number of axes served from the cache
+
+    misses
+        Number of axes that were computed
+    """
+    def __init__(self, maxsize=DEFAULT_CORRECTION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return f"SpectralAxisCorrector: {len(self._cache)} cached axes"
+
+    def __getstate__(self):
+        # sent to worker processes (see ssv.utils.read_spectra_files) without the lock or cache
+        return {"maxsize": self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @staticmethod
+    def _key(grid, correction):
+        digest = hashlib.sha1(np.ascontiguousarray(grid).tobytes()).hexdigest()
+        return grid.shape, grid.dtype.str, digest, correction
+
+    def correct_many(self, spectral_axes, corrections):
+        """Correct many spectral axes
+
+        Parameters
+        ----------
+        spectral_axes : sequence or 2-D array
+            The axes, as wavelengths in Angstrom or length Quantities
+        corrections : SpectralCorrection or sequence
+            One correction for all the axes, or one per axis
+
+        Returns
+        -------
+        list
+            The corrected axes, in the unit they were given in (read-only arrays shared with the
+            cache for plain wavelengths)
+        """
+        if isinstance(corrections, SpectralCorrection):
+            corrections = [corrections] * len(spectral_axes)
+        if len(corrections) != len(spectral_axes):
+            raise ValueError(f"{len(corrections)} corrections for {len(spectral_axes)} spectral axes")
+
+        units = []
+        grids = []
+        for axis in spectral_axes:
+            if isinstance(axis, u.Quantity):
+                units.append(axis.unit)
+                grids.append(np.asarray(axis.to_value(u.AA), dtype=float))
+            else:
+                units.append(None)
+                grids.append(np.asarray(axis, dtype=float))
+        corrections = [_normalise(correction) for correction in corrections]
+        keys = [self._key(grid, correction) for grid, correction in zip(grids, corrections)]
+
+        results = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    results[key] = self._cache[key]
+        todo = {}
+        for key, grid, correction in zip(keys, grids, corrections):
+            if key not in results and key not in todo:
+                todo[key] = (grid, correction)
+
+        # one pass per grid length, over all the axes of that length
+        by_length = {}
+        for key, (grid, correction) in todo.items():
+            by_length.setdefault(grid.shape, []).append(key)
+        for group in by_length.values():
+            stacked = np.array([todo[key][0] for key in group])
+            air = np.array([todo[key][1].air_to_vacuum for key in group])
+            factors = 1 + np.array([todo[key][1].velocity for key in group]) / SPEED_OF_LIGHT
+            if air.any():
+                stacked[air] = air_to_vacuum(stacked[air])
+            stacked *= factors.reshape((-1,) + (1,) * (stacked.ndim - 1))
+            stacked.flags.writeable = False
+            for key, corrected in zip(group, stacked):
+                results[key] = corrected
+
+        with self._lock:
+            self.hits += len(keys) - len(todo)
+            self.misses += len(todo)
+            for key in todo:
+                self._cache[key] = results[key]
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+        return [
+            results[key] if unit is None else (results[key] * u.AA).to(unit)
+            for key, unit in zip(keys, units)
+        ]
+
+    def correct(self, spectral_axis, correction):
+        """Correct one spectral axis, see `correct_many`"""
+        return self.correct_many([spectral_axis], [correction])[0]
+
+    def correct_spectra(self, spectra, corrections=None):
+        """Return copies of spectra with corrected spectral axes
+
+        Parameters
+        ----------
+        spectra : SpectrumList or list of Spectrum1D
+            The spectra, e.g. the fibres of a frame
+        corrections : SpectralCorrection or sequence, optional
+            By default read from the header in the meta of each spectrum (see
+            `header_corrections`), with the frame velocities of all the spectra of a frame
+            (same time, site and flags) computed in one call
+
+        Returns
+        -------
+        specutils.SpectrumList
+            The spectra on corrected axes, sharing the flux, uncertainty and mask of the
+            originals; the correction is recorded in their meta as ``spectral_correction``
+        """
+        from specutils import Spectrum1D, SpectrumList
+
+        spectra = list(spectra)
+        if corrections is None:
+            corrections = [NO_CORRECTION] * len(spectra)
+            frames = {}
+            for index, spectrum in enumerate(spectra):
+                header = spectrum.meta.get("header")
+                if header is not None:
+                    key = tuple(str(header.get(keyword)) for keyword in FRAME_KEYWORDS)
+                    frames.setdefault(key, []).append(index)
+            for indices in frames.values():
+                headers = [spectra[index].meta["header"] for index in indices]
+                ra, dec = zip(*(_position(header) for header in headers))
+                if None in ra or None in dec:
+                    ra = dec = None
+                for index, correction in zip(indices, header_corrections(headers[0], ra, dec)):
+                    corrections[index] = correction
+        elif isinstance(corrections, SpectralCorrection):
+            corrections = [corrections] * len(spectra)
+
+        axes = self.correct_many([spectrum.spectral_axis for spectrum in spectra], corrections)
+        corrected = SpectrumList()
+        for spectrum, axis, correction in zip(spectra, axes, corrections):
+            meta = dict(spectrum.meta, spectral_correction=_normalise(correction)._asdict())
+            corrected.append(Spectrum1D(
+                spectral_axis=axis, flux=spectrum.flux, uncertainty=spectrum.uncertainty,
+                mask=spectrum.mask, meta=meta,
+            ))
+        return corrected
+
+    def stats(self):
+        """Return the hit/miss counters
+
+        Returns
+        -------
+        dict
+            Number of hits and misses
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        """Empty the cache and reset the counters"""
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
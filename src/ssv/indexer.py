@@ -0,0 +1,272 @@
+"""
+Incremental index of the spectra in a directory.
+
+The index records, per file, the detected format and, per trace, the purpose,
+label, spectral range, pixel count and units, so that questions such as "all
+spectra covering H-alpha at z < 0.1" can be answered without opening every
+file. Re-running `SpectrumIndex.update` only reads files whose size or
+modification time changed.
+"""
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+import astropy.units as u
+
+from .cache import FormatCache, default_cache_dir
+from .ssvloaders import guess_label_from_header, resolve_format, whatformat
+from .utils import read_spectra_files
+
+DEFAULT_INDEX_FILENAME = "index.sqlite"
+INDEX_WAVELENGTH_UNIT = u.AA
+
+
+def _spectral_range(spectrum):
+    """Spectral range of `spectrum` in `INDEX_WAVELENGTH_UNIT`, or (None, None) if it can't be converted"""
+    try:
+        axis = spectrum.spectral_axis.to(INDEX_WAVELENGTH_UNIT, equivalencies=u.spectral())
+    except u.UnitConversionError:
+        return None, None
+    if len(axis) == 0:
+        return None, None
+    return float(axis.value.min()), float(axis.value.max())
+
+
+def _trace_label(meta):
+    label = meta.get("label")
+    if label is None and meta.get("header") is not None:
+        try:
+            label = guess_label_from_header(meta["header"])
+        except ValueError:
+            label = None
+    return label
+
+
+def _as_wavelength_range(value):
+    """Convert a wavelength, or a (start, stop) pair, to a range in `INDEX_WAVELENGTH_UNIT`"""
+    if not isinstance(value, (tuple, list)) and (not isinstance(value, u.Quantity) or value.isscalar):
+        value = (value, value)
+    start, stop = [
+        v.to_value(INDEX_WAVELENGTH_UNIT, equivalencies=u.spectral()) if isinstance(v, u.Quantity)
+        else float(v)
+        for v in value
+    ]
+    return min(start, stop), max(start, stop)
+
+
+class SpectrumIndex:
+    """
+    SQLite index of the spectra found in one or more directories
+
+    Parameters
+    ---------
+
+    path
+        Location of the SQLite database, by default ``index.sqlite`` in
+        `ssv.cache.default_cache_dir`. The detected formats are cached in the
+        same database (see `ssv.cache.FormatCache`)
+    """
+    def __init__(self, path=None):
+        if path is None:
+            path = default_cache_dir() / DEFAULT_INDEX_FILENAME
+        self.path = Path(path)
+        self.format_cache = FormatCache(self.path)
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def __str__(self):
+        return f"SpectrumIndex: {self.path}"
+
+    def _connect(self):
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._connection = sqlite3.connect(
+                str(self.path), check_same_thread=False, timeout=30
+            )
+            self._connection.executescript(
+                "PRAGMA journal_mode=WAL;"
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                "format TEXT, formats TEXT, error TEXT);"
+                "CREATE TABLE IF NOT EXISTS traces ("
+                "path TEXT, trace INTEGER, purpose TEXT, label TEXT, "
+                "wavelength_min REAL, wavelength_max REAL, n_pixels INTEGER, "
+                "spectral_axis_unit TEXT, flux_unit TEXT, "
+                "PRIMARY KEY (path, trace));"
+                "CREATE INDEX IF NOT EXISTS traces_range "
+                "ON traces (wavelength_min, wavelength_max);"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def update(self, directory, pattern="*", recursive=True, workers=None):
+        """Index the files in `directory` that are new or changed since the last update
+
+        Parameters
+        ----------
+        directory : str or Path
+            The directory to walk
+        pattern : str, optional
+            Glob pattern selecting the files to index, by default "*"
+        recursive : bool, optional
+            If True, also index the subdirectories, by default True
+        workers : int, optional
+            Number of files read in parallel, see `ssv.utils.read_spectra_files`
+
+        Returns
+        -------
+        dict
+            Number of files added, updated, removed, unchanged and failed
+        """
+        directory = Path(directory).resolve()
+        candidates = directory.rglob(pattern) if recursive else directory.glob(pattern)
+        # the database (and its journal files) may live in the indexed directory
+        database = str(self.path.resolve())
+        found = {}
+        for path in candidates:
+            if path.is_file() and not str(path).startswith(database):
+                stat = path.stat()
+                found[str(path)] = (stat.st_size, stat.st_mtime_ns)
+
+        counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "failed": 0}
+        with self._lock:
+            connection = self._connect()
+            known = {
+                row[0]: (row[1], row[2])
+                for row in connection.execute(
+                    "SELECT path, size, mtime_ns FROM files WHERE path LIKE ? ESCAPE '\\'",
+                    (self._directory_pattern(directory),)
+                )
+            }
+            # known files outside `pattern` or `recursive` are not walked, only drop those deleted
+            for path in set(known) - set(found):
+                if Path(path).is_file():
+                    continue
+                self._delete(connection, path)
+                counts["removed"] += 1
+            connection.commit()
+        stale = [path for path, stat in found.items() if known.get(path) != stat]
+        counts["unchanged"] = len(found) - len(stale)
+
+        results = read_spectra_files(
+            stale, workers=workers, ordered=False, format_cache=self.format_cache
+        )
+        for result in results:
+            formats = []
+            error = result.error
+            if error is None:
+                try:
+                    formats = whatformat(result.path, cache=self.format_cache)
+                except Exception as e:
+                    # the file was read, but its format could not be identified
+                    error = e
+            with self._lock:
+                connection = self._connect()
+                counts["updated" if result.path in known else "added"] += 1
+                if result.error is not None:
+                    counts["failed"] += 1
+                self._delete(connection, result.path)
+                size, mtime_ns = found[result.path]
+                connection.execute(
+                    "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                    (result.path, size, mtime_ns, resolve_format(formats),
+                     json.dumps(formats),
+                     None if error is None else repr(error))
+                )
+                for trace, spectrum in enumerate(result.spectra or []):
+                    wavelength_min, wavelength_max = _spectral_range(spectrum)
+                    connection.execute(
+                        "INSERT INTO traces VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (result.path, trace, spectrum.meta.get("purpose"),
+                         _trace_label(spectrum.meta), wavelength_min, wavelength_max,
+                         len(spectrum.spectral_axis),
+                         spectrum.spectral_axis.unit.to_string(),
+                         spectrum.flux.unit.to_string())
+                    )
+                connection.commit()
+        return counts
+
+    @staticmethod
+    def _directory_pattern(directory):
+        prefix = str(directory).rstrip("/") + "/"
+        return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+    @staticmethod
+    def _delete(connection, path):
+        connection.execute("DELETE FROM traces WHERE path = ?", (path,))
+        connection.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def query(self, format=None, purpose=None, label=None, covers=None, overlaps=None, directory=None):
+        """Find the indexed files with at least one trace matching all the given criteria
+
+        Parameters
+        ----------
+        format : str, optional
+            The format the file is read with
+        purpose : str, optional
+            The purpose of the trace, e.g. "reduced" or "sky"
+        label : str, optional
+            SQL LIKE pattern matched against the trace label
+        covers : Quantity or (start, stop), optional
+            Wavelength (or range) the trace must fully cover. Plain numbers are in Angstrom
+        overlaps : Quantity or (start, stop), optional
+            Wavelength range the trace must overlap. Plain numbers are in Angstrom
+        directory : str or Path, optional
+            Only return files within this directory
+
+        Returns
+        -------
+        list of str
+            Sorted paths, which can be passed to `ssv.utils.read_spectra_file`
+        """
+        conditions = []
+        parameters = []
+        if format is not None:
+            conditions.append("files.format = ?")
+            parameters.append(format)
+        if purpose is not None:
+            conditions.append("traces.purpose = ?")
+            parameters.append(purpose)
+        if label is not None:
+            conditions.append("traces.label LIKE ?")
+            parameters.append(label)
+        if covers is not None:
+            start, stop = _as_wavelength_range(covers)
+            conditions.append("traces.wavelength_min <= ? AND traces.wavelength_max >= ?")
+            parameters += [start, stop]
+        if overlaps is not None:
+            start, stop = _as_wavelength_range(overlaps)
+            conditions.append("traces.wavelength_min <= ? AND traces.wavelength_max >= ?")
+            parameters += [stop, start]
+        if directory is not None:
+            conditions.append("files.path LIKE ? ESCAPE '\\'")
+            parameters.append(self._directory_pattern(Path(directory).resolve()))
+
+        sql = "SELECT DISTINCT files.path FROM files JOIN traces ON files.path = traces.path"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY files.path"
+        with self._lock:
+            return [row[0] for row in self._connect().execute(sql, parameters)]
+
+    def failed(self):
+        """Return the indexed files that could not be read or identified, and their error
+
+        Returns
+        -------
+        dict
+            Error message by path
+        """
+        with self._lock:
+            return dict(self._connect().execute(
+                "SELECT path, error FROM files WHERE error IS NOT NULL ORDER BY path"
+            ))
+
+    def close(self):
+        """Close the database connections"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+        self.format_cache.close()
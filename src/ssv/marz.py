@@ -1,8 +1,15 @@
-import astropy.io.fits as fits
+from collections import Counter
+import inspect
+import logging
+
+from astropy.io import registry
 from specutils import SpectrumList
 from specutils.io.registers import data_loader
 
-from .ssvloaders import FITS_FILE_EXTS, SINGLE_SPLIT_LABEL, MULTILINE_SINGLE_LABEL
+from .ssvloaders import (
+    FITS_FILE_EXTS, SINGLE_SPLIT_LABEL, MULTILINE_SINGLE_LABEL,
+    register_header_rule, header_rule_identifier,
+)
 
 MARZ_CONFIG = {
     "hdus": {
@@ -50,31 +57,45 @@ MARZ_CONFIG_NEXT = {
 }
 
 
-def identify_marz(origin, *args, **kwargs):
+logger = logging.getLogger(__name__)
+
+
+def _supports_fallback_header():
     """
-    Identify if the current file is a OzDES file
+    Check whether the reader registered for the Data Central single-split
+    format (ssv's own unless overridden) accepts ``fallback_header``
     """
-    file_obj = args[0]
-    if isinstance(file_obj, fits.hdu.hdulist.HDUList):
-        hdulist = file_obj
-    else:
-        hdulist = fits.open(file_obj, **kwargs)
+    try:
+        reader = registry.get_reader(SINGLE_SPLIT_LABEL, SpectrumList)
+    except registry.IORegistryError:
+        return False
+    try:
+        parameters = inspect.signature(reader).parameters
+    except (TypeError, ValueError):
+        return False
+    return "fallback_header" in parameters
 
-    header = hdulist[0].header
 
-    if "AAOMEGA-2dF" in header.get("INSTRUME", "") and header.get("NAXIS", 0) == 1:
-        if not isinstance(file_obj, fits.hdu.hdulist.HDUList):
-            hdulist.close()
-        return True
+# Probed once, so each file is read once with the config the registered reader supports
+SUPPORTS_FALLBACK_HEADER = _supports_fallback_header()
+MARZ_READ_CONFIG = MARZ_CONFIG_NEXT if SUPPORTS_FALLBACK_HEADER else MARZ_CONFIG
+# Number of MARZ reads by config, "fallback" counts reads without fallback_header
+marz_read_counts = Counter()
 
-    if "Combined" in header.get("SOURCE", ""):
-        if not isinstance(file_obj, fits.hdu.hdulist.HDUList):
-            hdulist.close()
-        return True
 
-    if not isinstance(file_obj, fits.hdu.hdulist.HDUList):
-        hdulist.close()
-    return False
+MARZ_HEADER_RULE = [
+    {"INSTRUME": ("contains", "AAOMEGA-2dF"), "NAXIS": ("==", 1)},
+    {"SOURCE": ("contains", "Combined")},
+]
+register_header_rule("MARZ", MARZ_HEADER_RULE)
+_identify_marz_header = header_rule_identifier("MARZ")
+
+
+def identify_marz(origin, *args, **kwargs):
+    """
+    Identify if the current file is a MARZ file, using only its primary header
+    """
+    return _identify_marz_header(origin, *args, **kwargs)
 
 
 @data_loader(
@@ -82,13 +103,12 @@ def identify_marz(origin, *args, **kwargs):
     identifier=identify_marz,
 )
 def marz_loader(fname):
-    try:
-        spectra = SpectrumList.read(
-            fname, format=SINGLE_SPLIT_LABEL, **MARZ_CONFIG_NEXT
-        )
-    except:
+    if SUPPORTS_FALLBACK_HEADER:
+        marz_read_counts["fallback_header"] += 1
+    else:
         # fallback (to not having support for "fallback_header"!)
-        spectra = SpectrumList.read(
-            fname, format=SINGLE_SPLIT_LABEL, **MARZ_CONFIG
-        )
-    return spectra
\ No newline at end of file
+        marz_read_counts["fallback"] += 1
+        logger.debug("Reading %s without fallback_header support", fname)
+    return SpectrumList.read(
+        fname, format=SINGLE_SPLIT_LABEL, **MARZ_READ_CONFIG
+    )
@@ -0,0 +1,191 @@
+import json
+import os
+import struct
+
+import numpy as np
+from specutils import SpectrumList
+from specutils.io.registers import data_loader
+import ssv
+
+MARZ_BINARY_LABEL = "MARZBIN"
+MARZ_BINARY_FILE_EXTS = ["marzbin"]
+MARZ_BINARY_MAGIC = b"MARZBIN\0"
+MARZ_BINARY_VERSION = 1
+# Blocks start on multiples of this, so they can be viewed as float64 in place
+MARZ_BINARY_ALIGNMENT = 8
+MARZ_BINARY_KEYS = ["wavelength", "intensity", "sky", "variance"]
+
+_HEADER_LENGTH = struct.Struct("<I")
+
+
+def _aligned(offset):
+    return -(-offset // MARZ_BINARY_ALIGNMENT) * MARZ_BINARY_ALIGNMENT
+
+
+def identify_marzbin(origin, *args, **kwargs):
+    """
+    Identify if the current file is a binary Marz file, by its extension or
+    its magic bytes
+    """
+    path = args[0] if args else None
+    if isinstance(path, (str, os.PathLike)):
+        if os.fspath(path).lower().endswith(".marzbin"):
+            return True
+    file_obj = args[1] if len(args) > 1 else None
+    if not hasattr(file_obj, "read"):
+        return False
+    try:
+        # other identifiers may have left the shared file object anywhere
+        position = file_obj.tell()
+        file_obj.seek(0)
+        start = file_obj.read(len(MARZ_BINARY_MAGIC))
+        file_obj.seek(position)
+    except (OSError, ValueError):
+        return False
+    return start == MARZ_BINARY_MAGIC
+
+
+def writeMarzBinary(spectra, file, dtype=np.float32):
+    """Write spectra in the binary Marz exchange format
+
+    The file is the magic bytes ``MARZBIN\\0``, the length of a JSON header
+    as a little-endian uint32, the JSON header, and then contiguous
+    little-endian blocks holding the wavelength (always float64), intensity,
+    sky and variance of each spectrum, aligned to 8 bytes. The header lists
+    the dtype, offset (from the end of the header) and length of every block.
+
+    Parameters
+    ----------
+    spectra : SimpleSpectrum, dict or list
+        A SimpleSpectrum, a dict of arrays as returned by `ssv.utils.toMarzJSON`, or a list of
+        either
+    file : str, Path or file-like
+        Destination, opened in binary mode. File objects are left open
+    dtype : dtype, optional
+        Type of the intensity, sky and variance blocks, float32 (the default) or float64
+
+    Returns
+    -------
+    int
+        The number of spectra written
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "wb") as f:
+            return writeMarzBinary(spectra, f, dtype=dtype)
+
+    if not isinstance(spectra, (list, tuple)):
+        spectra = [spectra]
+    dtype = np.dtype(dtype).newbyteorder("<")
+    entries = []
+    blocks = []
+    offset = 0
+    for spectrum in spectra:
+        if isinstance(spectrum, dict):
+            arrays, name = spectrum, None
+        else:
+            arrays, name = ssv.utils._marz_arrays(spectrum), getattr(spectrum, "name", None)
+        length = len(arrays["wavelength"])
+        entry = {"length": length, "arrays": {}}
+        if name is not None:
+            entry["name"] = str(name)
+        for key in MARZ_BINARY_KEYS:
+            if key not in arrays:
+                continue
+            block_dtype = np.dtype("<f8") if key == "wavelength" else dtype
+            block = np.asarray(arrays[key], dtype=block_dtype)
+            if block.shape != (length,):
+                raise ValueError(f"{key} has {block.size} values, expected {length}")
+            offset = _aligned(offset)
+            entry["arrays"][key] = {"dtype": block_dtype.str, "offset": offset}
+            blocks.append((offset, block))
+            offset += block.nbytes
+        entries.append(entry)
+
+    header = json.dumps({
+        "version": MARZ_BINARY_VERSION, "spectra": entries
+    }).encode("utf-8")
+    prefix_length = len(MARZ_BINARY_MAGIC) + _HEADER_LENGTH.size + len(header)
+    # pad the header with spaces so the data starts aligned
+    header += b" " * (_aligned(prefix_length) - prefix_length)
+    file.write(MARZ_BINARY_MAGIC)
+    file.write(_HEADER_LENGTH.pack(len(header)))
+    file.write(header)
+    written = 0
+    for block_offset, block in blocks:
+        file.write(b"\0" * (block_offset - written))
+        file.write(block.tobytes())
+        written = block_offset + block.nbytes
+    return len(entries)
+
+
+def read_marz_binary(file_obj):
+    """Read the arrays of the spectra in a binary Marz file without copying them
+
+    Files given by path are memory-mapped (copy-on-write); bytes and file
+    objects are read once and viewed with `numpy.frombuffer`.
+
+    Parameters
+    ----------
+    file_obj : str, Path, bytes or file-like
+        The binary Marz data, see `writeMarzBinary`
+
+    Returns
+    -------
+    list of dict
+        For each spectrum, its arrays keyed by wavelength, intensity, sky and variance, and its
+        name if it has one
+
+    Raises
+    ------
+    ValueError
+        If the data is not a binary Marz file
+    """
+    if isinstance(file_obj, (str, os.PathLike)):
+        buffer = np.memmap(file_obj, dtype=np.uint8, mode="c")
+    elif hasattr(file_obj, "read"):
+        buffer = np.frombuffer(file_obj.read(), dtype=np.uint8)
+    else:
+        buffer = np.frombuffer(file_obj, dtype=np.uint8)
+
+    magic_length = len(MARZ_BINARY_MAGIC)
+    if buffer[:magic_length].tobytes() != MARZ_BINARY_MAGIC:
+        raise ValueError("Not a binary Marz file")
+    header_start = magic_length + _HEADER_LENGTH.size
+    (header_length,) = _HEADER_LENGTH.unpack(buffer[magic_length:header_start].tobytes())
+    header = json.loads(buffer[header_start:header_start + header_length].tobytes())
+    if header.get("version") != MARZ_BINARY_VERSION:
+        raise ValueError(f"Unsupported binary Marz version {header.get('version')}")
+    data = buffer[header_start + header_length:]
+
+    spectra = []
+    for entry in header["spectra"]:
+        length = entry["length"]
+        spectrum = {}
+        for key, block in entry["arrays"].items():
+            dtype = np.dtype(block["dtype"])
+            start = block["offset"]
+            spectrum[key] = data[start:start + length * dtype.itemsize].view(dtype)
+        if "name" in entry:
+            spectrum["name"] = entry["name"]
+        spectra.append(spectrum)
+    return spectra
+
+
+@data_loader(
+    label=MARZ_BINARY_LABEL, extensions=MARZ_BINARY_FILE_EXTS, dtype=SpectrumList,
+    identifier=identify_marzbin,
+)
+def marzbin_loader(fname):
+    if hasattr(fname, "read") and fname.seekable():
+        # the registry shares the file object with the identifiers
+        fname.seek(0)
+    spectra = SpectrumList()
+    for index, arrays in enumerate(read_marz_binary(fname)):
+        name = arrays.pop("name", None)
+        traces = ssv.utils.fromMarzJSON(arrays)
+        for spectrum in traces:
+            spectrum.meta["marz_index"] = index
+            if name is not None:
+                spectrum.meta["name"] = name
+        spectra.extend(traces)
+    return spectra
@@ -1,4 +1,8 @@
+import codecs
+import os
+import re
 import astropy.io.fits as fits
+import numpy as np
 from specutils import SpectrumList
 from specutils.io.registers import data_loader
 import ssv
@@ -6,18 +10,193 @@ import json
 
 from .ssvloaders import FITS_FILE_EXTS, SINGLE_SPLIT_LABEL, MULTILINE_SINGLE_LABEL
 
-JSON_FILE_EXTS = ["json", "JSON"]
+JSON_FILE_EXTS = ["json", "JSON", "jsonl"]
+MARZ_JSON_CHUNK_SIZE = 1 << 20
+# How much of a file object is looked at to recognise Marz JSON
+MARZ_JSON_PEEK_SIZE = 1 << 16
+MARZ_JSON_KEYS = ["wavelength", "intensity"]
+
+# Characters that matter when looking for the objects in a JSON document
+_JSON_STRUCTURE = re.compile(r'[{}"\\]')
 
 
 def identify_marzjson(origin, *args, **kwargs):
     """
-    Identify if the current file is a OzDES file
+    Identify if the current file is a Marz JSON file: a path ending in .json
+    (or .jsonl), or a file object starting with a JSON object or array that
+    mentions the Marz keys
     """
-    file_obj = args[0]
-    if file_obj.endswith(".json"):
+    path = args[0] if args else None
+    if isinstance(path, (str, os.PathLike)):
+        return os.fspath(path).lower().endswith((".json", ".jsonl"))
+    file_obj = args[1] if len(args) > 1 and args[1] is not None else path
+    if not hasattr(file_obj, "read"):
+        return False
+    name = getattr(file_obj, "name", None)
+    if isinstance(name, str) and name.lower().endswith((".json", ".jsonl")):
         return True
-    
-    return False
+    try:
+        # other identifiers may have left the shared file object anywhere
+        position = file_obj.tell()
+        file_obj.seek(0)
+        start = file_obj.read(MARZ_JSON_PEEK_SIZE)
+        file_obj.seek(position)
+    except (OSError, ValueError):
+        return False
+    if isinstance(start, bytes):
+        start = start.decode("utf-8", errors="ignore")
+    return start.lstrip()[:1] in ("{", "[") and any(
+        f'"{key}"' in start for key in MARZ_JSON_KEYS
+    )
+
+
+def _iter_json_objects(file_obj, chunk_size=MARZ_JSON_CHUNK_SIZE):
+    """Yield the text of each top-level JSON object in `file_obj`
+
+    This covers a single object, an array of objects and JSON lines, while
+    only holding one object (and one chunk) in memory.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    # offset in the stream of buffer[0], and of the current object's "{"
+    buffer_offset = 0
+    object_start = None
+    depth = 0
+    in_string = False
+    escaped_at = None
+    while True:
+        chunk = file_obj.read(chunk_size)
+        final = not chunk
+        if isinstance(chunk, bytes) or final:
+            chunk = decoder.decode(chunk or b"", final=final)
+        if final and not chunk:
+            break
+        chunk_offset = buffer_offset + len(buffer)
+        buffer += chunk
+        for match in _JSON_STRUCTURE.finditer(chunk):
+            position = chunk_offset + match.start()
+            if position == escaped_at:
+                continue
+            char = match.group()
+            if in_string:
+                if char == "\\":
+                    escaped_at = position + 1
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == "{":
+                if depth == 0:
+                    object_start = position
+                depth += 1
+            elif char == "}":
+                depth -= 1
+                if depth == 0:
+                    yield buffer[object_start - buffer_offset:position - buffer_offset + 1]
+                    object_start = None
+        keep_from = object_start if object_start is not None else buffer_offset + len(buffer)
+        buffer = buffer[keep_from - buffer_offset:]
+        buffer_offset = keep_from
+    if depth != 0:
+        raise ValueError("Truncated JSON document")
+
+
+def _parse_float_array(text):
+    return np.fromstring(text.replace("null", "nan"), sep=",")
+
+
+def _json_loads_marz(text):
+    """Parse a Marz JSON object with json, converting lists of numbers to float64 arrays"""
+    spectrum = json.loads(text)
+    return {
+        key: np.array(values, dtype=float) if isinstance(values, list) else values
+        for key, values in spectrum.items()
+    }
+
+
+def parse_marz_json(text):
+    """Parse one Marz JSON object into a dict of float64 arrays
+
+    The numeric arrays are parsed straight from the text into float64 buffers
+    (null becomes NaN), falling back to json for anything else.
+
+    Parameters
+    ----------
+    text : str
+        A JSON object whose values are arrays of numbers
+
+    Returns
+    -------
+    dict
+        The arrays, keyed as in the JSON object
+    """
+    spectrum = {}
+    position = text.find("{") + 1
+    while True:
+        start = text.find("[", position)
+        if start < 0:
+            break
+        stop = text.find("]", start)
+        key_stop = text.rfind('"', position, start)
+        key_start = text.rfind('"', position, key_stop)
+        if (
+            stop < 0 or key_start < 0
+            or "[" in text[start + 1:stop]
+            or text[position:key_start].strip(" \t\r\n,")
+            or text[key_stop + 1:start].strip(" \t\r\n:")
+        ):
+            return _json_loads_marz(text)
+        try:
+            spectrum[text[key_start + 1:key_stop]] = _parse_float_array(text[start + 1:stop])
+        except ValueError:
+            return _json_loads_marz(text)
+        position = stop + 1
+    if text[position:].strip(" \t\r\n,}"):
+        return _json_loads_marz(text)
+    return spectrum
+
+
+def iter_marz_json(file_obj, chunk_size=MARZ_JSON_CHUNK_SIZE):
+    """Iterate over the Marz spectra in a JSON file
+
+    Parameters
+    ----------
+    file_obj : str, Path or file-like
+        A file holding a single Marz JSON object, a JSON array of them, or
+        one per line (JSON lines)
+    chunk_size : int, optional
+        Number of characters read at a time
+
+    Yields
+    ------
+    dict
+        The float64 arrays of each spectrum, see `parse_marz_json`
+    """
+    if not hasattr(file_obj, "read"):
+        with open(file_obj, "rb") as f:
+            yield from iter_marz_json(f, chunk_size=chunk_size)
+        return
+    for text in _iter_json_objects(file_obj, chunk_size=chunk_size):
+        yield parse_marz_json(text)
+
+
+def iter_marzjson_spectra(file_obj, chunk_size=MARZ_JSON_CHUNK_SIZE):
+    """Lazily load the Marz spectra in a JSON file
+
+    Parameters
+    ----------
+    file_obj : str, Path or file-like
+        See `iter_marz_json`
+    chunk_size : int, optional
+        Number of characters read at a time
+
+    Yields
+    ------
+    SpectrumList
+        The traces of each Marz spectrum, as built by `ssv.utils.fromMarzJSON`
+    """
+    for spectrum in iter_marz_json(file_obj, chunk_size=chunk_size):
+        yield ssv.utils.fromMarzJSON(spectrum)
 
 
 @data_loader(
@@ -25,8 +204,12 @@ def identify_marzjson(origin, *args, **kwargs):
     identifier=identify_marzjson,
 )
 def marzjson_loader(fname):
-    spectra = None
-    with open(fname) as f:
-        spec_data = json.load(f)
-        spectra = ssv.utils.fromMarzJSON(spec_data)
+    if hasattr(fname, "read") and fname.seekable():
+        # the registry shares the file object with the identifiers
+        fname.seek(0)
+    spectra = SpectrumList()
+    for index, traces in enumerate(iter_marzjson_spectra(fname)):
+        for spectrum in traces:
+            spectrum.meta["marz_index"] = index
+        spectra.extend(traces)
     return spectra
\ No newline at end of file
@@ -0,0 +1,240 @@
+"""
+Batch redshifting and structured Marz results.
+
+`MarzResult` is the structured result of a fit, with all the candidates Marz
+reported, built from a result dict or the CSV output of the Marz CLI by
+`marz_result` and `parse_marz_output`.
+
+`redshift_batch` fits many spectra (files or in-memory) concurrently with any
+redshift function, e.g. one running the Marz CLI, skipping those whose result
+is already in a `ssv.cache.RedshiftCache`.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+from . import utils
+from .cache import redshift_cache_key
+from .redshift import RedshiftCandidate
+
+# Columns of the Marz CLI output giving the best fit; further candidates are
+# assumed to be numbered from 2 (AutoZ2, AutoTN2, ...), which has not been
+# checked against the output of a Marz CLI run with --numAutomatic
+MARZ_REDSHIFT_COLUMN = "AutoZ"
+MARZ_TEMPLATE_COLUMN = "AutoTN"
+MARZ_XCOR_COLUMN = "AutoXCor"
+MARZ_QOP_COLUMN = "QOP"
+# Positions of the columns in output without a header line
+MARZ_LEGACY_COLUMNS = {MARZ_TEMPLATE_COLUMN: 7, MARZ_REDSHIFT_COLUMN: 8, MARZ_XCOR_COLUMN: 9}
+
+MarzResult = namedtuple("MarzResult", ["z", "template", "xcor", "qop", "candidates", "seconds", "fields"])
+MarzResult.__doc__ = """Result of a Marz fit
+
+The best redshift, template, cross-correlation strength and quality (QOP, None if not
+assigned), every candidate as a `ssv.redshift.RedshiftCandidate` (best first), the seconds the
+fit took, and all the other fields Marz reported."""
+
+
+def _spectrum_json(spectrum, precision=None):
+    """Marz JSON of `spectrum`, which may already be serialised"""
+    if isinstance(spectrum, str):
+        return spectrum
+    return utils.dumpMarzJSON(spectrum, precision=precision)
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def marz_result(result, seconds=None):
+    """Build a `MarzResult` from a result dict (e.g. from `marz_result_to_dict`)
+
+    Parameters
+    ----------
+    result : dict
+        Holds at least ``z`` and ``template``, and optionally ``xcor``, ``qop``, ``seconds`` and
+        ``candidates``, a list of dicts with ``z``, ``template`` and ``value``
+    seconds : float, optional
+        Time the fit took, if not in `result`
+
+    Returns
+    -------
+    MarzResult
+    """
+    result = dict(result)
+    z = _float(result.pop("z", None))
+    template = str(result.pop("template", "")).strip()
+    xcor = _float(result.pop("xcor", None))
+    candidates = [
+        RedshiftCandidate(_float(candidate.get("z")), str(candidate.get("template", "")).strip(),
+                          _float(candidate.get("value")))
+        for candidate in result.pop("candidates", None) or []
+    ] or [RedshiftCandidate(z, template, xcor)]
+    qop = result.pop("qop", None)
+    seconds = result.pop("seconds", seconds)
+    return MarzResult(
+        z, template, xcor, None if qop is None else int(qop), candidates,
+        float("nan") if seconds is None else float(seconds), result,
+    )
+
+
+def marz_result_to_dict(result):
+    """JSON-able form of a `MarzResult`, read back by `marz_result`"""
+    data = dict(result.fields)
+    data.update({
+        "z": result.z, "template": result.template, "xcor": result.xcor, "qop": result.qop,
+        "candidates": [candidate._asdict() for candidate in result.candidates],
+        "seconds": result.seconds,
+    })
+    return data
+
+
+def parse_marz_output(output, seconds=None):
+    """Parse the results CSV printed by the Marz CLI
+
+    The last line holding the column names (``AutoZ`` and so on, possibly
+    commented with ``#``) maps the row after it, so all the candidates
+    (``AutoZ``, ``AutoZ2``, ...) and fields are kept. Output without column
+    names falls back to the template name and redshift at their usual
+    positions. The numbering of further candidates is unverified against
+    real Marz output; columns named otherwise are kept in the fields.
+
+    Parameters
+    ----------
+    output : str or list of str
+        Output of the Marz CLI, or its lines
+    seconds : float, optional
+        Time the fit took
+
+    Returns
+    -------
+    MarzResult
+
+    Raises
+    ------
+    ValueError
+        If there is no result in the output
+    """
+    lines = output.splitlines() if isinstance(output, str) else list(output)
+    lines = [line.strip() for line in lines if line.strip()]
+    header = row = None
+    for index, line in enumerate(lines):
+        columns = [column.strip() for column in line.lstrip("#").split(",")]
+        if MARZ_REDSHIFT_COLUMN in columns and index + 1 < len(lines):
+            header, row = columns, [value.strip() for value in lines[index + 1].split(",")]
+    if header is None:
+        # no header: the result is the last line with enough columns
+        rows = [line.split(",") for line in lines if line.count(",") >= max(MARZ_LEGACY_COLUMNS.values())]
+        if not rows:
+            raise ValueError("No Marz result in the output")
+        row = [value.strip() for value in rows[-1]]
+        header = [None] * len(row)
+        for column, position in MARZ_LEGACY_COLUMNS.items():
+            header[position] = column
+    fields = {column: value for column, value in zip(header, row) if column}
+
+    candidates = []
+    suffix = ""
+    while MARZ_REDSHIFT_COLUMN + suffix in fields:
+        candidates.append({
+            "z": fields.pop(MARZ_REDSHIFT_COLUMN + suffix),
+            "template": fields.pop(MARZ_TEMPLATE_COLUMN + suffix, ""),
+            "value": fields.pop(MARZ_XCOR_COLUMN + suffix, None),
+        })
+        suffix = str(len(candidates) + 1)
+    qop = fields.pop(MARZ_QOP_COLUMN, None)
+    best = candidates[0]
+    return marz_result(dict(
+        fields, z=best["z"], template=best["template"], xcor=best["value"], candidates=candidates,
+        qop=int(qop) if qop not in (None, "") and qop.lstrip("-").isdigit() else None,
+    ), seconds=seconds)
+
+
+def _batch_name(item):
+    if isinstance(item, (str, os.PathLike)):
+        return os.fspath(item)
+    if isinstance(item, dict):
+        return item.get("name")
+    return getattr(item, "name", None)
+
+
+def _batch_spectrum(item):
+    """The spectrum to fit for one item of a batch, reading it if it is a path"""
+    if isinstance(item, (str, os.PathLike)):
+        from .viewer import SimpleSpectrum
+        return SimpleSpectrum(os.fspath(item), utils.read_spectra_file(item))
+    return item
+
+
+def redshift_batch(items, redshift, cache=None, template_signature="", workers=None, precision=None):
+    """Fit the redshift of many spectra concurrently
+
+    Parameters
+    ----------
+    items : iterable
+        Paths of spectra files, and/or in-memory spectra (SimpleSpectrum or
+        Marz JSON dicts)
+    redshift : callable
+        Fits one spectrum given as Marz JSON and returns a dict holding at least
+        ``z`` and ``template``
+    cache : ssv.cache.RedshiftCache, optional
+        Cache of previous results, keyed by the serialised spectrum and
+        `template_signature`
+    template_signature : str, optional
+        Identifies the templates `redshift` fits with, so that changing them
+        invalidates the cached results
+    workers : int, optional
+        Number of spectra read and fitted in parallel, by default the number
+        of CPUs
+    precision : int, optional
+        Number of significant digits of the serialised spectra
+
+    Returns
+    -------
+    astropy.table.Table
+        One row per item, in order, with its path (or name), best fit ``z``,
+        ``template`` and ``xcor`` (NaN if not reported), the ``seconds`` the fit took (as recorded when it was
+        cached), whether it was ``cached`` and the ``error`` that stopped it (an
+        empty string if none; ``z`` is then NaN)
+    """
+    from astropy.table import Table
+
+    items = list(items)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    def fit(item):
+        try:
+            spectrum_json = _spectrum_json(_batch_spectrum(item), precision=precision)
+            if cache is not None:
+                key = redshift_cache_key(spectrum_json, template_signature)
+                cached = cache.lookup(key)
+                if cached is not None:
+                    result, seconds = cached
+                    return result, seconds, True, ""
+            start = time.perf_counter()
+            result = redshift(spectrum_json)
+            seconds = time.perf_counter() - start
+            if cache is not None:
+                cache.store(key, result, seconds)
+            return result, seconds, False, ""
+        except Exception as error:
+            return {}, float("nan"), False, f"{type(error).__name__}: {error}"
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        rows = list(executor.map(fit, items))
+
+    names = [_batch_name(item) for item in items]
+    return Table({
+        "path": ["" if name is None else str(name) for name in names],
+        "z": [float(result.get("z", "nan")) for result, *_ in rows],
+        "template": [str(result.get("template", "")).strip() for result, *_ in rows],
+        "xcor": [_float(result.get("xcor")) for result, *_ in rows],
+        "seconds": [row[1] for row in rows],
+        "cached": [row[2] for row in rows],
+        "error": [row[3] for row in rows],
+    })
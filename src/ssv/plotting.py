@@ -26,6 +26,9 @@ DEFAULT_SPECTRA_LABEL_COLUMN_NAME = "label"
 DEFAULT_LINE_LABEL_COLUMN_NAME = "name"
 DEFAULT_UNCERTAINTY_COLUMN_NAME = "variance"
 
+# points kept per horizontal pixel when downsampling spectra: the minimum and maximum of each pixel
+DEFAULT_POINTS_PER_PIXEL = 2
+
 
 def _custom_axis(*, axis, column, title):
     return axis(
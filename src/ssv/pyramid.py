@@ -0,0 +1,146 @@
+"""
+Multi-resolution summaries of spectra for zoom-dependent rendering.
+
+A `SpectrumPyramid` is the 1-D analogue of map tiles: level 0 is the spectrum
+itself and each level above it summarises pairs of buckets of the level below
+(so level ``k`` has buckets of ``2**k`` pixels) by their minimum, maximum and
+mean, along with the pixels holding the minimum and maximum. Building all the
+levels is O(N). A view of a wavelength window at a given point budget then
+picks the finest level with few enough buckets in the window and returns the
+extreme pixels of those buckets, in O(output size): a deep zoom returns every
+pixel, while a zoomed out view of a long spectrum only reads a few hundred
+precomputed values.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+PyramidLevel = namedtuple("PyramidLevel", ["argmin", "argmax", "minimum", "maximum", "mean", "count"])
+PyramidLevel.__doc__ = """Summary of the buckets of one pyramid level
+
+Pixel indices of the minimum and maximum of each bucket, the minimum, maximum and mean values,
+and the number of valid (not NaN) pixels summarised."""
+
+
+def _pairs(values, fill):
+    """Split `values` into its even and odd elements, padding an odd length with `fill`"""
+    if len(values) % 2:
+        values = np.append(values, fill)
+    return values[0::2], values[1::2]
+
+
+def _combine(level):
+    """Summarise pairs of buckets of `level` into the level above it"""
+    # a padding bucket repeats the last pixel index with NaN values, so it is never picked over real data
+    left_arg, right_arg = _pairs(level.argmin, level.argmin[-1])
+    left, right = _pairs(level.minimum, np.nan)
+    right_wins = (right < left) | (np.isnan(left) & ~np.isnan(right))
+    argmin, minimum = np.where(right_wins, right_arg, left_arg), np.where(right_wins, right, left)
+
+    left_arg, right_arg = _pairs(level.argmax, level.argmax[-1])
+    left, right = _pairs(level.maximum, np.nan)
+    right_wins = (right > left) | (np.isnan(left) & ~np.isnan(right))
+    argmax, maximum = np.where(right_wins, right_arg, left_arg), np.where(right_wins, right, left)
+
+    left_count, right_count = _pairs(level.count, 0)
+    left_mean, right_mean = _pairs(level.mean, np.nan)
+    count = left_count + right_count
+    total = np.nan_to_num(left_mean) * left_count + np.nan_to_num(right_mean) * right_count
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(count > 0, total / count, np.nan)
+    return PyramidLevel(argmin, argmax, minimum, maximum, mean, count)
+
+
+class SpectrumPyramid:
+    """Multi-resolution min/max/mean summaries of a spectrum
+
+    Parameters
+    ----------
+    wavelength : array-like
+        Spectral axis, used to find the pixels of a wavelength window
+    values : array-like
+        Values summarised, e.g. the flux; NaN values are ignored
+
+    Attributes
+    ----------
+    levels : list of PyramidLevel
+        Level ``k`` summarises buckets of ``2**k`` pixels; level 0 is the spectrum itself
+    """
+
+    def __init__(self, wavelength, values):
+        self.wavelength = np.asarray(wavelength, dtype=float)
+        values = np.asarray(values, dtype=float)
+        # windows are found by binary search, which needs an increasing spectral axis
+        self._sorted = bool(np.all(np.diff(self.wavelength) >= 0))
+        index = np.arange(len(values))
+        valid = ~np.isnan(values)
+        self.levels = [PyramidLevel(index, index, values, values, values, valid.astype(int))]
+        while len(self.levels[-1].argmin) > 1:
+            self.levels.append(_combine(self.levels[-1]))
+
+    def __len__(self):
+        return len(self.wavelength)
+
+    def window(self, wavelength_min=None, wavelength_max=None):
+        """Return the range of pixels covering a wavelength window
+
+        One pixel either side of the window is included, so that lines drawn through the
+        pixels reach the edges of the window.
+
+        Parameters
+        ----------
+        wavelength_min, wavelength_max : float, optional
+            Limits of the window, by default unbounded
+
+        Returns
+        -------
+        start, stop : int
+            The window is ``wavelength[start:stop]``
+        """
+        n = len(self)
+        if not self._sorted:
+            return 0, n
+        start = 0 if wavelength_min is None else np.searchsorted(self.wavelength, wavelength_min, side="left")
+        stop = n if wavelength_max is None else np.searchsorted(self.wavelength, wavelength_max, side="right")
+        return int(max(start - 1, 0)), int(min(stop + 1, n))
+
+    def level_for(self, start, stop, max_points):
+        """Return the finest level showing pixels ``start:stop`` in at most `max_points` points
+
+        Each bucket contributes its minimum and maximum, so the level must have at most
+        ``max_points // 2`` buckets in the window; level 0 needs ``stop - start <= max_points``.
+        """
+        if max_points is None or stop - start <= max_points:
+            return 0
+        buckets = max(max_points // 2, 1)
+        for level in range(1, len(self.levels)):
+            size = 2 ** level
+            if -(-stop // size) - start // size <= buckets:
+                return level
+        return len(self.levels) - 1
+
+    def indices(self, wavelength_range=None, max_points=None):
+        """Return the pixels to draw for a wavelength window and point budget
+
+        Parameters
+        ----------
+        wavelength_range : tuple of float, optional
+            ``(wavelength_min, wavelength_max)`` of the window, by default the whole spectrum
+        max_points : int, optional
+            Maximum number of pixels returned, by default no limit
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted pixel indices: every pixel of the window when it fits in `max_points`,
+            otherwise the minimum and maximum pixels of the buckets of the coarser level
+            covering it
+        """
+        start, stop = self.window(*(wavelength_range or (None, None)))
+        level = self.level_for(start, stop, max_points)
+        if level == 0:
+            return np.arange(start, stop)
+        size = 2 ** level
+        summary = self.levels[level]
+        first, last = start // size, -(-stop // size)
+        return np.unique(np.concatenate([summary.argmin[first:last], summary.argmax[first:last]]))
@@ -0,0 +1,540 @@
+"""
+In-process cross-correlation redshifting.
+
+As in Marz, spectra and templates are rebinned onto a common grid uniform in
+log10(wavelength), on which redshifting is a constant shift. Once their
+continuum is removed, outliers clipped, edges tapered and their norm
+made one, a spectrum is correlated against every template at once: one FFT
+of the spectrum, a product with the (precomputed) template FFTs and an
+inverse FFT batched over the template axis, in single precision. The
+strongest peaks within the redshift range of each template are the redshift
+candidates.
+
+The prepared templates are kept in a `TemplateBank`, which is cached on disk
+per template file and memory-mapped, so redshifting starts without parsing
+or rebinning any template.
+"""
+from collections import namedtuple
+import hashlib
+import json
+import os
+import shutil
+import threading
+import warnings
+from pathlib import Path
+
+import numpy as np
+import astropy.units as u
+from scipy import fft
+
+# Default log10(wavelength / Angstrom) grid, wide enough for the rest frame
+# UV of the quasar template and the near-infrared end of observed spectra
+LOG_LAMBDA_START = 2.9
+LOG_LAMBDA_END = 4.25
+# ~69 km/s per pixel
+LOG_LAMBDA_STEP = 1e-4
+# Width in pixels of the running mean subtracted as the continuum
+CONTINUUM_WIDTH = 121
+# Residuals beyond this many (robust) standard deviations are clipped
+CLIP_SIGMA = 5.0
+# Fraction of each end of a spectrum smoothly tapered to zero
+TAPER_FRACTION = 0.05
+DEFAULT_CANDIDATES = 5
+DEFAULT_Z_RANGE = (-0.01, 5.0)
+
+# Marz templates shipped with ssv, used when no template file is given
+DEFAULT_TEMPLATE_FILE = Path(__file__).parent / "data" / "MarzTemplates.json"
+
+TEMPLATE_BANK_DIRNAME = "templates"
+TEMPLATE_BANK_INDEX = "index.json"
+TEMPLATE_BANK_ARRAYS = ["flux", "prepared", "template_fft"]
+TEMPLATE_BANK_VERSION = 1
+
+RedshiftCandidate = namedtuple("RedshiftCandidate", ["z", "template", "value"])
+RedshiftCandidate.__doc__ = """A peak of the cross-correlation: redshift, template name and correlation value"""
+
+
+def log_lambda_grid(start=LOG_LAMBDA_START, end=LOG_LAMBDA_END, step=LOG_LAMBDA_STEP):
+    """Return a grid uniform in log10(wavelength / Angstrom)
+
+    Parameters
+    ----------
+    start, end : float, optional
+        log10 of the first and last wavelength
+    step : float, optional
+        Spacing in log10(wavelength)
+
+    Returns
+    -------
+    numpy.ndarray
+        The grid, in log10(Angstrom)
+    """
+    return start + step * np.arange(int(round((end - start) / step)) + 1)
+
+
+def rebin_log(wavelength, values, grid):
+    """Interpolate `values` sampled at `wavelength` (Angstrom) onto a log10 grid
+
+    Non-finite values are skipped, and grid points outside the wavelength range are NaN.
+    """
+    wavelength = np.asarray(wavelength, dtype=float)
+    values = np.asarray(values, dtype=float)
+    good = np.isfinite(values) & np.isfinite(wavelength) & (wavelength > 0)
+    if good.sum() < 2:
+        return np.full(grid.shape, np.nan)
+    log_wavelength = np.log10(wavelength[good])
+    order = np.argsort(log_wavelength, kind="stable")
+    return np.interp(grid, log_wavelength[order], values[good][order], left=np.nan, right=np.nan)
+
+
+def _window_sum(values, width):
+    """Sum of `values` over a centered window of `width` pixels, along the last axis"""
+    n = values.shape[-1]
+    padding = [(0, 0)] * (values.ndim - 1) + [(1, 0)]
+    cumulative = np.cumsum(np.pad(values, padding), axis=-1)
+    index = np.arange(n)
+    upper = np.minimum(index + width // 2 + 1, n)
+    lower = np.maximum(index - width // 2, 0)
+    return cumulative[..., upper] - cumulative[..., lower]
+
+
+def prepare_for_correlation(flux, variance=None, continuum_width=CONTINUUM_WIDTH):
+    """Turn rebinned spectra into the normalised residuals that are cross-correlated
+
+    Parameters
+    ----------
+    flux : numpy.ndarray
+        Spectra on a log-wavelength grid (last axis), NaN where there is no data
+    variance : numpy.ndarray, optional
+        Their variance on the same grid; residuals are then weighted by the inverse standard
+        deviation, which suppresses sky lines and noisy ends
+    continuum_width : int, optional
+        Width in pixels of the running mean subtracted as the continuum
+
+    Returns
+    -------
+    numpy.ndarray
+        Residuals with unit norm (or zero if there is no data), zero outside the data
+    """
+    flux = np.atleast_1d(np.asarray(flux, dtype=float))
+    valid = np.isfinite(flux)
+    if variance is not None:
+        variance = np.asarray(variance, dtype=float)
+        valid &= np.isfinite(variance) & (variance > 0)
+    filled = np.where(valid, flux, 0.0)
+    counts = _window_sum(valid.astype(float), continuum_width)
+    continuum = _window_sum(filled, continuum_width) / np.maximum(counts, 1)
+    residual = np.where(valid, filled - continuum, 0.0)
+    if variance is not None:
+        residual[valid] /= np.sqrt(variance[valid])
+
+    # clip spikes (cosmic rays, bad sky subtraction) at CLIP_SIGMA robust standard deviations
+    masked = np.where(valid, np.abs(residual), np.nan)
+    with warnings.catch_warnings():
+        # rows without data have no median
+        warnings.simplefilter("ignore", RuntimeWarning)
+        sigma = 1.4826 * np.nanmedian(masked, axis=-1, keepdims=True)
+    sigma = np.where(np.isfinite(sigma) & (sigma > 0), sigma, np.inf)
+    residual = np.clip(residual, -CLIP_SIGMA * sigma, CLIP_SIGMA * sigma)
+
+    # cosine taper at both ends of the data, so its edges don't correlate
+    index = np.arange(flux.shape[-1])
+    first = np.argmax(valid, axis=-1)[..., None]
+    last = flux.shape[-1] - 1 - np.argmax(valid[..., ::-1], axis=-1)[..., None]
+    position = (index - first) / np.maximum(last - first, 1)
+    edge = np.clip(np.minimum(position, 1 - position) / TAPER_FRACTION, 0, 1)
+    residual *= 0.5 * (1 - np.cos(np.pi * edge))
+
+    norm = np.sqrt(np.sum(residual ** 2, axis=-1, keepdims=True))
+    return residual / np.where(norm > 0, norm, 1)
+
+
+def _spectrum_arrays(spectrum):
+    """Wavelength (Angstrom), flux and variance (or None) of a spectrum
+
+    Accepts a Spectrum1D, a SimpleSpectrum (its reduced trace) or a dict of Marz arrays.
+    """
+    from astropy.nddata import StdDevUncertainty, InverseVariance
+
+    if isinstance(spectrum, dict):
+        variance = spectrum.get("variance")
+        return (
+            np.asarray(spectrum["wavelength"], dtype=float),
+            np.asarray(spectrum["intensity"], dtype=float),
+            None if variance is None else np.asarray(variance, dtype=float),
+        )
+    if not hasattr(spectrum, "spectral_axis"):
+        from .utils import _marz_arrays
+        arrays = _marz_arrays(spectrum)
+        return arrays["wavelength"], arrays["intensity"], arrays["variance"]
+
+    wavelength = spectrum.spectral_axis.to_value(u.AA, equivalencies=u.spectral())
+    flux = np.asarray(spectrum.flux.value, dtype=float)
+    if spectrum.mask is not None:
+        flux = np.where(spectrum.mask, np.nan, flux)
+    uncertainty = spectrum.uncertainty
+    variance = None
+    if isinstance(uncertainty, StdDevUncertainty):
+        variance = np.asarray(uncertainty.array, dtype=float) ** 2
+    elif isinstance(uncertainty, InverseVariance):
+        with np.errstate(divide="ignore"):
+            variance = 1 / np.asarray(uncertainty.array, dtype=float)
+    elif uncertainty is not None:
+        variance = np.asarray(uncertainty.array, dtype=float)
+    return wavelength, flux, variance
+
+
+class TemplateBank:
+    """
+    Templates prepared once on a shared log-wavelength grid
+
+    The rebinned fluxes, the residuals that are cross-correlated (see
+    `prepare_for_correlation`) and optionally their FFTs are each stored as one
+    2-D array (templates x pixels), which can be saved to a directory of
+    ``.npy`` files and memory-mapped back. Loading a saved bank therefore
+    neither parses the template file nor rebins anything, and every process
+    that loads the same bank shares one copy of it through the page cache.
+    Pickling a saved bank only sends its location.
+
+    Parameters
+    ---------
+
+    grid
+        log10(wavelength / Angstrom) grid, see `log_lambda_grid`
+
+    names
+        Name of each template
+
+    template_redshifts
+        Redshift each template is at
+
+    z_ranges
+        (start, end) of the redshifts each template is fitted over
+
+    flux
+        Templates rebinned onto the grid, NaN outside their wavelength range
+
+    prepared
+        Residuals that are cross-correlated, see `prepare_for_correlation`
+
+    template_fft
+        FFT of `prepared`, of length `n_fft`; computed on first use if not given
+
+    path
+        Directory the bank was saved to or loaded from, if any
+    """
+    def __init__(self, grid, names, template_redshifts, z_ranges, flux, prepared, template_fft=None, path=None):
+        self.grid = np.asarray(grid, dtype=float)
+        self.step = float(self.grid[1] - self.grid[0])
+        self.names = list(names)
+        self.template_redshifts = np.asarray(template_redshifts, dtype=float)
+        self.z_ranges = np.asarray(z_ranges, dtype=float).reshape(-1, 2)
+        self.flux = flux
+        self.prepared = prepared
+        self.path = None if path is None else Path(path)
+        self.source = None
+        self._template_fft = template_fft
+
+        # lag k shifts a template k pixels redwards: 1 + z = 10**(k * step) * (1 + z_template)
+        self.lag_ranges = np.log10((1 + self.z_ranges) / (1 + self.template_redshifts[:, None])) / self.step
+        self.lags = np.arange(int(np.floor(self.lag_ranges.min())), int(np.ceil(self.lag_ranges.max())) + 1)
+        # zero padding by the largest lag stops the correlation wrapping around
+        self.n_fft = fft.next_fast_len(len(self.grid) + int(np.abs(self.lags).max()) + 1, real=True)
+
+    def __str__(self):
+        return f"TemplateBank: {len(self.names)} templates"
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getstate__(self):
+        if self.path is not None:
+            return {"path": str(self.path)}
+        return self.__dict__.copy()
+
+    def __setstate__(self, state):
+        if set(state) == {"path"}:
+            state = type(self).load(state["path"]).__dict__
+        self.__dict__.update(state)
+
+    @property
+    def template_fft(self):
+        """FFT of the prepared templates, of length `n_fft`"""
+        if self._template_fft is None:
+            self._template_fft = fft.rfft(self.prepared, self.n_fft, axis=-1).astype(np.complex64)
+        return self._template_fft
+
+    @classmethod
+    def from_templates(cls, templates, grid=None, z_range=DEFAULT_Z_RANGE):
+        """Prepare a bank from template spectra
+
+        Parameters
+        ----------
+        templates : list of Spectrum1D
+            The templates, as returned by `ssv.utils.read_template_file`, whose meta gives the
+            name, redshift and z_start/z_end range of each template
+        grid : numpy.ndarray, optional
+            log10(wavelength / Angstrom) grid, by default `log_lambda_grid`
+        z_range : tuple, optional
+            Redshift range of templates that don't specify one
+
+        Returns
+        -------
+        TemplateBank
+        """
+        grid = log_lambda_grid() if grid is None else np.asarray(grid, dtype=float)
+        flux = np.array([
+            rebin_log(template.spectral_axis.to_value(u.AA), template.flux.value, grid)
+            for template in templates
+        ], dtype=np.float32)
+        return cls(
+            grid,
+            [template.meta.get("purpose") for template in templates],
+            [template.meta.get("redshift", 0.0) for template in templates],
+            [
+                (template.meta.get("z_start", z_range[0]), template.meta.get("z_end", z_range[1]))
+                for template in templates
+            ],
+            flux,
+            prepare_for_correlation(flux).astype(np.float32),
+        )
+
+    @classmethod
+    def from_file(cls, template_file, grid=None, z_range=DEFAULT_Z_RANGE, cache_dir=None, cache=True):
+        """Return the bank of a Marz template file, from the cache when it is up to date
+
+        Parameters
+        ----------
+        template_file : str or Path
+            The Marz template file, see `ssv.utils.read_template_file`
+        grid : numpy.ndarray, optional
+            log10(wavelength / Angstrom) grid, by default `log_lambda_grid`
+        z_range : tuple, optional
+            Redshift range of templates that don't specify one
+        cache_dir : str or Path, optional
+            Where banks are saved, by default a ``templates`` directory in
+            `ssv.cache.default_cache_dir`
+        cache : bool, optional
+            If False, always prepare the templates and don't save them
+
+        Returns
+        -------
+        TemplateBank
+            The bank, memory-mapped if it was cached
+        """
+        from .cache import default_cache_dir, file_fingerprint
+        from .utils import read_template_file
+
+        grid = log_lambda_grid() if grid is None else np.asarray(grid, dtype=float)
+        if not cache:
+            return cls.from_templates(read_template_file(template_file), grid, z_range)
+
+        fingerprint = file_fingerprint(template_file)
+        key = hashlib.sha1(json.dumps([
+            TEMPLATE_BANK_VERSION, fingerprint["path"], list(z_range),
+            [float(grid[0]), float(grid[-1]), len(grid)],
+        ]).encode("utf-8")).hexdigest()
+        path = Path(cache_dir or default_cache_dir() / TEMPLATE_BANK_DIRNAME) / key
+        try:
+            bank = cls.load(path)
+            if bank.source == fingerprint:
+                return bank
+        except (OSError, ValueError, KeyError):
+            pass
+        bank = cls.from_templates(read_template_file(template_file), grid, z_range)
+        bank.save(path, source=fingerprint)
+        return cls.load(path)
+
+    def save(self, path, source=None, with_fft=True):
+        """Save the bank to the directory `path`, replacing it atomically
+
+        Parameters
+        ----------
+        path : str or Path
+            The directory
+        source : dict, optional
+            Fingerprint of the template file, see `ssv.cache.file_fingerprint`
+        with_fft : bool, optional
+            Also save the template FFTs, so loading the bank needs no FFT at all, by default True
+        """
+        path = Path(path)
+        tmp_dir = path.with_name(f"{path.name}.tmp-{os.getpid()}-{threading.get_ident()}")
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        np.save(tmp_dir / "grid.npy", self.grid)
+        for name in TEMPLATE_BANK_ARRAYS:
+            if name != "template_fft" or with_fft:
+                np.save(tmp_dir / (name + ".npy"), np.asarray(getattr(self, name)))
+        with open(tmp_dir / TEMPLATE_BANK_INDEX, "w") as f:
+            json.dump({
+                "version": TEMPLATE_BANK_VERSION,
+                "source": source,
+                "names": self.names,
+                "template_redshifts": self.template_redshifts.tolist(),
+                "z_ranges": self.z_ranges.tolist(),
+            }, f)
+        if path.exists():
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(tmp_dir, path)
+        except OSError:
+            # another process saved the same bank first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.path = path
+        self.source = source
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a bank saved with `save`
+
+        Parameters
+        ----------
+        path : str or Path
+            The directory the bank was saved to
+
+        Returns
+        -------
+        TemplateBank
+            The bank, whose arrays are read-only memory maps
+
+        Raises
+        ------
+        ValueError
+            If the bank was saved by an incompatible version
+        """
+        path = Path(path)
+        with open(path / TEMPLATE_BANK_INDEX) as f:
+            index = json.load(f)
+        if index.get("version") != TEMPLATE_BANK_VERSION:
+            raise ValueError(f"Unsupported template bank version {index.get('version')}")
+        arrays = {
+            name: np.load(path / (name + ".npy"), mmap_mode="r")
+            for name in TEMPLATE_BANK_ARRAYS
+            if (path / (name + ".npy")).exists()
+        }
+        bank = cls(
+            np.load(path / "grid.npy"), index["names"], index["template_redshifts"],
+            index["z_ranges"], path=path, **arrays
+        )
+        bank.source = index.get("source")
+        return bank
+
+
+class CrossCorrelator:
+    """
+    Cross-correlation redshifting of spectra against a set of templates
+
+    The templates are prepared and Fourier transformed once (see
+    `TemplateBank`), so each spectrum costs one forward FFT and one inverse FFT
+    batched over the templates.
+
+    Parameters
+    ---------
+
+    templates
+        A `TemplateBank`, a list of template Spectrum1D (as returned by
+        `ssv.utils.read_template_file`), or the path of a Marz template file,
+        whose bank is cached (see `TemplateBank.from_file`)
+
+    grid
+        log10(wavelength / Angstrom) grid, see `log_lambda_grid`
+
+    z_range
+        Redshift range of templates that don't specify one
+    """
+    def __init__(self, templates, grid=None, z_range=DEFAULT_Z_RANGE):
+        if isinstance(templates, (str, os.PathLike)):
+            templates = TemplateBank.from_file(templates, grid, z_range)
+        elif not isinstance(templates, TemplateBank):
+            templates = TemplateBank.from_templates(templates, grid, z_range)
+        self.bank = templates
+        lag_ranges = self.bank.lag_ranges
+        self._allowed = (self.lags >= lag_ranges[:, :1]) & (self.lags <= lag_ranges[:, 1:])
+        # the correlation is computed as irfft(conj(spectrum) * template), which
+        # reverses the lags but uses the bank's FFTs without copying them
+        self._lag_index = -self.lags % self.n_fft
+
+    def __reduce__(self):
+        # rebuilt from the bank, which pickles as its location when saved
+        return type(self), (self.bank,)
+
+    grid = property(lambda self: self.bank.grid)
+    step = property(lambda self: self.bank.step)
+    names = property(lambda self: self.bank.names)
+    template_redshifts = property(lambda self: self.bank.template_redshifts)
+    lags = property(lambda self: self.bank.lags)
+    n_fft = property(lambda self: self.bank.n_fft)
+
+    def __str__(self):
+        return f"CrossCorrelator: {len(self.names)} templates"
+
+    def prepare(self, spectrum):
+        """Rebin and prepare a spectrum, see `prepare_for_correlation`"""
+        wavelength, flux, variance = _spectrum_arrays(spectrum)
+        rebinned = rebin_log(wavelength, flux, self.grid)
+        if variance is not None:
+            variance = rebin_log(wavelength, variance, self.grid)
+            if not np.isfinite(variance).any():
+                variance = None
+        return prepare_for_correlation(rebinned, variance)
+
+    def correlate(self, spectrum):
+        """Cross-correlate a spectrum with every template
+
+        Parameters
+        ----------
+        spectrum : Spectrum1D, SimpleSpectrum or dict
+            The spectrum; a dict holds Marz arrays (wavelength in Angstrom, intensity and
+            optionally variance)
+
+        Returns
+        -------
+        numpy.ndarray
+            Correlation of each template (rows) at each of `lags` (columns), -inf outside the
+            redshift range of the template
+        """
+        spectrum_fft = np.conj(fft.rfft(self.prepare(spectrum).astype(np.float32), self.n_fft))
+        correlation = fft.irfft(spectrum_fft * self.bank.template_fft, self.n_fft, axis=-1)
+        correlation = correlation[:, self._lag_index]
+        correlation[~self._allowed] = -np.inf
+        return correlation
+
+    def lag_to_redshift(self, lag, template):
+        """Redshift of a (fractional) lag of the template with index `template`"""
+        return 10 ** (np.asarray(lag) * self.step) * (1 + self.template_redshifts[template]) - 1
+
+    def redshift(self, spectrum, candidates=DEFAULT_CANDIDATES):
+        """Find the best redshift candidates of a spectrum
+
+        Parameters
+        ----------
+        spectrum : Spectrum1D, SimpleSpectrum or dict
+            The spectrum, see `correlate`
+        candidates : int, optional
+            Number of candidates returned
+
+        Returns
+        -------
+        list of RedshiftCandidate
+            The highest peaks of the cross-correlation over all templates, best first. Peak
+            positions are refined to a fraction of a pixel
+        """
+        correlation = self.correlate(spectrum)
+        middle = correlation[:, 1:-1]
+        with np.errstate(invalid="ignore"):
+            peaks = np.isfinite(middle) & (middle > correlation[:, :-2]) & (middle >= correlation[:, 2:])
+        templates, columns = np.nonzero(peaks)
+        columns = columns + 1
+        values = correlation[templates, columns]
+        best = np.argsort(values)[::-1][:candidates]
+
+        result = []
+        for template, column, value in zip(templates[best], columns[best], values[best]):
+            left, right = correlation[template, column - 1], correlation[template, column + 1]
+            offset = 0.0
+            if np.isfinite(left) and np.isfinite(right):
+                curvature = left - 2 * value + right
+                if curvature < 0:
+                    offset = 0.5 * (left - right) / curvature
+            z = self.lag_to_redshift(self.lags[column] + offset, template)
+            result.append(RedshiftCandidate(float(z), self.names[template], float(value)))
+        return result
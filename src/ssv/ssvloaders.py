@@ -1,9 +1,14 @@
 from copy import deepcopy
 from enum import Enum
 from astropy.io import registry
+import hashlib
 import pathlib
 import os
 import sys
+import re
+import threading
+import time
+import weakref
 
 import astropy.io.fits as fits
 from astropy.nddata import (
@@ -21,45 +26,80 @@ from specutils.io.registers import data_loader
 _unregistered_loaders = {}
 _unregistered_identifiers = {}
 _low_priority_loaders = {}
+_registry_lock = threading.RLock()
 
-def whatformat(*args, format=None, **kwargs):
+# Formats that can read almost any FITS/table file, only chosen when nothing
+# more specific identifies the file.
+GENERIC_FORMATS = ["wcs1d-fits", "tabular-fits", "iraf", "ASCII", "ECSV", "IPAC"]
+
+# Identifiers for these formats accept lists of files, and so also claim any
+# HDUList (a list subclass) they are given.
+HDULIST_FALSE_POSITIVE_FORMATS = ["JWST x1d MIRI MRS"]
+
+def whatformat(*args, format=None, cache=None, **kwargs):
     """
     Read in data.
 
-    The arguments passed to this method depend on the format.
+    The arguments passed to this method depend on the format. An already
+    open HDUList is identified in place, without reopening the file. If
+    `cache` (a `ssv.cache.FormatCache`) is given, the identified formats of
+    files on disk are looked up in, and stored to, the cache.
     """
+    if format is not None:
+        return [format]
     cls = SpectrumList
+    if cache is not None and len(args):
+        if isinstance(args[0], fits.HDUList):
+            path = args[0].filename()
+        else:
+            path = args[0]
+        if isinstance(path, (str, pathlib.Path)) and os.path.isfile(path):
+            return _whatformat_cached(cache, cls, path, args, kwargs)
+    return _prioritise_formats(_identify_formats(cls, *args, **kwargs))
+
+def _identify_formats(cls, *args, **kwargs):
+    """
+    Run the registered identifiers over the arguments, returning the formats
+    in registry order.
+    """
     formats = []
     ctx = None
     try:
-        if format is None:
-            path = None
-            fileobj = None
-
-            if len(args):
-                if isinstance(args[0], (str, pathlib.Path)) and not os.path.isdir(args[0]):
-                    from astropy.utils.data import get_readable_fileobj
-                    # path might be a pathlib.Path object
-                    if isinstance(args[0], pathlib.Path):
-                        args = (str(args[0]),) + args[1:]
-                    path = args[0]
-                    try:
-                        ctx = get_readable_fileobj(args[0], encoding='binary')
-                        fileobj = ctx.__enter__()
-                    except OSError:
-                        raise
-                    except Exception:
-                        fileobj = None
-                    else:
-                        args = [fileobj] + list(args[1:])
-                elif hasattr(args[0], 'read'):
-                    path = None
-                    fileobj = args[0]
-
-                formats = whatformat_get_valid_format(
-                    'read', cls, path, fileobj, args, kwargs)
-        else:
-            formats = [format]
+        path = None
+        fileobj = None
+
+        if len(args):
+            if isinstance(args[0], (str, pathlib.Path)) and not os.path.isdir(args[0]):
+                from astropy.utils.data import get_readable_fileobj
+                # path might be a pathlib.Path object
+                if isinstance(args[0], pathlib.Path):
+                    args = (str(args[0]),) + args[1:]
+                path = args[0]
+                try:
+                    ctx = get_readable_fileobj(args[0], encoding='binary')
+                    fileobj = ctx.__enter__()
+                except OSError:
+                    raise
+                except Exception:
+                    fileobj = None
+                else:
+                    args = [fileobj] + list(args[1:])
+            elif isinstance(args[0], fits.HDUList):
+                # identifiers use the HDUList directly, the path is only
+                # passed for those checking the file extension
+                path = args[0].filename()
+                fileobj = None
+            elif hasattr(args[0], 'read'):
+                path = None
+                fileobj = args[0]
+
+            formats = registry.identify_format(
+                'read', cls, path, fileobj, args, kwargs)
+            if isinstance(args[0], fits.HDUList):
+                formats = [
+                    format for format in formats
+                    if format not in HDULIST_FALSE_POSITIVE_FORMATS
+                ]
 
     finally:
         if ctx is not None:
@@ -67,25 +107,76 @@ def whatformat(*args, format=None, **kwargs):
 
     return formats
 
+def _identifier_signature(cls):
+    """
+    Signature of the identifiers currently registered for `cls`, used to
+    invalidate cached identifications when loaders are (un)registered.
+    """
+    formats = sorted(fmt for fmt, reg_cls in registry._identifiers if reg_cls is cls)
+    return hashlib.sha1("\n".join(formats).encode("utf-8")).hexdigest()
+
+def _whatformat_cached(cache, cls, path, args, kwargs):
+    """
+    whatformat for the file at `path`, going through `cache`
+    """
+    signature = _identifier_signature(cls)
+    valid_formats = cache.lookup(path, signature)
+    if valid_formats is None:
+        start = time.perf_counter()
+        valid_formats = _identify_formats(cls, *args, **kwargs)
+        cache.store(path, signature, valid_formats, time.perf_counter() - start)
+    return _prioritise_formats(valid_formats)
+
+def resolve_format(formats, cls=SpectrumList):
+    """
+    Pick the format to read with from the identified `formats`.
+
+    Formats marked as low priority (see `unregister`) lose to all others,
+    followed by the generic formats in `GENERIC_FORMATS`, then the reader
+    priority from the registry decides. Remaining ties go to the format that
+    comes last in `formats`, as `whatformat` puts the preferred format last.
+    Neither the registry nor any module state is changed, so this is safe to
+    call from several threads at once. Returns None if `formats` is empty.
+    """
+    def rank(indexed_format):
+        index, format = indexed_format
+        reader = registry._readers.get((format, cls))
+        # older astropy versions only store the reader function
+        priority = reader[1] if isinstance(reader, tuple) else 0
+        return (
+            format not in _low_priority_loaders,
+            format not in GENERIC_FORMATS,
+            priority,
+            index,
+        )
+
+    if not formats:
+        return None
+    return max(enumerate(formats), key=rank)[1]
+
 def unregister(format):
     """
     The unregistered format also stays the less preferred format even once its restored
+
+    This changes the global astropy registry, use `resolve_format` to choose
+    between ambiguous formats for a single read.
     """
-    _low_priority_loaders[format] = True
-    if format not in _unregistered_loaders.keys():
-        _unregistered_loaders[format] = SpectrumList
-        _unregistered_identifiers[format] = registry._identifiers[(format, SpectrumList)]
-        registry.unregister_identifier(format, SpectrumList)
+    with _registry_lock:
+        _low_priority_loaders[format] = True
+        if format not in _unregistered_loaders.keys():
+            _unregistered_loaders[format] = SpectrumList
+            _unregistered_identifiers[format] = registry._identifiers[(format, SpectrumList)]
+            registry.unregister_identifier(format, SpectrumList)
 
 def restore_registered_loaders():
     """
     Restore all unregistered formats
     """
-    for format in list(_unregistered_loaders):
-        registry.register_identifier(format, SpectrumList, _unregistered_identifiers[format])
-        _unregistered_loaders.pop(format)
-        _unregistered_identifiers.pop(format)
-    pass
+    with _registry_lock:
+        for format in list(_unregistered_loaders):
+            registry.register_identifier(format, SpectrumList, _unregistered_identifiers[format])
+            _unregistered_loaders.pop(format)
+            _unregistered_identifiers.pop(format)
 
 def whatformat_get_valid_format(mode, cls, path, fileobj, args, kwargs):
     """
@@ -94,7 +185,12 @@ def whatformat_get_valid_format(mode, cls, path, fileobj, args, kwargs):
     """
 
     valid_formats = registry.identify_format(mode, cls, path, fileobj, args, kwargs)
+    return _prioritise_formats(valid_formats)
 
+def _prioritise_formats(valid_formats):
+    """
+    Reorder `valid_formats` so the preferred format comes last.
+    """
     # A low priority loader is only intended to be used if its the only one
     reordered = []
     for format in valid_formats:
@@ -106,6 +202,207 @@ def whatformat_get_valid_format(mode, cls, path, fileobj, args, kwargs):
             reordered.append(format)
     return reordered
 
+FITS_BLOCK_SIZE = 2880
+_header_rules = {}
+# Bumped whenever a rule is registered, so that memoized identifications are not reused
+_header_rules_version = 0
+# Last file identified by header_rule_identifier, per thread, see _identify_memoized
+_header_rule_memo = threading.local()
+
+HEADER_RULE_OPERATORS = {
+    "==": lambda value, expected: value == expected,
+    "!=": lambda value, expected: value != expected,
+    "in": lambda value, expected: value in expected,
+    "contains": lambda value, expected: value is not None and expected in str(value),
+    "startswith": lambda value, expected: value is not None and str(value).startswith(expected),
+    "exists": lambda value, expected: (value is not None) == expected,
+}
+
+
+def register_header_rule(format, alternatives):
+    """
+    Register a declarative identification rule for `format`.
+
+    `alternatives` is a list of conditions, the rule matches if any one of
+    them does. A condition is a dict mapping a keyword (looked up in the
+    primary header) or a ``(hdu_index, keyword)`` pair to an
+    ``(operator, value)`` pair, and matches if every entry holds. The
+    operators are the keys of `HEADER_RULE_OPERATORS`.
+    """
+    for condition in alternatives:
+        for (operator, _) in condition.values():
+            if operator not in HEADER_RULE_OPERATORS:
+                raise ValueError(f"Unknown header rule operator {operator}")
+    global _header_rules_version
+    _header_rules[format] = list(alternatives)
+    _header_rules_version += 1
+
+
+def _header_rule_hdus(alternatives):
+    hdus = [
+        key[0] if isinstance(key, tuple) else 0
+        for condition in alternatives for key in condition
+    ]
+    return max(hdus, default=0) + 1
+
+
+def _header_data_size(header):
+    """
+    Size in bytes of the (padded) data unit following `header`.
+    """
+    naxis = header.get("NAXIS", 0)
+    if naxis == 0:
+        return 0
+    axes = [header.get("NAXIS" + str(i), 0) for i in range(1, naxis + 1)]
+    if header.get("GROUPS") and axes[0] == 0:
+        # random groups, NAXIS1 is 0 and not part of the data size
+        axes = axes[1:]
+    size = 1
+    for axis in axes:
+        size *= axis
+    size = abs(header.get("BITPIX", 8)) // 8 * header.get("GCOUNT", 1) * (
+        header.get("PCOUNT", 0) + size
+    )
+    return -(-size // FITS_BLOCK_SIZE) * FITS_BLOCK_SIZE
+
+
+def _read_headers_from_fileobj(fileobj, max_hdus):
+    start = fileobj.tell()
+    if fileobj.read(6) != b"SIMPLE":
+        # bail out early rather than scanning a non-FITS file for an END card
+        raise OSError("File does not start with a SIMPLE card")
+    fileobj.seek(start)
+    headers = []
+    while len(headers) < max_hdus:
+        try:
+            header = fits.Header.fromfile(fileobj)
+        except EOFError:
+            break
+        headers.append(header)
+        fileobj.seek(_header_data_size(header), os.SEEK_CUR)
+    return headers
+
+
+def read_headers(file_obj, max_hdus=1):
+    """
+    Read the headers of the first `max_hdus` HDUs of a FITS file.
+
+    Only the header blocks are read, data units are skipped over, so the
+    cost does not depend on the size of the data. `file_obj` can be a path,
+    an open binary file object (which is rewound afterwards) or an HDUList.
+    """
+    if isinstance(file_obj, fits.HDUList):
+        return [hdu.header for hdu in file_obj[:max_hdus]]
+    if hasattr(file_obj, "read"):
+        position = file_obj.tell()
+        try:
+            return _read_headers_from_fileobj(file_obj, max_hdus)
+        finally:
+            file_obj.seek(position)
+    from astropy.utils.data import get_readable_fileobj
+    with get_readable_fileobj(str(file_obj), encoding="binary") as fileobj:
+        return _read_headers_from_fileobj(fileobj, max_hdus)
+
+
+def _condition_matches(condition, headers):
+    for key, (operator, expected) in condition.items():
+        hdu_index, keyword = key if isinstance(key, tuple) else (0, key)
+        if hdu_index >= len(headers):
+            return False
+        value = headers[hdu_index].get(keyword)
+        try:
+            if not HEADER_RULE_OPERATORS[operator](value, expected):
+                return False
+        except TypeError:
+            return False
+    return True
+
+
+def evaluate_header_rules(headers, formats=None):
+    """
+    Return the formats whose registered header rule matches `headers`.
+
+    `formats` restricts which rules are evaluated, by default all of them.
+    """
+    if formats is None:
+        formats = list(_header_rules)
+    return [
+        format for format in formats
+        if any(_condition_matches(condition, headers) for condition in _header_rules[format])
+    ]
+
+
+def identify_with_header_rules(file_obj, formats=None):
+    """
+    Identify `file_obj` against every registered header rule in one pass.
+
+    The headers needed by all the rules are read once, see `read_headers`.
+    Returns an empty list if the file is not a readable FITS file.
+    """
+    if formats is None:
+        formats = list(_header_rules)
+    if not formats:
+        return []
+    max_hdus = max(_header_rule_hdus(_header_rules[format]) for format in formats)
+    try:
+        headers = read_headers(file_obj, max_hdus=max_hdus)
+    except (OSError, ValueError):
+        return []
+    return evaluate_header_rules(headers, formats)
+
+
+def _header_rule_memo_key(file_obj):
+    rules = (id(_header_rules), _header_rules_version)
+    if isinstance(file_obj, fits.HDUList):
+        return rules + (weakref.ref(file_obj),)
+    if hasattr(file_obj, "read"):
+        return rules + (weakref.ref(file_obj), file_obj.tell())
+    stat = os.stat(file_obj)
+    return rules + (os.fspath(file_obj), stat.st_mtime_ns, stat.st_size)
+
+
+def _identify_memoized(file_obj):
+    """
+    `identify_with_header_rules` for all the registered rules, reusing the
+    result for the file most recently identified on this thread.
+
+    The registry calls the identifier of every format in turn with the same
+    file, so the headers are read once for all the header rule formats.
+    """
+    try:
+        key = _header_rule_memo_key(file_obj)
+    except (OSError, TypeError, ValueError):
+        return identify_with_header_rules(file_obj)
+    memo = getattr(_header_rule_memo, "last", None)
+    if memo is not None and memo[0] == key:
+        return memo[1]
+    formats = identify_with_header_rules(file_obj)
+    _header_rule_memo.last = (key, formats)
+    return formats
+
+
+def header_rule_identifier(format):
+    """
+    Return an astropy registry identifier evaluating the header rule of
+    `format`. It uses the HDUList or file object handed over by the
+    registry when there is one, and only opens the path otherwise. All the
+    registered rules are evaluated on the first call for a file and the
+    result is shared by the identifiers of the other formats, so
+    identifying a file through the registry reads its headers once.
+    """
+    def identifier(origin, *args, **kwargs):
+        if len(args) > 2 and isinstance(args[2], fits.HDUList):
+            file_obj = args[2]
+        elif len(args) > 1 and args[1] is not None:
+            file_obj = args[1]
+        elif args and args[0] is not None:
+            file_obj = args[0]
+        else:
+            return False
+        return format in _identify_memoized(file_obj)
+    return identifier
+
+
 HEADER_PUPOSE_KEYWORDS = ["EXTNAME", "HDUNAME"]
 HEADER_INDEX_PUPOSE_KEYWORDS = ["ROW", "ARRAY"]
 FITS_FILE_EXTS = ["fit", "fits", "fts"]
@@ -318,6 +615,187 @@ def get_flux_units_from_keys_and_values(
     return flux_scale * flux_unit
 
 
+
+def _dc_flux_units(
+    header,
+    *,
+    flux_unit_keyword="BUNIT",
+    flux_unit=None,
+    flux_scale_keyword="BSCALE",
+    flux_scale=None,
+):
+    # specutils' Data Central flux units, which the loaders overriding its Data Central formats
+    # keep: BUNIT and BSCALE by default, and the header takes precedence over configured values
+    if flux_unit is None and flux_unit_keyword is None:
+        raise ValueError(
+            "Either flux_unit or flux_unit_keyword must be provided"
+        )
+    flux_unit_from_header = header.get(flux_unit_keyword)
+    if flux_unit is None and flux_unit_from_header is None:
+        raise ValueError(
+            "No units found for flux, check flux_unit and flux_unit_keyword"
+        )
+    flux_unit = u.Unit(flux_unit_from_header or flux_unit)
+
+    flux_scale_from_header = header.get(flux_scale_keyword)
+    if flux_scale is None and flux_scale_from_header is None:
+        flux_scale = 1
+    else:
+        flux_scale = flux_scale_from_header or flux_scale
+    return flux_scale * flux_unit
+
+class LazySpectrum:
+    """
+    Stand-in for a spectrum in a spectra_map, created by
+    `add_single_spectra_to_map` with ``lazy=True``.
+
+    The header, purpose and label are available straight away, while the
+    (possibly memory-mapped) data is only wrapped in a unit-bearing
+    Spectrum1D, and the WCS only built, when the spectrum is first used.
+    Attributes not found on the LazySpectrum are looked up on the loaded
+    Spectrum1D.
+    """
+    def __init__(self, *, data, flux_unit, make_wcs, meta):
+        self.data = data
+        self.flux_unit = flux_unit
+        self.meta = meta
+        self._make_wcs = make_wcs
+        self._uncertainty = None
+        self._spectrum = None
+
+    def set_uncertainty(self, uncertainty_class, *, data, flux_unit, make_wcs):
+        """
+        Attach the data of an error HDU, aligned to the spectrum when loaded.
+        """
+        self._uncertainty = (uncertainty_class, data, flux_unit, make_wcs)
+
+    @property
+    def is_loaded(self):
+        return self._spectrum is not None
+
+    def load(self):
+        """
+        Build (once) and return the Spectrum1D.
+        """
+        if self._spectrum is None:
+            wcs = self._make_wcs()
+            flux = u.Quantity(self.data, self.flux_unit, copy=False)
+            spectrum = Spectrum1D(wcs=wcs, flux=flux, meta=self.meta)
+            if self._uncertainty is not None:
+                uncertainty_class, data, flux_unit, make_wcs = self._uncertainty
+                aligned_flux = _align_to_wcs(
+                    u.Quantity(data, flux_unit, copy=False), make_wcs(), wcs
+                )
+                spectrum.uncertainty = uncertainty_class(aligned_flux)
+            self._spectrum = spectrum
+        return self._spectrum
+
+    @property
+    def spectrum(self):
+        return self.load()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+
+def load_lazy_spectra(spectra):
+    """
+    Return `spectra` with any LazySpectrum replaced by its Spectrum1D.
+    """
+    return [
+        spectrum.load() if isinstance(spectrum, LazySpectrum) else spectrum
+        for spectrum in spectra
+    ]
+
+
+# Header keywords that WCS(header) may read for a spectrum; HDUs agreeing on
+# all of them share a WCS
+WCS_KEYWORD_PATTERN = re.compile(
+    r"^(WCSAXES|NAXIS|CRPIX|CRVAL|CDELT|CUNIT|CTYPE|CROTA|CD\d|PC\d|PV\d|PS\d|"
+    r"CNAME|CRDER|CSYER|LONPOLE|LATPOLE|EQUINOX|EPOCH|RADESYS|RADECSYS|MJD|"
+    r"DATE-OBS|SPECSYS|SSYS|VELOSYS|ZSOURCE|RESTFR|RESTWAV|OBSGEO|DC-FLAG|"
+    r"WAT\d|LTV|LTM|DISPAXIS|WCSNAME|WCSDIM)"
+)
+
+
+def _wcs_key(header, spec_wcs_info, valid_wcs):
+    if valid_wcs or not spec_wcs_info:
+        return ("header", tuple(
+            (keyword, str(value)) for keyword, value in header.items()
+            if WCS_KEYWORD_PATTERN.match(keyword)
+        ))
+    info = tuple(sorted(spec_wcs_info.items()))
+    keywords = [
+        value for name, value in info
+        if name.endswith("_keyword") and value is not None
+    ] + ["CDELT1"]
+    return ("keys", info, tuple(
+        (keyword, str(header.get(keyword))) for keyword in keywords
+    ))
+
+
+def refresh_units(wcs):
+    """
+    Reparse unit strings to ensure aliases have been applied.
+
+    This is needed to handle legacy spellings that are used by existing surveys.
+    """
+    wcs.wcs.cunit = [u.Unit(str(cunit)) for cunit in wcs.wcs.cunit]
+    return wcs
+
+
+def _build_wcs(header, spec_wcs_info, valid_wcs, drop_wcs_axes, wcs_cache):
+    if wcs_cache is not None:
+        key = _wcs_key(header, spec_wcs_info, valid_wcs) + (drop_wcs_axes,)
+        wcs = wcs_cache.get(key)
+        if wcs is not None:
+            return wcs
+    if valid_wcs or not spec_wcs_info:
+        wcs = WCS(header)
+        if drop_wcs_axes is not None:
+            if callable(drop_wcs_axes):
+                wcs = drop_wcs_axes(wcs)
+            else:
+                wcs = wcs.dropaxis(drop_wcs_axes)
+    else:
+        wcs = compute_wcs_from_keys_and_values(header, **spec_wcs_info)
+    wcs = refresh_units(wcs)
+    if wcs_cache is not None:
+        wcs_cache[key] = wcs
+    return wcs
+
+
+def _wcs_from_header(header, spec_wcs_info, valid_wcs, wcs_cache=None,
+                     drop_wcs_axes=None, fallback_header=None):
+    """
+    Build the WCS of an HDU, reusing the one in `wcs_cache` built from the
+    same WCS keywords if there is one. If the header has no usable WCS, it
+    is built from `fallback_header` when given.
+    """
+    try:
+        return _build_wcs(header, spec_wcs_info, valid_wcs, drop_wcs_axes, wcs_cache)
+    except (ValueError, KeyError):
+        if fallback_header is None:
+            raise
+    return _build_wcs(fallback_header, spec_wcs_info, valid_wcs, drop_wcs_axes, wcs_cache)
+
+
+def _align_to_wcs(flux, wcs, target_wcs):
+    """
+    Align `flux` on `wcs` to `target_wcs`, passing its values through
+    unchanged when the two are the same WCS. Like pixel_to_pixel, the result
+    has no unit.
+    """
+    if wcs is target_wcs or (
+        isinstance(wcs, WCS) and isinstance(target_wcs, WCS)
+        and wcs.wcs.compare(target_wcs.wcs)
+    ):
+        return u.Quantity(flux, copy=False).value
+    return pixel_to_pixel(wcs, target_wcs, flux)
+
+
 def add_single_spectra_to_map(
     spectra_map,
     *,
@@ -331,7 +809,27 @@ def add_single_spectra_to_map(
     all_keywords,
     valid_wcs,
     index=None,
+    drop_wcs_axes=None,
+    fallback_header=None,
+    lazy=False,
+    wcs_cache=None,
 ):
+    """
+    Add the spectrum (or uncertainty) in `header`/`data` to `spectra_map`.
+
+    `drop_wcs_axes` (an axis, or a function of the WCS) is removed from a
+    WCS read from the header, and `fallback_header` is used for the purpose,
+    WCS and units when `header` lacks them, as in the specutils Data Central
+    loaders.
+
+    With `lazy`, a LazySpectrum keeping a reference to `data` is added
+    instead of a Spectrum1D, so memory-mapped data is not copied until the
+    spectrum is used.
+
+    Passing the same dict as `wcs_cache` for every HDU of a file builds the
+    WCS only once per unique set of WCS keywords; uncertainties whose WCS is
+    the same as the spectrum's are then attached without realignment.
+    """
     spec_wcs_info = {}
     spec_units_info = {}
     if wcs_info is not None:
@@ -346,29 +844,66 @@ def add_single_spectra_to_map(
     else:
         purpose = None
 
-    purpose = get_purpose(
-        header,
-        purpose=purpose,
-        purpose_prefix=purpose_prefix,
-        all_keywords=all_keywords,
-        index=index,
-    )
+    try:
+        purpose = get_purpose(
+            header,
+            purpose=purpose,
+            purpose_prefix=purpose_prefix,
+            all_keywords=all_keywords,
+            index=index,
+        )
+    except ValueError:
+        if fallback_header is None:
+            raise
+        purpose = get_purpose(
+            fallback_header,
+            purpose=purpose,
+            purpose_prefix=purpose_prefix,
+            all_keywords=all_keywords,
+            index=index,
+        )
 
     if purpose == Purpose.SKIP:
         return None
 
-    if valid_wcs or not spec_wcs_info:
-        wcs = WCS(header)
-    else:
-        wcs = compute_wcs_from_keys_and_values(header, **spec_wcs_info)
-
     if all_standard_units:
-        spec_units_info = {"flux_unit_keyword": "BUNIT"}
-    flux_unit = get_flux_units_from_keys_and_values(header, **spec_units_info)
-    flux = data * flux_unit
+        spec_units_info = {}
+    try:
+        flux_unit = _dc_flux_units(header, **spec_units_info)
+    except ValueError:
+        if fallback_header is None:
+            raise
+        flux_unit = _dc_flux_units(fallback_header, **spec_units_info)
 
     meta = {"header": header, "purpose": PURPOSE_SPECTRA_MAP[purpose]}
 
+    def make_wcs():
+        return _wcs_from_header(
+            header, spec_wcs_info, valid_wcs, wcs_cache,
+            drop_wcs_axes=drop_wcs_axes, fallback_header=fallback_header,
+        )
+
+    if lazy:
+
+        if purpose in CREATE_SPECTRA:
+            spectra_map[PURPOSE_SPECTRA_MAP[purpose]].append(LazySpectrum(
+                data=data, flux_unit=flux_unit, make_wcs=make_wcs, meta=meta,
+            ))
+        elif purpose in ERROR_PURPOSES:
+            try:
+                spectrum = spectra_map[PURPOSE_SPECTRA_MAP[purpose]][-1]
+            except IndexError:
+                raise ValueError(f"No spectra to associate with {purpose}")
+            spectrum.set_uncertainty(
+                UNCERTAINTY_MAP[purpose], data=data, flux_unit=flux_unit,
+                make_wcs=make_wcs,
+            )
+            spectrum.meta["uncertainty_header"] = header
+        return None
+
+    wcs = make_wcs()
+    flux = data * flux_unit
+
     if purpose in CREATE_SPECTRA:
         spectrum = Spectrum1D(wcs=wcs, flux=flux, meta=meta)
         spectra_map[PURPOSE_SPECTRA_MAP[purpose]].append(spectrum)
@@ -377,7 +912,7 @@ def add_single_spectra_to_map(
             spectrum = spectra_map[PURPOSE_SPECTRA_MAP[purpose]][-1]
         except IndexError:
             raise ValueError(f"No spectra to associate with {purpose}")
-        aligned_flux = pixel_to_pixel(wcs, spectrum.wcs, flux)
+        aligned_flux = _align_to_wcs(flux, wcs, spectrum.wcs)
         spectrum.uncertainty = UNCERTAINTY_MAP[purpose](aligned_flux)
         spectrum.meta["uncertainty_header"] = header
 
@@ -432,3 +967,230 @@ def get_purpose(
 
 def no_auto_identify(*args, **kwargs):
     return False
+
+
+# Options of the current read_spectra_file call on this thread, see read_options
+_read_options = threading.local()
+
+
+class read_options:
+    """
+    Context manager setting how the Data Central loaders below build spectra
+    for reads made inside it on this thread.
+
+    With `lazy`, the loaders return LazySpectrum stand-ins (see
+    `add_single_spectra_to_map`). `wcs_cache` is a dict shared by every file
+    read, so files with the same WCS keywords share one WCS; without it,
+    each file gets its own cache shared by its HDUs.
+    """
+    def __init__(self, *, lazy=False, wcs_cache=None):
+        self.options = {"lazy": lazy, "wcs_cache": wcs_cache}
+
+    def __enter__(self):
+        self._previous = getattr(_read_options, "options", None)
+        _read_options.options = self.options
+        return self
+
+    def __exit__(self, *exc_info):
+        _read_options.options = self._previous
+        return False
+
+
+def _current_read_options():
+    options = getattr(_read_options, "options", None) or {}
+    wcs_cache = options.get("wcs_cache")
+    return options.get("lazy", False), {} if wcs_cache is None else wcs_cache
+
+
+def _new_spectra_map():
+    return {
+        "sky": [],
+        "combined": [],
+        "unreduced": [],
+        "normalised": [],
+        "reduced": [],
+    }
+
+
+def _spectra_map_to_list(spectra_map, label):
+    if label:
+        add_labels(spectra_map["combined"])
+        add_labels(spectra_map["reduced"])
+        add_labels(spectra_map["normalised"])
+        add_labels(spectra_map["unreduced"], use_purpose=True)
+        add_labels(spectra_map["sky"], use_purpose=True)
+
+    return SpectrumList(
+        spectra_map["combined"] +
+        spectra_map["normalised"] +
+        spectra_map["reduced"] +
+        spectra_map["unreduced"] +
+        spectra_map["sky"]
+    )
+
+
+@data_loader(
+    label=SINGLE_SPLIT_LABEL, extensions=FITS_FILE_EXTS, dtype=SpectrumList,
+    identifier=no_auto_identify, force=True,
+)
+def load_single_split_file(
+    filename,
+    *,
+    hdus,
+    wcs,
+    units,
+    all_standard_units,
+    all_keywords,
+    valid_wcs,
+    label=True,
+    drop_wcs_axes=None,
+    fallback_header=None,
+):
+    """
+    The specutils Data Central Single-Split loader (used by the OzDES, GAMA,
+    GALAH, 2dF, ... loaders), building the spectra with
+    `add_single_spectra_to_map` so that the WCS is built once per set of
+    WCS keywords, and spectra can be lazy, see `read_options`.
+    """
+    from .utils import read_fileobj_or_hdulist
+
+    lazy, wcs_cache = _current_read_options()
+    spectra_map = _new_spectra_map()
+
+    with read_fileobj_or_hdulist(filename) as fits_file:
+        if fallback_header is not None:
+            if fallback_header is True:
+                fallback_header = 0
+            fallback_header = fits_file[fallback_header].header
+
+        hdus = deepcopy(hdus)
+        if hdus is not None:
+            # extract hdu information and validate it
+            cycle = hdus.pop("cycle", None)
+            cycle_start = hdus.pop("cycle_start", None)
+            purpose_prefix = hdus.pop("purpose_prefix", None)
+            if len(hdus) != 0 and cycle is None:
+                if len(hdus) < len(fits_file):
+                    raise ValueError("Not all HDUs have been specified")
+                if len(hdus) > len(fits_file):
+                    raise ValueError("Too many HDUs have been specified")
+            if cycle is not None and cycle_start is None:
+                if len(hdus) == 0:
+                    raise ValueError(
+                        "If HDUs are not specified, cycle_start must be used"
+                    )
+                cycle_start = len(hdus)
+            if cycle is not None:
+                cycle_purpose_prefix = cycle.pop("purpose_prefix", None)
+                cycle_length = len(cycle)
+
+                # validate cycle
+                if (len(fits_file) - cycle_start) % cycle_length != 0:
+                    raise ValueError(
+                        "Full cycle cannot be read from fits file"
+                    )
+        else:
+            cycle = None
+            cycle_start = 0
+            purpose_prefix = None
+            cycle_purpose_prefix = None
+            cycle_length = 0
+
+        for i, fits_hdu in enumerate(fits_file):
+            if cycle is not None and i >= cycle_start:
+                hdu_info = cycle.get(str((i - cycle_start) % cycle_length))
+                hdu_purpose_prefix = cycle_purpose_prefix
+            elif hdus is not None:
+                hdu_info = hdus.get(str(i))
+                hdu_purpose_prefix = purpose_prefix
+            else:
+                hdu_info = None
+                hdu_purpose_prefix = None
+
+            add_single_spectra_to_map(
+                spectra_map,
+                data=fits_hdu.data,
+                header=fits_hdu.header,
+                spec_info=hdu_info,
+                wcs_info=wcs,
+                units_info=units,
+                purpose_prefix=hdu_purpose_prefix,
+                all_standard_units=all_standard_units,
+                all_keywords=all_keywords,
+                valid_wcs=valid_wcs,
+                drop_wcs_axes=drop_wcs_axes,
+                fallback_header=fallback_header,
+                lazy=lazy,
+                wcs_cache=wcs_cache,
+            )
+
+    return _spectra_map_to_list(spectra_map, label)
+
+
+@data_loader(
+    label=MULTILINE_SINGLE_LABEL, extensions=FITS_FILE_EXTS,
+    dtype=SpectrumList, identifier=no_auto_identify, force=True,
+)
+def load_multiline_single_file(
+    filename,
+    *,
+    hdu,
+    wcs,
+    units,
+    all_standard_units,
+    all_keywords,
+    valid_wcs,
+    label=True,
+    drop_wcs_axes=1,
+):
+    """
+    The specutils Data Central Multiline-Single loader, building the spectra
+    with `add_single_spectra_to_map`, see `load_single_split_file`.
+    """
+    from .utils import read_fileobj_or_hdulist
+
+    lazy, wcs_cache = _current_read_options()
+    spectra_map = _new_spectra_map()
+
+    with read_fileobj_or_hdulist(filename) as fits_file:
+        fits_header = fits_file[0].header
+        fits_data = fits_file[0].data
+        hdu = deepcopy(hdu)
+        if hdu is not None:
+            # extract hdu information and validate it
+            if hdu.pop("require_transpose", False):
+                fits_data = fits_data.T
+            purpose_prefix = hdu.pop("purpose_prefix", None)
+            num_rows = fits_data.shape[0]
+            if len(hdu) != 0:
+                if len(hdu) < num_rows:
+                    raise ValueError("Not all rows have been specified")
+                if len(hdu) > num_rows:
+                    raise ValueError("Too many rows have been specified")
+        else:
+            purpose_prefix = None
+
+        for i, row in enumerate(fits_data, start=1):
+            if hdu is not None:
+                row_info = hdu.get(str(i))
+            else:
+                row_info = None
+
+            add_single_spectra_to_map(
+                spectra_map,
+                header=fits_header,
+                data=row,
+                index=i,
+                spec_info=row_info,
+                wcs_info=wcs,
+                units_info=units,
+                purpose_prefix=purpose_prefix,
+                all_standard_units=all_standard_units,
+                all_keywords=all_keywords,
+                valid_wcs=valid_wcs,
+                drop_wcs_axes=drop_wcs_axes,
+                lazy=lazy,
+                wcs_cache=wcs_cache,
+            )
+
+    return _spectra_map_to_list(spectra_map, label)
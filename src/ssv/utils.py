@@ -7,6 +7,8 @@ from specutils.manipulation import snr_threshold, box_smooth, gaussian_smooth, t
 import astropy.units as u
 from astropy.io import fits, registry
 from pathlib import Path
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 import json, os
 import ssv
 
@@ -57,6 +59,9 @@ except:
                     hdulist.close()
 #END temporary until specutils releases read_fileobj_or_hdulist
 
+# Fields of a Marz template kept in the meta of the spectra read by read_template_file
+TEMPLATE_META_KEYS = ['id', 'redshift', 'z_start', 'z_end', 'isStar']
+
 # From SO post https://stackoverflow.com/a/39130019
 # Allows applying multiple functions in sequence to data
 def id(x):
@@ -258,6 +263,16 @@ def toMarzJSON(spectrum):
         If SimpleSpectrum does not have a 'reduced' trace
     """    
     
+    arrays = _marz_arrays(spectrum)
+    return {
+        key: np.where(np.isnan(values), None, values).tolist() if key != "wavelength"
+        else values.tolist()
+        for key, values in arrays.items()
+    }
+
+def _marz_arrays(spectrum):
+    """Float arrays of the wavelength (in Angstrom), intensity, sky and variance of a SimpleSpectrum,
+    as used by `toMarzJSON`"""
     keys = spectrum.spectra.keys()
     reduced_keyword = 'reduced'
     sky_keyword = 'sky'
@@ -271,42 +286,134 @@ def toMarzJSON(spectrum):
 
     if reduced_keyword in keys:
         wavelength = spectrum.spectra[reduced_keyword].object.data.spectral_axis.to(u.Unit('Angstrom'))
-        wavelength = np.array(wavelength, copy=False)
-        reduced = np.array(spectrum.spectra[reduced_keyword].object.data.flux, copy=False)
+        wavelength = np.asarray(wavelength)
+        reduced = np.asarray(spectrum.spectra[reduced_keyword].object.data.flux)
     else:
         raise KeyError(f'{reduced_keyword} is not present in the SimpleSpectrum')
 
     if sky_keyword in keys:
-        sky = np.array(spectrum.spectra['sky'].object.data.flux, copy=False)
+        sky = np.asarray(spectrum.spectra['sky'].object.data.flux)
     else:
-        sky = np.full(wavelength.size, None, wavelength.dtype)
+        sky = np.full(wavelength.size, np.nan, wavelength.dtype)
 
-    variance = spectrum.spectra[reduced_keyword].object.data.uncertainty.array
-    reduced = np.where(np.isnan(reduced), None, reduced)
-    sky = np.where(np.isnan(sky), None, sky)
-    variance = np.where(np.isnan(variance), None, variance)
+    variance = np.asarray(spectrum.spectra[reduced_keyword].object.data.uncertainty.array)
 
     return {
-        "wavelength": wavelength.tolist(),
-        "intensity": reduced.tolist(),
-        "sky": sky.tolist(),
-        "variance": variance.tolist()
+        "wavelength": wavelength,
+        "intensity": reduced,
+        "sky": sky,
+        "variance": variance
     }
 
+def _json_float_array(values, precision=None):
+    """Format a float array as a JSON array, with null for NaN and other non-finite values"""
+    values = np.asarray(values).ravel()
+    if not np.issubdtype(values.dtype, np.floating):
+        values = values.astype(float)
+    if precision is None and values.dtype.itemsize > 4:
+        # repr gives the shortest round-tripping representation, as json does
+        items = list(map(float.__repr__, values.tolist()))
+    else:
+        # 9 significant digits are enough to read back single precision data exactly
+        fmt = "%.{}g".format(9 if precision is None else int(precision))
+        items = list(map(fmt.__mod__, values.tolist()))
+    for index in np.flatnonzero(~np.isfinite(values)).tolist():
+        items[index] = "null"
+    return "[" + ",".join(items) + "]"
+
+def dumpMarzJSON(spectrum, precision=None):
+    """Serialise a spectrum to a compact Marz readable JSON string
+
+    Equivalent to ``json.dumps(toMarzJSON(spectrum))``, but written straight from the float arrays
+    rather than through a list of Python objects per pixel, and with null for infinite values as
+    well as NaN, as JSON has no representation for them.
+
+    Parameters
+    ----------
+    spectrum : SimpleSpectrum or dict
+        Input spectrum, or a dict of arrays keyed by wavelength, intensity, sky and variance
+        (such as the output of `toMarzJSON`)
+    precision : int, optional
+        Number of significant digits of the values, by default enough to read back the values
+        exactly (9 for single precision data)
+
+    Returns
+    -------
+    str
+        The JSON document, without indentation
+
+    Raises
+    ------
+    KeyError
+        If SimpleSpectrum does not have a 'reduced' trace
+    """
+    arrays = spectrum if isinstance(spectrum, dict) else _marz_arrays(spectrum)
+    return "{" + ",".join(
+        json.dumps(key) + ":" + _json_float_array(
+            np.array(values, dtype=float) if isinstance(values, list) else values, precision
+        )
+        for key, values in arrays.items()
+    ) + "}"
+
+def writeMarzJSON(spectra, file, precision=None, json_lines=False):
+    """Stream Marz readable JSON for many spectra to a file or pipe
+
+    Only one spectrum is serialised at a time, so the whole document is never held in memory.
+
+    Parameters
+    ----------
+    spectra : iterable
+        SimpleSpectrum objects (or dicts of arrays, see `dumpMarzJSON`), consumed lazily
+    file : str, Path or file-like
+        Destination; file objects (e.g. a subprocess stdin) are written to and left open
+    precision : int, optional
+        Number of significant digits of the values, see `dumpMarzJSON`
+    json_lines : bool, optional
+        If True, write one JSON document per line instead of a single JSON array, by default False
+
+    Returns
+    -------
+    int
+        The number of spectra written
+    """
+    if isinstance(file, (str, Path)):
+        with open(file, "w") as f:
+            return writeMarzJSON(spectra, f, precision=precision, json_lines=json_lines)
+
+    count = 0
+    if not json_lines:
+        file.write("[")
+    for spectrum in spectra:
+        if count and not json_lines:
+            file.write(",")
+        file.write(dumpMarzJSON(spectrum, precision=precision))
+        if json_lines:
+            file.write("\n")
+        count += 1
+    if not json_lines:
+        file.write("]")
+    return count
+
+def _marz_float_array(values):
+    """Float array of a Marz JSON list (None becomes NaN), without copying arrays that are already float"""
+    if isinstance(values, np.ndarray) and np.issubdtype(values.dtype, np.floating):
+        return values
+    return np.asarray(values, dtype=float)
+
 def fromMarzJSON(json_spectrum):
     from astropy.nddata import (
         VarianceUncertainty, StdDevUncertainty, InverseVariance,
     )
-    wavelength = Quantity(json_spectrum["wavelength"], u.Angstrom)
+    wavelength = Quantity(_marz_float_array(json_spectrum["wavelength"]), u.Angstrom, copy=False)
     
     spectrum = SpectrumList()
     uncertainty = None
     if "variance" in json_spectrum.keys():
-        uncertainty = StdDevUncertainty(Quantity(np.array(json_spectrum["variance"], dtype=np.float)))
+        uncertainty = StdDevUncertainty(Quantity(_marz_float_array(json_spectrum["variance"]), copy=False), copy=False)
     
     for key in json_spectrum.keys():
         if key != 'wavelength' and key != 'variance':
-            flux = Quantity(np.array(json_spectrum[key], dtype=np.float))
+            flux = Quantity(_marz_float_array(json_spectrum[key]), copy=False)
             if key == 'intensity' and uncertainty:
                 aspectrum = Spectrum1D(flux=flux, spectral_axis=wavelength, uncertainty=uncertainty, mask=np.isnan(flux), meta={'purpose': 'reduced'})
             else:
@@ -342,7 +449,8 @@ def format_from_hdulist(hdulist, *args, **kwargs):
     formats = registry.identify_format('read', SpectrumList, None, None, [hdulist], kwargs)
     return formats[-1] if formats else None # We only want one format
 
-def read_spectra_file(data_or_file, format=None, config_dict=None):
+def read_spectra_file(data_or_file, format=None, config_dict=None, format_cache=None, open_once=False,
+                      spectra_cache=None, lazy=False, wcs_cache=None, corrector=None):
     """Read a FITS file of a spectrum into a SpectrumList
 
     Parameters
@@ -353,6 +461,27 @@ def read_spectra_file(data_or_file, format=None, config_dict=None):
         The format of the FITS file, by default None
     config_dict : dict, optional
         Used to specify the format of the FITS file, if the format string doesn't work, by default None
+    format_cache : ssv.cache.FormatCache, optional
+        Cache of previously identified formats, used when the format is not given, by default None
+    open_once : bool, optional
+        If True, a FITS file given by path is opened once (memory-mapped where possible) and the
+        same HDUList is used to identify the format and to load the spectra, by default False
+    spectra_cache : ssv.cache.SpectraCache, optional
+        Columnar cache of parsed spectra. Files given by path are loaded from the cache when the
+        source is unchanged, and written to it otherwise, by default None
+    lazy : bool, optional
+        If True, formats read with the Data Central loaders return `ssv.ssvloaders.LazySpectrum`
+        stand-ins, which only wrap the (memory-mapped) data in a Spectrum1D when first used,
+        by default False
+    wcs_cache : dict, optional
+        Shared by the Data Central loaders across reads, so that files with the same WCS keywords
+        share one WCS, by default each file has its own
+    corrector : ssv.corrections.SpectralAxisCorrector, optional
+        If given, the spectral axes are converted to vacuum and to the frame requested by the
+        ``VACUUM``, ``DO_HELIO`` and ``DO_CMB`` keywords of their (Marz-style) headers, see
+        `ssv.corrections.SpectralAxisCorrector.correct_spectra`, before they are displayed or
+        redshifted. Only for files using these keywords, as a header without ``VACUUM`` is read
+        as air wavelengths. By default the spectral axes are returned as read
 
     Returns
     -------
@@ -361,7 +490,38 @@ def read_spectra_file(data_or_file, format=None, config_dict=None):
     """
     if data_or_file is None:
         return None
-    
+
+    if corrector is not None:
+        spectra = read_spectra_file(data_or_file, format=format, config_dict=config_dict,
+                                    format_cache=format_cache, open_once=open_once,
+                                    spectra_cache=spectra_cache, lazy=lazy, wcs_cache=wcs_cache)
+        return corrector.correct_spectra(spectra)
+
+    if lazy or wcs_cache is not None:
+        with ssv.ssvloaders.read_options(lazy=lazy, wcs_cache=wcs_cache):
+            return read_spectra_file(data_or_file, format=format, config_dict=config_dict,
+                                     format_cache=format_cache, open_once=open_once,
+                                     spectra_cache=spectra_cache)
+
+    if spectra_cache is not None and isinstance(data_or_file, (str, Path)) and os.path.isfile(data_or_file):
+        spectra = spectra_cache.load(data_or_file)
+        if spectra is None:
+            spectra = read_spectra_file(data_or_file, format=format, config_dict=config_dict,
+                                        format_cache=format_cache, open_once=open_once)
+            spectra_cache.store(data_or_file, spectra)
+        return spectra
+
+    if open_once and isinstance(data_or_file, (str, Path)) and os.path.isfile(data_or_file):
+        try:
+            # astropy memory-maps the data where it can (scaled images are read instead)
+            hdulist = fits.open(data_or_file)
+        except OSError:
+            # Not a FITS file (e.g. Marz JSON), let the loaders open it
+            hdulist = None
+        if hdulist is not None:
+            with hdulist:
+                return read_spectra_file(hdulist, format=format, config_dict=config_dict, format_cache=format_cache)
+
     if format:
         return SpectrumList.read(
             data_or_file,
@@ -373,17 +533,143 @@ def read_spectra_file(data_or_file, format=None, config_dict=None):
             **config_dict
         )
     else:
-        # Try to resolve ambiguous loaders
-        formats = ssv.ssvloaders.whatformat(data_or_file)
-        if len(formats) > 1:
-            for i in range(len(formats)-1):
-                ssv.ssvloaders.unregister(formats[i])
-        spectra = SpectrumList.read(
+        # Resolve ambiguous loaders for this read only, leaving the registry untouched
+        formats = ssv.ssvloaders.whatformat(data_or_file, cache=format_cache)
+        return SpectrumList.read(
             data_or_file,
-            format=formats[-1]
+            format=ssv.ssvloaders.resolve_format(formats)
         )
-        ssv.ssvloaders.restore_registered_loaders()
-        return spectra
+
+LoadResult = namedtuple("LoadResult", ["path", "spectra", "error"])
+LoadResult.__doc__ = """Result of loading one file with read_spectra_files
+
+path is the input as given, spectra the SpectrumList (None on failure) and
+error the exception raised while loading (None on success)."""
+
+
+def spectrum_to_arrays(spectrum):
+    """Split a spectrum into plain arrays, e.g. to pickle or cache it
+
+    Spectra built on a lookup-table WCS can't be pickled, so the spectral axis is stored as values
+    instead of the WCS.
+
+    Parameters
+    ----------
+    spectrum : specutils.Spectrum1D
+        Spectrum to split
+
+    Returns
+    -------
+    dict
+        The spectral axis, flux, uncertainty (array and class name), mask and meta of the spectrum
+    """
+    uncertainty = spectrum.uncertainty
+    return {
+        "spectral_axis": spectrum.spectral_axis.value,
+        "spectral_axis_unit": spectrum.spectral_axis.unit.to_string(),
+        "flux": spectrum.flux.value,
+        "flux_unit": spectrum.flux.unit.to_string(),
+        "uncertainty": None if uncertainty is None else uncertainty.array,
+        "uncertainty_type": None if uncertainty is None else type(uncertainty).__name__,
+        "mask": spectrum.mask,
+        "meta": dict(spectrum.meta),
+    }
+
+def spectrum_from_arrays(arrays):
+    """Rebuild a spectrum split by `spectrum_to_arrays`
+
+    Parameters
+    ----------
+    arrays : dict
+        As returned by `spectrum_to_arrays`
+
+    Returns
+    -------
+    specutils.Spectrum1D
+        The rebuilt spectrum
+    """
+    from astropy import nddata
+    uncertainty = None
+    if arrays["uncertainty"] is not None:
+        uncertainty = getattr(nddata, arrays["uncertainty_type"])(arrays["uncertainty"])
+    return Spectrum1D(
+        spectral_axis=Quantity(arrays["spectral_axis"], arrays["spectral_axis_unit"], copy=False),
+        flux=Quantity(arrays["flux"], arrays["flux_unit"], copy=False),
+        uncertainty=uncertainty,
+        mask=arrays["mask"],
+        meta=arrays["meta"],
+    )
+
+def _load_result(data_or_file, read_kwargs, as_arrays=False):
+    try:
+        spectra = read_spectra_file(data_or_file, **read_kwargs)
+        if as_arrays:
+            spectra = [spectrum_to_arrays(spectrum) for spectrum in spectra]
+        return LoadResult(data_or_file, spectra, None)
+    except Exception as error:
+        return LoadResult(data_or_file, None, error)
+
+def read_spectra_files(paths, workers=None, use_processes=False, ordered=True, max_in_flight=None, **kwargs):
+    """Read many spectrum files in parallel
+
+    Parameters
+    ----------
+    paths : iterable
+        Paths (or anything accepted by `read_spectra_file`) to load, consumed lazily
+    workers : int, optional
+        Number of worker threads or processes, by default the number of CPUs
+    use_processes : bool, optional
+        Load in a process pool rather than a thread pool, by default False. The spectra are sent
+        back as plain arrays and rebuilt with `spectrum_from_arrays`, so their WCS is replaced by
+        the spectral axis values
+    ordered : bool, optional
+        If True, results are yielded in input order, otherwise as they complete, by default True
+    max_in_flight : int, optional
+        Maximum number of files submitted but not yet yielded, which bounds memory use,
+        by default twice the number of workers
+    **kwargs
+        Passed to `read_spectra_file` for every file
+
+    Yields
+    ------
+    LoadResult
+        The path, the SpectrumList (or None) and the error (or None) for each file. Errors are
+        reported per file rather than aborting the batch
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_in_flight is None:
+        max_in_flight = 2 * workers
+    max_in_flight = max(max_in_flight, 1)
+
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor_class(max_workers=workers) as executor:
+        pending = deque()
+
+        def next_done():
+            if ordered:
+                path, future = pending.popleft()
+            else:
+                done, _ = wait([future for _, future in pending], return_when=FIRST_COMPLETED)
+                path, future = next(item for item in pending if item[1] in done)
+                pending.remove((path, future))
+            try:
+                result = future.result()
+            except Exception as error:
+                # e.g. a crashed worker process
+                return LoadResult(path, None, error)
+            if use_processes and result.spectra is not None:
+                result = result._replace(spectra=SpectrumList(
+                    [spectrum_from_arrays(arrays) for arrays in result.spectra]
+                ))
+            return result
+
+        for path in paths:
+            if len(pending) >= max_in_flight:
+                yield next_done()
+            pending.append((path, executor.submit(_load_result, path, kwargs, use_processes)))
+        while pending:
+            yield next_done()
 
 def read_template_file(path_to_file):
     """Read a file containing template spectra
@@ -396,7 +682,9 @@ def read_template_file(path_to_file):
     Returns
     -------
     list
-        List of Spectrum1D objects containing the template spectra
+        List of Spectrum1D objects containing the template spectra. Their meta holds the
+        template name as the purpose, and the Marz id, redshift and redshift range
+        (z_start, z_end) of the template when the file has them
     """    
     template_list = []
     with open(path_to_file) as template_file:
@@ -408,6 +696,8 @@ def read_template_file(path_to_file):
             if template['log_linear']:
                 spectral_axis = 10. ** spectral_axis
 
-            template_list.append(Spectrum1D(spectral_axis=spectral_axis * u.AA, flux=flux * u.ct, meta={'purpose': template['name']}))
+            meta = {'purpose': template['name']}
+            meta.update({key: template[key] for key in TEMPLATE_META_KEYS if key in template})
+            template_list.append(Spectrum1D(spectral_axis=spectral_axis * u.AA, flux=flux * u.ct, meta=meta))
 
     return template_list
\ No newline at end of file
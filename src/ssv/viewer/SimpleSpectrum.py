@@ -1,6 +1,7 @@
 from .. import helpers
 from .. import plotting
 from .. import utils
+from ..pyramid import SpectrumPyramid
 import altair as alt
 from astropy.table import QTable
 import astropy.units as u
@@ -23,6 +24,11 @@ import os, sys
 
 warnings.simplefilter('ignore', category=AstropyWarning)
 
+# pixels kept either side of a wavelength window when cropping is enabled (see
+# SpectrumIndividual.crop_margin), so that smoothing kernels and other transforms working on
+# nearby pixels see the data around the edges of the window
+DEFAULT_CROP_MARGIN = 50
+
 class SpectrumIndividual():
     """
     The container class to actually hold the spectrum data
@@ -36,14 +42,30 @@ class SpectrumIndividual():
         self.wavelength_unit = self.data.spectral_axis.unit
         self.flux_unit = self.data.unit
 
-        self.wavelength_offset = 0
-        self.flux_offset = 0
+        self._wavelength_offset = 0
+        self._flux_offset = 0
 
         self._wavelength_redshift = 0.0
 
         self._transform_functions = [utils.id]
         self._show_variance = False
 
+        # pixels kept around the wavelength window passed to to_dataframe when cropping before the
+        # transform functions, e.g. DEFAULT_CROP_MARGIN; None (the default) transforms the whole
+        # spectrum, which transforms such as scaling or continuum fitting need
+        self.crop_margin = None
+
+        # memoizing to_dataframe: the transformed spectrum, keyed by the transform functions and the
+        # (start, stop) pixels transformed, and the DataFrame of the whole spectrum, keyed by the
+        # transform functions, offsets, redshift, variance and unit
+        self._transformed = None
+        self._dataframe = None
+        # (transformed spectrum, SpectrumPyramid) pair, the pyramid of the memoized transformed
+        # spectrum, built on first use
+        self._pyramid = None
+        # whether the spectral axis is increasing, so it can be cropped by binary search
+        self._sorted = None
+
     def _format_spectrum(self, spectrum):
         if isinstance(spectrum.uncertainty, StdDevUncertainty):
             uncertainty = spectrum.uncertainty.quantity
@@ -68,6 +90,7 @@ class SpectrumIndividual():
             If True, the variance will be included in the dataframe
         """
         self._show_variance = show
+        self._dataframe = None
 
     def set_transform_functions(self, *functions):
         """
@@ -81,6 +104,35 @@ class SpectrumIndividual():
         """
 
         self._transform_functions = [utils.id, *functions]
+        self.clear_cache()
+
+    def clear_cache(self):
+        """
+        Forget the memoized results of `to_dataframe`, e.g. after modifying `data` in place
+        """
+
+        self._transformed = None
+        self._dataframe = None
+        self._pyramid = None
+        self._sorted = None
+
+    @property
+    def wavelength_offset(self):
+        return self._wavelength_offset
+
+    @wavelength_offset.setter
+    def wavelength_offset(self, offset):
+        self._wavelength_offset = offset
+        self._dataframe = None
+
+    @property
+    def flux_offset(self):
+        return self._flux_offset
+
+    @flux_offset.setter
+    def flux_offset(self, offset):
+        self._flux_offset = offset
+        self._dataframe = None
 
     @property
     def wavelength_redshift(self):
@@ -89,18 +141,48 @@ class SpectrumIndividual():
     @wavelength_redshift.setter
     def wavelength_redshift(self, z):
         self._wavelength_redshift = z
-
-    def to_dataframe(self):
-        """
-        Applies transform functions and converts the spectrum data to a pandas DataFrame
-
-        Returns
-        -------
-        pandas.DataFrame
-            DataFrame columns for wavelength, flux and (optionally) the variance
-        """
-
-        data = utils.compose(*self._transform_functions)(self.data)
+        self._dataframe = None
+
+    def _raw_wavelength_range(self, wavelength_range, output_wavelength_unit, unit):
+        # (wavelength_min, wavelength_max) in `unit` of the spectrum before its wavelength offset
+        # and redshift, showing wavelength_range of the DataFrame returned by to_dataframe
+        offset = self.wavelength_offset
+        if not isinstance(offset, u.Quantity):
+            offset = offset * unit
+        limits = u.Quantity(wavelength_range, output_wavelength_unit).to(unit, u.equivalencies.spectral())
+        return tuple(np.sort((limits / (1 + self.wavelength_redshift) - offset).to_value(unit)))
+
+    def _crop(self, wavelength_range, output_wavelength_unit):
+        # (start, stop) pixels of data needed to show wavelength_range, found by binary search on
+        # the spectral axis
+        n = len(self.data.spectral_axis)
+        if wavelength_range is None or self.crop_margin is None:
+            return 0, n
+        axis = self.data.spectral_axis
+        if self._sorted is None:
+            self._sorted = bool(np.all(np.diff(axis.value) > 0))
+        if not self._sorted:
+            return 0, n
+        limits = self._raw_wavelength_range(wavelength_range, output_wavelength_unit, axis.unit)
+        start = np.searchsorted(axis.value, limits[0], side='left') - self.crop_margin - 1
+        stop = np.searchsorted(axis.value, limits[1], side='right') + self.crop_margin + 1
+        return int(max(start, 0)), int(min(stop, n))
+
+    def _transformed_data(self, crop):
+        # the transform functions (continuum fitting, smoothing, ...) are the expensive part of
+        # to_dataframe, so their result is kept while only the offsets or redshift change; it is
+        # only reused for the same pixels, as slicing a transform of more pixels would not give
+        # the same result for transforms depending on all of them
+        key = (tuple(self._transform_functions), crop)
+        if self._transformed is not None and self._transformed[0] == key:
+            return self._transformed[1]
+        data = self.data if crop == (0, len(self.data.spectral_axis)) else self.data[crop[0]:crop[1]]
+        self._transformed = (key, utils.compose(*self._transform_functions)(data))
+        return self._transformed[1]
+
+    def _shown_dataframe(self, data, output_wavelength_unit):
+        # applies the offsets and redshift to the transformed spectrum `data`, in the DataFrame
+        # returned by to_dataframe
         data = utils.offset_flux(self.flux_offset, data)
         data = utils.offset_wavelength(self.wavelength_offset, data)
         original_redshift = 0.0 # TODO: Is this always zero, does it adjust with _wavelength_redshift? the current redshift of this spectrum
@@ -110,10 +192,100 @@ class SpectrumIndividual():
         return plotting.convert_spectrum_to_dataframe(
                 self.purpose,
                 data,
-                output_wavelength_unit=u.nm,
+                output_wavelength_unit=output_wavelength_unit,
                 show_variance=self._show_variance
             )
 
+    def _full_dataframe(self, output_wavelength_unit):
+        key = (
+            tuple(self._transform_functions), self.flux_offset, self.wavelength_offset,
+            self.wavelength_redshift, self._show_variance, output_wavelength_unit,
+        )
+        if self._dataframe is not None and self._dataframe[0] == key:
+            return self._dataframe[1]
+
+        data = self._transformed_data((0, len(self.data.spectral_axis)))
+        self._dataframe = (key, self._shown_dataframe(data, output_wavelength_unit))
+        return self._dataframe[1]
+
+    def pyramid(self, output_wavelength_unit=u.nm, wavelength_range=None):
+        """
+        Multi-resolution summary of the transformed flux, before the offsets and redshift
+
+        Built on first use, and rebuilt only when the transformed spectrum changes, so changing
+        the offsets or redshift, or zooming in or out, reuses it
+
+        Parameters
+        ---------
+
+        output_wavelength_unit
+            Unit of `wavelength_range`
+
+        wavelength_range
+            If set, (wavelength_min, wavelength_max) of the data summarised, which is cropped
+            as in `to_dataframe`
+
+        Returns
+        -------
+        ssv.pyramid.SpectrumPyramid
+            Summary of the pixels of the transformed spectrum, along its spectral axis
+        """
+
+        transformed = self._transformed_data(self._crop(wavelength_range, output_wavelength_unit))
+        if self._pyramid is None or self._pyramid[0] is not transformed:
+            self._pyramid = (transformed, SpectrumPyramid(transformed.spectral_axis.value, transformed.flux.value))
+        return self._pyramid[1]
+
+    def to_dataframe(self, output_wavelength_unit=u.nm, wavelength_range=None, max_points=None):
+        """
+        Applies transform functions and converts the spectrum data to a pandas DataFrame
+
+        The result is memoized until the transform functions, offsets, redshift or variance
+        visibility change; the transformed spectrum is kept separately, so changing only the
+        offsets or redshift does not re-run the transform functions.
+
+        The whole spectrum is transformed, unless `crop_margin` is set: then, with a
+        `wavelength_range`, the spectrum is cropped to the range (plus `crop_margin` pixels either
+        side) before it is transformed, so the cost is proportional to the pixels shown. Only
+        transforms working on nearby pixels, such as smoothing, give the same result on the
+        cropped data; scaling or continuum fitting would depend on the window.
+
+        Parameters
+        ---------
+
+        output_wavelength_unit
+            Unit of the wavelength column
+
+        wavelength_range
+            If set, (wavelength_min, wavelength_max) of the rows returned
+
+        max_points
+            If set, the maximum number of rows returned; if there are more in the window, the
+            minimum and maximum flux rows of coarser buckets are returned, read from `pyramid`
+
+        Returns
+        -------
+        pandas.DataFrame
+            DataFrame columns for wavelength, flux and (optionally) the variance
+        """
+
+        if wavelength_range is None and max_points is None:
+            return self._full_dataframe(output_wavelength_unit).copy()
+        pyramid = self.pyramid(output_wavelength_unit, wavelength_range)
+        transformed = self._pyramid[0]
+        if wavelength_range is not None:
+            wavelength_range = self._raw_wavelength_range(
+                wavelength_range, output_wavelength_unit, transformed.spectral_axis.unit
+            )
+        # only the rows shown are offset, redshifted and converted
+        indices = pyramid.indices(wavelength_range, max_points)
+        rows = Spectrum1D(
+            spectral_axis=transformed.spectral_axis[indices], flux=transformed.flux[indices],
+            uncertainty=None if transformed.uncertainty is None else transformed.uncertainty[indices],
+            mask=None if transformed.mask is None else transformed.mask[indices],
+        )
+        return self._shown_dataframe(rows, output_wavelength_unit)
+
 class SimpleSpectrum:
     """
     Controller class to more easily deal with the spectrum data
@@ -144,7 +316,7 @@ class SimpleSpectrum:
 
         return data_dict
 
-    def to_dataframe(self, wavelength_unit=u.nm):
+    def to_dataframe(self, wavelength_unit=u.nm, max_points=None, wavelength_range=None):
         """
         Create a pandas DataFrame containing all data from the spectra that are set to be visible in the chart
 
@@ -154,12 +326,24 @@ class SimpleSpectrum:
         wavelength_unit
             Set the wavelength unit for the resulting DataFrame
 
+        max_points
+            If set, each visible spectrum is downsampled to at most this many points, keeping the
+            minimum and maximum flux of each bucket (see `SpectrumIndividual.to_dataframe`)
+
+        wavelength_range
+            If set, (wavelength_min, wavelength_max) of the data included
+
         Returns
         -------
 
         None or pandas.DataFrame
         """
-        dfs = [spectrum.object.to_dataframe() for spectrum in self.spectra.values() if spectrum.visible]
+        dfs = [
+            spectrum.object.to_dataframe(
+                output_wavelength_unit=wavelength_unit, wavelength_range=wavelength_range, max_points=max_points
+            )
+            for spectrum in self.spectra.values() if spectrum.visible
+        ]
         if not dfs:
             return None
         df = pd.concat(dfs).melt(id_vars=[plotting.DEFAULT_SPECTRA_LABEL_COLUMN_NAME, plotting.DEFAULT_WAVELENGTH_COLUMN_NAME], var_name='type', value_name=plotting.DEFAULT_FLUX_COLUMN_NAME)
@@ -289,6 +473,33 @@ class SimpleSpectrum:
             if spectrum is not None:
                 spectrum.object.flux_offset = offset
 
+    def set_crop_margin(self, margin=DEFAULT_CROP_MARGIN, *trace_keys):
+        """
+        Crop specific spectra to the wavelength range shown before applying their transform functions
+
+        Zoomed in views then only transform the pixels shown, plus `margin` pixels either side;
+        only transforms working on nearby pixels, such as smoothing, give the same result on the
+        cropped spectrum (see `SpectrumIndividual.to_dataframe`)
+
+        Parameters
+        ---------
+
+        margin
+            Pixels kept either side of the wavelength range, by default DEFAULT_CROP_MARGIN. If None,
+            the whole spectrum is transformed
+
+        *trace_keys
+            The keys of the spectra to crop
+        """
+
+        if not trace_keys:
+            trace_keys = self.spectra.keys()
+
+        for trace_key in trace_keys:
+            spectrum = self.spectra.get(trace_key)
+            if spectrum is not None:
+                spectrum.object.crop_margin = margin
+
     def redshift_wavelength(self, z, *trace_keys):
         """
         Set a redshift z to offset the wavelength values of specific spectra
@@ -338,7 +549,7 @@ class SimpleSpectrum:
 
         return result
 
-    def build_chart(self, wavelength_unit=u.nm, **kwargs):
+    def build_chart(self, wavelength_unit=u.nm, chart_data=None, max_points=None, wavelength_range=None, **kwargs):
         """
         Build a altair Chart with the data from the visible spectra
 
@@ -348,6 +559,15 @@ class SimpleSpectrum:
         wavelength_unit
             Set the wavelength unit for the data used in the Chart
 
+        chart_data
+            DataFrame already returned by `to_dataframe`, to be plotted instead of building it again
+
+        max_points
+            Maximum number of points plotted for each visible spectrum, see `to_dataframe`
+
+        wavelength_range
+            (wavelength_min, wavelength_max) of the data plotted, see `to_dataframe`
+
         **kwargs
             Passed to plotting.plot_spectra
 
@@ -357,7 +577,8 @@ class SimpleSpectrum:
         If no data in the Chart, returns None, else returns an altair Chart of the visible spectra
         """
 
-        chart_data = self.to_dataframe(wavelength_unit=wavelength_unit)
+        if chart_data is None:
+            chart_data = self.to_dataframe(wavelength_unit=wavelength_unit, max_points=max_points, wavelength_range=wavelength_range)
         if chart_data is None:
             return None
         return plotting.plot_spectra(chart_data, **kwargs)
\ No newline at end of file
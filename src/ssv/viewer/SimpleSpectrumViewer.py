@@ -1,3 +1,5 @@
+from .. import plotting
+from .SimpleSpectrum import DEFAULT_CROP_MARGIN
 import altair as alt
 from astropy.table import QTable
 import astropy.units as u
@@ -25,6 +27,9 @@ class SimpleSpectrumViewer:
         self.lines = None
         self._show_grid = True
         self._show_legend = True
+        self._points_per_pixel = plotting.DEFAULT_POINTS_PER_PIXEL
+        self._x_range = None
+        self._crop_margin = None
         self._chart_properties = {
             "height": 400,
             "width": 700,
@@ -43,6 +48,9 @@ class SimpleSpectrumViewer:
         """
         Sets the range of the x-axis in the final chart
 
+        Only the data within the range is included in the chart, at the resolution needed
+        for the chart width (see `set_downsampling`)
+
         Parameters
         ---------
 
@@ -53,6 +61,7 @@ class SimpleSpectrumViewer:
             The maximum of the x-axis extent
         """
 
+        self._x_range = (x_min, x_max)
         self._chart_properties['encoding']['x'] = {
                     "scale": {"domain": [x_min, x_max]},
                     "type": "quantitative"
@@ -89,6 +98,8 @@ class SimpleSpectrumViewer:
         """
 
         self.spectrum_dict[spectrum.name] = spectrum
+        if self._crop_margin is not None:
+            spectrum.set_crop_margin(self._crop_margin)
 
     def remove_spectrum(self, spectrum):
         """
@@ -103,10 +114,25 @@ class SimpleSpectrumViewer:
 
         del self.spectrum_dict[spectrum.name]
 
-    def get_all_spectrum_chart_data(self):
+    def _build_spectrum_chart_data(self):
+        return OrderedDict(
+            (name, spectrum.to_dataframe(
+                wavelength_unit=self.wavelength_unit, max_points=self._max_points(), wavelength_range=self._x_range
+            ))
+            for name, spectrum in self.spectrum_dict.items()
+        )
+
+    def get_all_spectrum_chart_data(self, chart_data=None):
         """
         Return a dataframe of wavelengths and spectra for all SimpleSpectrum objects in the viewer
 
+        Parameters
+        ---------
+
+        chart_data
+            Dictionary of SimpleSpectrum names to the DataFrames already built from them, as used by
+            `build_chart` to avoid rebuilding the data. If None, the DataFrames are built here
+
         Returns
         -------
 
@@ -120,7 +146,9 @@ class SimpleSpectrumViewer:
             The largest wavelength value in the dataframe
         """
 
-        all_spectrum_chart_data = pd.concat([spectrum.to_dataframe(wavelength_unit=self.wavelength_unit) for spectrum in self.spectrum_dict.values()])
+        if chart_data is None:
+            chart_data = self._build_spectrum_chart_data()
+        all_spectrum_chart_data = pd.concat(chart_data.values())
         wavelength_min = all_spectrum_chart_data['wavelength'].min()
         wavelength_max = all_spectrum_chart_data['wavelength'].max()
         return all_spectrum_chart_data, wavelength_min, wavelength_max
@@ -229,6 +257,49 @@ class SimpleSpectrumViewer:
 
         self._show_legend = show
 
+    def set_downsampling(self, points_per_pixel=plotting.DEFAULT_POINTS_PER_PIXEL):
+        """
+        Set how many points of each spectrum are plotted per pixel of the chart width
+
+        Spectra with more points are downsampled, keeping the minimum and maximum flux of each
+        bucket so that narrow lines are not lost
+
+        Parameters
+        ---------
+
+        points_per_pixel
+            Number of points kept per pixel, by default 2 (the minimum and maximum). If None,
+            every point of every spectrum is plotted
+        """
+
+        self._points_per_pixel = points_per_pixel
+
+    def set_crop_margin(self, margin=DEFAULT_CROP_MARGIN):
+        """
+        Crop the spectra to the x-axis range (see `set_x_range`) before applying their transform
+        functions, so that zoomed in charts only transform the pixels shown
+
+        Only transforms working on nearby pixels, such as smoothing, give the same result on the
+        cropped spectra; scaling or continuum fitting would depend on the range shown. Applies to
+        the spectra already added and those added later
+
+        Parameters
+        ---------
+
+        margin
+            Pixels kept either side of the x-axis range, by default DEFAULT_CROP_MARGIN. If None,
+            the whole spectra are transformed
+        """
+
+        self._crop_margin = margin
+        for spectrum in self.spectrum_dict.values():
+            spectrum.set_crop_margin(margin)
+
+    def _max_points(self):
+        if self._points_per_pixel is None:
+            return None
+        return int(self._points_per_pixel * self._chart_properties['width'])
+
     def set_chart_width_height(self, width=None, height=None):
         """
         Set the width and height of the chart
@@ -258,18 +329,21 @@ class SimpleSpectrumViewer:
         The Altair Chart
         """
         layer_list = []
+        # each spectrum's data is built once per render, then shared by its layer and the line limits
+        chart_data = self._build_spectrum_chart_data()
 
-        for spectrum in self.spectrum_dict.values():
+        for name, spectrum in self.spectrum_dict.items():
             layer = spectrum.build_chart(
                 wavelength_axis_label=self._get_wavelength_title(),
                 flux_axis_label=self._get_flux_title(),
-                wavelength_unit=self.wavelength_unit
+                wavelength_unit=self.wavelength_unit,
+                chart_data=chart_data[name]
             )
             if layer is not None:
                 layer_list.append(layer)
 
         if self.lines is not None:
-            _, wavelength_min, wavelength_max = self.get_all_spectrum_chart_data()
+            _, wavelength_min, wavelength_max = self.get_all_spectrum_chart_data(chart_data)
             self.lines.set_wavelength_limits(wavelength_min=wavelength_min, wavelength_max=wavelength_max)
             layer_list.extend(
                 self.lines.build_chart(
@@ -1,4 +1,6 @@
+import numpy as np
 import pytest
+import astropy.units as u
 from specutils import Spectrum1D, SpectrumList
 
 from ssv.helpers import (
@@ -10,6 +12,7 @@ from ssv.viewer import \
 from specutils.manipulation import box_smooth, gaussian_smooth, trapezoid_smooth, median_smooth
 
 from ssv import utils
+from ssv.viewer.SimpleSpectrum import DEFAULT_CROP_MARGIN, SpectrumIndividual
 import ssv
 
 # Uncomment if running test locally
@@ -104,4 +107,189 @@ class TestChart1:
         viewer.show_legend(True)
         viewer.set_chart_width_height(height=500)
 
-        viewer.build_chart()
\ No newline at end of file
+        viewer.build_chart()
+
+
+def synthetic_spectra(start, stop, purposes=('reduced', 'sky'), n=500):
+    wavelength = np.linspace(start, stop, n) * u.nm
+    return [
+        Spectrum1D(spectral_axis=wavelength, flux=np.random.default_rng(0).normal(size=n) * u.ct, meta={'purpose': purpose})
+        for purpose in purposes
+    ]
+
+
+class TestViewer:
+
+    def test_data_built_once_per_render(self, monkeypatch):
+        calls = []
+        to_dataframe = SpectrumIndividual.to_dataframe
+
+        def counted(self, *args, **kwargs):
+            calls.append(self.purpose)
+            return to_dataframe(self, *args, **kwargs)
+
+        monkeypatch.setattr(SpectrumIndividual, 'to_dataframe', counted)
+
+        viewer = SimpleSpectrumViewer('Simple')
+        viewer.add_spectrum(SimpleSpectrum('First', synthetic_spectra(380, 700)))
+        viewer.add_spectrum(SimpleSpectrum('Second', synthetic_spectra(450, 900, purposes=('reduced',))))
+        viewer.add_lines(SimpleSpectralLines())
+        viewer.build_chart()
+
+        assert sorted(calls) == ['reduced', 'reduced', 'sky']
+        assert viewer.lines.wavelength_min == pytest.approx(380)
+        assert viewer.lines.wavelength_max == pytest.approx(900)
+
+
+class TestSpectrumIndividual:
+
+    def test_transforms_memoized(self):
+        calls = []
+
+        def transform(spectrum):
+            calls.append(spectrum)
+            return spectrum * 2
+
+        individual = SpectrumIndividual('reduced', synthetic_spectra(400, 800, purposes=('reduced',))[0])
+        individual.set_transform_functions(transform)
+        first = individual.to_dataframe()
+        assert individual.to_dataframe().equals(first)
+        assert len(calls) == 1
+
+        individual.wavelength_redshift = 1.0
+        individual.flux_offset = 3
+        shifted = individual.to_dataframe()
+        assert len(calls) == 1
+        assert shifted['wavelength'].to_numpy() == pytest.approx(2 * first['wavelength'].to_numpy())
+        assert shifted['spectrum'].to_numpy() == pytest.approx(first['spectrum'].to_numpy() + 3)
+
+        individual.set_transform_functions(transform)
+        individual.to_dataframe()
+        assert len(calls) == 2
+
+    def test_crop_before_transforms(self):
+        lengths = []
+
+        def transform(spectrum):
+            lengths.append(len(spectrum.spectral_axis))
+            return spectrum * 2
+
+        individual = SpectrumIndividual('reduced', synthetic_spectra(400, 800, purposes=('reduced',), n=4001)[0])
+        individual.set_transform_functions(transform)
+        individual.wavelength_redshift = 1.0
+        full = individual.to_dataframe()
+        individual.to_dataframe(wavelength_range=(1200, 1210))
+        assert lengths == [4001]
+
+        individual.crop_margin = DEFAULT_CROP_MARGIN
+        window = individual.to_dataframe(wavelength_range=(1200, 1210))
+        assert lengths[-1] == 51 + 2 * (DEFAULT_CROP_MARGIN + 1)
+        assert len(window) == 53
+        assert window['wavelength'].min() < 1200 < 1210 < window['wavelength'].max()
+        assert window['spectrum'].to_numpy() == pytest.approx(full.set_index('wavelength').loc[window['wavelength'], 'spectrum'].to_numpy())
+        individual.flux_offset = 1
+        individual.to_dataframe(wavelength_range=(1200, 1210))
+        assert len(lengths) == 2
+
+    def test_scaling_independent_of_window(self):
+        individual = SpectrumIndividual('reduced', synthetic_spectra(400, 800, purposes=('reduced',), n=4001)[0])
+        individual.set_transform_functions(utils.apply_scaling())
+        full = individual.to_dataframe().set_index('wavelength')['spectrum']
+        assert full.max() == pytest.approx(1)
+
+        for crop_margin in (None, DEFAULT_CROP_MARGIN):
+            individual.crop_margin = crop_margin
+            windows = [(600, 610), (400, 800), (600, 610), (605, 606), (600, 610)]
+            results = [individual.to_dataframe(wavelength_range=window) for window in windows]
+            for earlier, later in [(0, 2), (2, 4)]:
+                assert results[earlier].equals(results[later])
+            individual.clear_cache()
+            assert individual.to_dataframe(wavelength_range=windows[0]).equals(results[0])
+        individual.crop_margin = None
+        window = individual.to_dataframe(wavelength_range=(600, 610))
+        assert window['spectrum'].to_numpy() == pytest.approx(full.loc[window['wavelength']].to_numpy())
+
+    def test_pyramid_built_once(self):
+        individual = SpectrumIndividual('reduced', synthetic_spectra(400, 800, purposes=('reduced',), n=20000)[0])
+        individual.crop_margin = None
+        pyramid = individual.pyramid()
+        individual.to_dataframe(max_points=400)
+        individual.to_dataframe(wavelength_range=(500, 510), max_points=400)
+        individual.wavelength_redshift = 1.0
+        individual.flux_offset = 3
+        window = individual.to_dataframe(output_wavelength_unit=u.AA, wavelength_range=(10000, 10100), max_points=400)
+        assert individual.pyramid() is pyramid
+
+        full = individual.to_dataframe(output_wavelength_unit=u.AA)
+        assert window['wavelength'].min() < 10000 < 10100 < window['wavelength'].max()
+        assert window['spectrum'].to_numpy() == pytest.approx(full.set_index('wavelength').loc[window['wavelength'], 'spectrum'].to_numpy())
+
+    def test_cached_dataframe_not_shared(self):
+        individual = SpectrumIndividual('reduced', synthetic_spectra(400, 800, purposes=('reduced',))[0])
+        individual.to_dataframe()['spectrum'] = 0
+        assert individual.to_dataframe()['spectrum'].any()
+        assert individual.to_dataframe(output_wavelength_unit=u.AA)['wavelength'].iloc[0] == pytest.approx(4000)
+
+
+class TestDownsampling:
+
+    def test_keeps_extremes(self):
+        spectrum = synthetic_spectra(380, 900, purposes=('reduced',), n=10001)[0]
+        spectrum.flux[1234] = 50 * spectrum.flux.unit
+        spectrum.flux[8765] = -50 * spectrum.flux.unit
+        individual = SpectrumIndividual('reduced', spectrum)
+        data = individual.to_dataframe(max_points=400)
+        assert len(data) <= 400
+        assert data['wavelength'].is_monotonic_increasing
+        assert {50, -50} <= set(data['spectrum'])
+        assert len(individual.to_dataframe(wavelength_range=(500, 510), max_points=400)) < 400
+
+    def test_viewer_budget_from_width(self):
+        viewer = SimpleSpectrumViewer('Simple')
+        viewer.add_spectrum(SimpleSpectrum('Long', synthetic_spectra(380, 900, purposes=('reduced',), n=20000)))
+        viewer.set_chart_width_height(width=300)
+        datasets = viewer.build_chart().to_dict()['datasets'].values()
+        assert sum(len(rows) for rows in datasets) <= 600
+
+        viewer.set_downsampling(None)
+        datasets = viewer.build_chart().to_dict()['datasets'].values()
+        assert sum(len(rows) for rows in datasets) == 20000
+
+    def test_viewer_x_range(self):
+        viewer = SimpleSpectrumViewer('Simple')
+        viewer.add_spectrum(SimpleSpectrum('Long', synthetic_spectra(380, 900, purposes=('reduced',), n=20000)))
+        viewer.set_x_range(600, 610)
+        data, wavelength_min, wavelength_max = viewer.get_all_spectrum_chart_data()
+        assert len(data) < 400
+        assert wavelength_min < 600 < 610 < wavelength_max < 611
+
+    def test_viewer_crop_margin(self):
+        lengths = []
+
+        def transform(spectrum):
+            lengths.append(len(spectrum.spectral_axis))
+            return spectrum
+
+        viewer = SimpleSpectrumViewer('Simple')
+        viewer.set_crop_margin()
+        spectrum = SimpleSpectrum('Long', synthetic_spectra(380, 900, purposes=('reduced',), n=20000))
+        spectrum.set_transform_functions(['reduced'], [transform])
+        viewer.add_spectrum(spectrum)
+        viewer.set_x_range(600, 610)
+        viewer.build_chart()
+        assert lengths == [len(viewer.get_all_spectrum_chart_data()[0]) + 2 * DEFAULT_CROP_MARGIN]
+
+        viewer.set_crop_margin(None)
+        viewer.build_chart()
+        assert lengths[-1] == 20000
+
+    def test_viewer_x_range_in_wavelength_unit(self):
+        viewer = SimpleSpectrumViewer('Simple')
+        viewer.add_spectrum(SimpleSpectrum('Long', synthetic_spectra(380, 900, purposes=('reduced',), n=20000)))
+        viewer.set_x_range(600, 610)
+        in_nm = viewer.get_all_spectrum_chart_data()[0]
+        viewer.set_wavelength_unit(u.AA)
+        viewer.set_x_range(6000, 6100)
+        data, wavelength_min, wavelength_max = viewer.get_all_spectrum_chart_data()
+        assert len(data) == len(in_nm)
+        assert wavelength_min < 6000 < 6100 < wavelength_max < 6110
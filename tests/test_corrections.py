@@ -0,0 +1,114 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import astropy.units as u
+from astropy.io import fits
+from specutils import Spectrum1D
+
+from ssv.corrections import (
+    NO_CORRECTION, SpectralAxisCorrector, SpectralCorrection, air_to_vacuum, cmb_velocity,
+    header_corrections, vacuum_to_air,
+)
+
+MARZ_DATA = Path("./tests/data/marz")
+
+
+def linear_axis(header):
+    pixels = np.arange(header["NAXIS1"]) + 1
+    return header["CRVAL1"] + (pixels - header["CRPIX1"]) * header["CDELT1"]
+
+
+def fibre_position(filename):
+    fibres = fits.getdata(MARZ_DATA / filename, "FIBRES")
+    return np.degrees(fibres["RA"]), np.degrees(fibres["DEC"])
+
+
+class TestAirVacuum:
+    def test_matches_marz_fixtures(self):
+        air = linear_axis(fits.getheader(MARZ_DATA / "emlLinearSkyAirNoHelio.fits"))
+        vacuum = fits.getdata(MARZ_DATA / "emlLinearVacuumNoHelio.fits", "WAVELENGTH")
+        log_vacuum = fits.getdata(MARZ_DATA / "emlLogVacuumNoHelio.fits", "WAVELENGTH")
+        assert air_to_vacuum(air) == pytest.approx(vacuum, abs=1e-4)
+        assert air_to_vacuum(air) == pytest.approx(10 ** log_vacuum.astype(float), rel=1e-6)
+
+    def test_round_trip(self):
+        wavelength = np.linspace(3500, 9500, 50) * u.nm / 10
+        assert vacuum_to_air(air_to_vacuum(wavelength)).unit == u.nm
+        assert vacuum_to_air(air_to_vacuum(wavelength)).value == pytest.approx(wavelength.value)
+
+
+class TestHeaderCorrections:
+    def test_flags(self):
+        air, = header_corrections(fits.getheader(MARZ_DATA / "emlLinearSkyAirNoHelio.fits"))
+        vacuum, = header_corrections(fits.getheader(MARZ_DATA / "emlLogVacuumNoHelio.fits"))
+        assert air == SpectralCorrection(True, 0.0)
+        assert vacuum == NO_CORRECTION
+
+    def test_frame_velocities(self):
+        ra, dec = fibre_position("emlLinearSkyAirHelio.fits")
+        helio, = header_corrections(fits.getheader(MARZ_DATA / "emlLinearSkyAirHelio.fits"), ra, dec)
+        both, = header_corrections(fits.getheader(MARZ_DATA / "emlLinearSkyAirHelioCMB.fits"), ra, dec)
+        assert helio.air_to_vacuum
+        # December, towards RA 35 deg: the Earth moves away from the target
+        assert -30 < helio.velocity < -10
+        assert both.velocity - helio.velocity == pytest.approx(cmb_velocity(ra, dec)[0])
+
+    def test_fibres_computed_together(self):
+        header = fits.getheader(MARZ_DATA / "emlLogVacuumHelioMultiple.fits")
+        ra, dec = fibre_position("emlLogVacuumHelioMultiple.fits")
+        corrections = header_corrections(header, ra, dec)
+        assert len(corrections) == 3
+        assert not any(correction.air_to_vacuum for correction in corrections)
+
+
+class TestSpectralAxisCorrector:
+    def test_cached_per_grid_and_correction(self):
+        corrector = SpectralAxisCorrector()
+        grid = np.linspace(4000, 8000, 100)
+        corrections = [SpectralCorrection(True, 10.0)] * 3 + [SpectralCorrection(True, 10.0000001)]
+        axes = corrector.correct_many([grid.copy() for _ in corrections], corrections)
+        assert corrector.stats() == {"hits": 3, "misses": 1}
+        assert all(axis is axes[0] for axis in axes)
+        assert not axes[0].flags.writeable
+        assert axes[0] == pytest.approx(air_to_vacuum(grid) * (1 + 10.0 / 299792.458))
+
+        corrector.correct(grid, SpectralCorrection(False, 0.0))
+        assert corrector.stats() == {"hits": 3, "misses": 2}
+
+    def test_quantities_keep_unit(self):
+        corrector = SpectralAxisCorrector()
+        axis = corrector.correct(np.linspace(400, 800, 10) * u.nm, SpectralCorrection(True, 0.0))
+        assert axis.unit == u.nm
+        assert axis.value == pytest.approx(air_to_vacuum(np.linspace(4000, 8000, 10)) / 10)
+
+    def test_correct_spectra_from_headers(self):
+        header = fits.getheader(MARZ_DATA / "emlLinearSkyAirNoHelio.fits")
+        wavelength = linear_axis(header) * u.AA
+        spectra = [
+            Spectrum1D(spectral_axis=wavelength, flux=np.ones(len(wavelength)) * u.ct, meta={"header": header})
+            for _ in range(2)
+        ]
+        corrector = SpectralAxisCorrector()
+        corrected = corrector.correct_spectra(spectra)
+        vacuum = fits.getdata(MARZ_DATA / "emlLinearVacuumNoHelio.fits", "WAVELENGTH")
+        assert corrected[1].spectral_axis.value == pytest.approx(vacuum, abs=1e-4)
+        assert corrected[0].meta["spectral_correction"] == {"air_to_vacuum": True, "velocity": 0.0}
+        assert corrector.stats() == {"hits": 1, "misses": 1}
+
+    def test_read_spectra_file(self):
+        from ssv import utils
+
+        filename = MARZ_DATA / "emlLinearSkyAirNoHelio.fits"
+        corrected = utils.read_spectra_file(filename, corrector=SpectralAxisCorrector())
+        vacuum = fits.getdata(MARZ_DATA / "emlLinearVacuumNoHelio.fits", "WAVELENGTH")
+        assert corrected[0].spectral_axis.to_value(u.AA) == pytest.approx(vacuum, abs=1e-4)
+        assert utils.read_spectra_file(filename)[0].spectral_axis.to_value(u.AA) != pytest.approx(vacuum, abs=1e-4)
+
+    def test_sent_to_worker_processes(self):
+        from ssv import utils
+
+        filenames = [MARZ_DATA / "emlLinearSkyAirNoHelio.fits"]
+        result, = utils.read_spectra_files(filenames, workers=1, use_processes=True, corrector=SpectralAxisCorrector())
+        assert result.error is None
+        assert result.spectra[0].meta["spectral_correction"]["air_to_vacuum"]
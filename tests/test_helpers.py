@@ -77,6 +77,66 @@ class TestConvert:
         spectrum = SimpleSpectrum('fits2JSON', spectrum_data)
         asjson = utils.toMarzJSON(spectrum)
 
+    def _marz_spectrum(self, shared_datadir):
+        from ssv.viewer import SimpleSpectrum
+        from ssv import utils
+        spectrum_file = shared_datadir / "marz/spec-4444-55538-1000.fits"
+        formats = ssv.ssvloaders.whatformat(spectrum_file)
+        if len(formats) > 1:
+            ssv.ssvloaders.unregister(formats[0])
+        spectrum_data = utils.read_spectra_file(spectrum_file)
+        ssv.ssvloaders.restore_registered_loaders()
+        return SimpleSpectrum('fits2JSON', spectrum_data)
+
+    def test_dump_marz_json(self, shared_datadir):
+        import json
+        import numpy as np
+        from ssv import utils
+        spectrum = self._marz_spectrum(shared_datadir)
+        expected = utils.toMarzJSON(spectrum)
+
+        dumped = utils.dumpMarzJSON(spectrum)
+        assert "\n" not in dumped
+        asjson = json.loads(dumped)
+        assert list(asjson) == list(expected)
+        for key, values in expected.items():
+            values = np.array(values, dtype=float)
+            values[~np.isfinite(values)] = np.nan
+            np.testing.assert_array_equal(
+                np.array(asjson[key], dtype=float).astype(np.float32),
+                values.astype(np.float32),
+            )
+
+        rough = json.loads(utils.dumpMarzJSON(spectrum, precision=3))
+        np.testing.assert_allclose(
+            np.array(rough["wavelength"], dtype=float), expected["wavelength"], rtol=5e-3
+        )
+
+    def test_dump_marz_json_non_finite(self):
+        import json
+        from ssv import utils
+        arrays = {"wavelength": [1.0, 2.0, 3.0], "intensity": [float("nan"), float("inf"), 0.5]}
+        assert json.loads(utils.dumpMarzJSON(arrays)) == {
+            "wavelength": [1.0, 2.0, 3.0], "intensity": [None, None, 0.5]
+        }
+
+    @pytest.mark.parametrize("json_lines", [False, True])
+    def test_write_marz_json(self, shared_datadir, tmp_path, json_lines):
+        import json
+        from ssv import utils
+        spectrum = self._marz_spectrum(shared_datadir)
+        path = tmp_path / "spectra.json"
+
+        assert utils.writeMarzJSON(
+            (spectrum for _ in range(3)), path, json_lines=json_lines
+        ) == 3
+        with open(path) as f:
+            if json_lines:
+                documents = [json.loads(line) for line in f]
+            else:
+                documents = json.load(f)
+        assert documents == [json.loads(utils.dumpMarzJSON(spectrum))] * 3
+
     def test_fits2json_2(self, shared_datadir):
         from ssv.viewer import SimpleSpectrum
         from ssv import utils
@@ -256,6 +256,87 @@ class TestAAOmega2dF:
             assert spec.meta.get("purpose") is not None
             assert spec.meta.get("fibre_index") is not None
 
+def make_aaomega_frame(path, rwss=True):
+    """Write a small reduced 2dfdr frame: program, sky, unused, program, broken and program fibres"""
+    import numpy as np
+    from astropy.io import fits
+
+    rng = np.random.default_rng(0)
+    n_fibres, n_pixels = 6, 50
+    primary = fits.PrimaryHDU(rng.normal(size=(n_fibres, n_pixels)).astype(np.float32))
+    primary.header.update({
+        "INSTRUME": "AAOMEGA-2dF", "OBJECT": "field", "MEANRA": 10.0, "MEANDEC": -30.0,
+        "CRPIX1": 1.0, "CRVAL1": 4000.0, "CDELT1": 2.0,
+    })
+    hdus = [
+        primary,
+        fits.ImageHDU(rng.uniform(size=(n_fibres, n_pixels)).astype(np.float32), name="VARIANCE"),
+        fits.BinTableHDU.from_columns([
+            fits.Column(name="NAME", format="20A",
+                        array=["gal1", "sky1", "unused", "gal2", "broken", "gal1"]),
+            fits.Column(name="RA", format="D", array=np.linspace(0.1, 0.2, n_fibres)),
+            fits.Column(name="DEC", format="D", array=np.linspace(-0.5, -0.4, n_fibres)),
+            fits.Column(name="COMMENT", format="20A", array=["comment"] * n_fibres),
+            fits.Column(name="MAGNITUDE", format="E", array=np.arange(n_fibres)),
+            fits.Column(name="TYPE", format="1A", array=["P", "S", "U", "P", "N", "P"]),
+            fits.Column(name="THETA", format="D", array=np.zeros(n_fibres)),
+        ] + [
+            fits.Column(name=name, format="J", array=np.arange(n_fibres))
+            for name in ["PIVOT", "PID", "X", "Y", "XERR", "YERR", "RETRACTOR"]
+        ], name="FIBRES"),
+        fits.BinTableHDU.from_columns(
+            [fits.Column(name="ARGNAME", format="10A", array=["arg"])], name="REDUCTION_ARGS"
+        ),
+    ]
+    if rwss:
+        hdus.append(fits.ImageHDU(
+            rng.normal(size=(n_fibres, n_pixels)).astype(np.float32), name="RWSS"
+        ))
+    fits.HDUList(hdus).writeto(path)
+
+
+class TestAAOmegaFibres:
+    @pytest.mark.parametrize("rwss", [False, True])
+    def test_matches_full_load(self, tmp_path, rwss):
+        import numpy as np
+        from ssv.aaomega import iter_aaomega_fibres
+
+        frame = tmp_path / "OBJ0001red.fits"
+        make_aaomega_frame(frame, rwss=rwss)
+        expected = SpectrumList.read(frame, format="Data Central AAOmega")
+        fibres = list(iter_aaomega_fibres(frame))
+
+        assert len(fibres) == len(expected) == 4
+        for spec, fibre in zip(expected, fibres):
+            for key in ["label", "purpose", "fibre_index", "header"]:
+                assert fibre.meta[key] == spec.meta[key]
+            np.testing.assert_array_equal(fibre.spectral_axis, spec.spectral_axis)
+            np.testing.assert_array_equal(fibre.flux, spec.flux)
+            np.testing.assert_array_equal(fibre.uncertainty.array, spec.uncertainty.array)
+            assert ("science_sky" in fibre.meta) == rwss
+            if rwss:
+                np.testing.assert_array_equal(
+                    fibre.meta["science_sky"].flux, spec.meta["science_sky"].flux
+                )
+
+    def test_selected_fibres_only(self, tmp_path):
+        from astropy.io import fits
+        from ssv.aaomega import iter_aaomega_fibres, read_aaomega_fibre
+
+        frame = tmp_path / "OBJ0001red.fits"
+        make_aaomega_frame(frame)
+        with fits.open(frame) as hdulist:
+            fibres = list(iter_aaomega_fibres(hdulist, fibres=[4, "gal1"]))
+            assert [f.meta["fibre_index"] for f in fibres] == [4, 0, 5]
+            assert fibres[0].meta["purpose"] is None
+            assert fibres[1].meta["label"] == "gal1 #1"
+            # rows are read through sections, never the full image
+            assert all("data" not in hdu.__dict__ for hdu in hdulist if hdu.is_image)
+
+        assert read_aaomega_fibre(frame, "gal2").meta["fibre_index"] == 3
+        with pytest.raises(ValueError):
+            read_aaomega_fibre(frame, "no such fibre")
+
 
 DC_TEST_FILENAMES = [
     "000001.fits",
@@ -418,6 +499,122 @@ class TestSingleSplitMarz:
         assert spectra[0].spectral_axis.unit == u.Angstrom
         assert spectra[0].meta.get("header") is not None
 
+class TestMarzJSONReader:
+    MARZ_JSON = "marz/quasarLinearSkyAirNoHelio.json"
+
+    def test_parse_matches_json(self, shared_datadir):
+        import json
+        import numpy as np
+        from ssv.marzJSON import iter_marz_json
+
+        with open(shared_datadir / self.MARZ_JSON) as f:
+            expected = json.load(f)
+        # tiny chunks exercise objects and numbers split across reads
+        for chunk_size in [7, 2**20]:
+            spectra = list(iter_marz_json(shared_datadir / self.MARZ_JSON, chunk_size=chunk_size))
+            assert len(spectra) == 1
+            assert list(spectra[0]) == list(expected)
+            for key, values in expected.items():
+                assert spectra[0][key].dtype == np.float64
+                np.testing.assert_array_equal(spectra[0][key], np.array(values, dtype=float))
+
+    def test_fallback_for_other_values(self):
+        import io
+        from ssv.marzJSON import iter_marz_json
+
+        text = '[{"name": "a {b} \\"c\\"", "wavelength": [1, 2], "intensity": [null, 3]},\n{"wavelength": []}]'
+        first, second = iter_marz_json(io.StringIO(text), chunk_size=3)
+        assert first["name"] == 'a {b} "c"'
+        assert first["intensity"].tolist()[1] == 3.0
+        assert len(second["wavelength"]) == 0
+
+    @pytest.mark.parametrize("json_lines", [False, True])
+    def test_many_spectra(self, shared_datadir, tmp_path, json_lines):
+        from ssv.marzJSON import iter_marzjson_spectra
+
+        simple = SimpleSpectrum("imported", ssv.utils.read_spectra_file(shared_datadir / self.MARZ_JSON))
+        path = tmp_path / ("spectra.jsonl" if json_lines else "spectra.json")
+        ssv.utils.writeMarzJSON([simple] * 3, path, json_lines=json_lines)
+
+        spectra = iter_marzjson_spectra(path)
+        assert len(next(spectra)) == 2
+        assert len(list(spectra)) == 2
+
+        loaded = SpectrumList.read(path, format="MARZJSON")
+        assert len(loaded) == 6
+        assert [spec.meta["marz_index"] for spec in loaded] == [0, 0, 1, 1, 2, 2]
+
+    def test_identify(self, shared_datadir):
+        import io
+        from ssv.marzJSON import identify_marzjson
+
+        path = shared_datadir / self.MARZ_JSON
+        assert identify_marzjson("read", path, None)
+        assert identify_marzjson("read", str(path), None)
+        assert not identify_marzjson("read", shared_datadir / GAMA_MGC_TEST_FILENAME, None)
+        with open(path, "rb") as f:
+            contents = f.read()
+        fileobj = io.BytesIO(contents)
+        assert identify_marzjson("read", None, fileobj)
+        assert fileobj.tell() == 0
+        with open(shared_datadir / GAMA_MGC_TEST_FILENAME, "rb") as f:
+            assert not identify_marzjson("read", None, f)
+        assert len(SpectrumList.read(io.BytesIO(contents), format="MARZJSON")) == 2
+
+class TestMarzBinary:
+    def _simple_spectrum(self, shared_datadir):
+        spectra = ssv.utils.read_spectra_file(shared_datadir / TestMarzJSONReader.MARZ_JSON)
+        return SimpleSpectrum("quasar", spectra)
+
+    @pytest.mark.parametrize("dtype", ["float32", "float64"])
+    def test_round_trip(self, shared_datadir, tmp_path, dtype):
+        import json
+        import numpy as np
+        from ssv.marzBinary import writeMarzBinary
+
+        simple = self._simple_spectrum(shared_datadir)
+        path = tmp_path / "quasar.marzbin"
+        assert writeMarzBinary([simple, simple], path, dtype=dtype) == 2
+        assert path.stat().st_size < len(ssv.utils.dumpMarzJSON(simple)) * 2
+
+        expected = ssv.utils.fromMarzJSON(json.loads(ssv.utils.dumpMarzJSON(simple)))
+        spectra = SpectrumList.read(path)
+        assert len(spectra) == 2 * len(expected)
+        for spec, expected_spec in zip(spectra, expected * 2):
+            assert spec.flux.dtype == np.dtype(dtype)
+            assert spec.meta["name"] == "quasar"
+            assert spec.meta["purpose"] == expected_spec.meta["purpose"]
+            np.testing.assert_array_equal(spec.spectral_axis, expected_spec.spectral_axis)
+            np.testing.assert_allclose(
+                spec.flux.value, expected_spec.flux.value, rtol=1e-6, equal_nan=True
+            )
+
+    def test_zero_copy(self, shared_datadir, tmp_path):
+        import numpy as np
+        from ssv.marzBinary import read_marz_binary, writeMarzBinary
+
+        path = tmp_path / "quasar.marzbin"
+        writeMarzBinary(self._simple_spectrum(shared_datadir), path)
+        arrays = read_marz_binary(path)[0]
+        assert isinstance(arrays["intensity"].base, np.memmap)
+        arrays.pop("name")
+        reduced = ssv.utils.fromMarzJSON(arrays)[0]
+        assert np.shares_memory(reduced.flux.value, arrays["intensity"])
+        assert np.shares_memory(reduced.uncertainty.array, arrays["variance"])
+
+    def test_file_objects(self, shared_datadir):
+        import io
+        from ssv.marzBinary import identify_marzbin, writeMarzBinary
+
+        buffer = io.BytesIO()
+        writeMarzBinary(self._simple_spectrum(shared_datadir), buffer)
+        fileobj = io.BytesIO(buffer.getvalue())
+        assert identify_marzbin("read", None, fileobj)
+        assert fileobj.tell() == 0
+        with open(shared_datadir / GAMA_MGC_TEST_FILENAME, "rb") as f:
+            assert not identify_marzbin("read", None, f)
+        assert len(SpectrumList.read(fileobj)) == 2
+
 class TestLoaderRegistryWorkaround:
     def test_unregister_and_register(self, shared_datadir):
         ssv.ssvloaders.restore_registered_loaders()
@@ -431,3 +628,486 @@ class TestLoaderRegistryWorkaround:
         ssv.ssvloaders.restore_registered_loaders()
         formats = ssv.ssvloaders.whatformat(shared_datadir / GAMA_2SLAQ_QSO_TEST_FILENAME)
         assert len(formats) == 2
+
+class TestFormatCache:
+    def test_cache_hit_and_invalidation(self, shared_datadir, tmp_path):
+        import os
+        import shutil
+        from ssv.cache import FormatCache
+
+        spectrum_file = tmp_path / GAMA_2SLAQ_QSO_TEST_FILENAME
+        shutil.copy(shared_datadir / GAMA_2SLAQ_QSO_TEST_FILENAME, spectrum_file)
+        cache = FormatCache(tmp_path / "formats.sqlite")
+
+        expected = ssv.ssvloaders.whatformat(spectrum_file)
+        assert ssv.ssvloaders.whatformat(spectrum_file, cache=cache) == expected
+        assert cache.stats()["misses"] == 1
+        assert ssv.ssvloaders.whatformat(spectrum_file, cache=cache) == expected
+        assert cache.hits == 1
+
+        # A new cache on the same database still sees the stored entry
+        assert ssv.ssvloaders.whatformat(spectrum_file, cache=FormatCache(cache.path)) == expected
+
+        stat = spectrum_file.stat()
+        os.utime(spectrum_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert ssv.ssvloaders.whatformat(spectrum_file, cache=cache) == expected
+        assert cache.misses == 2
+
+    def test_read_spectra_file_with_cache(self, shared_datadir, tmp_path):
+        from ssv.cache import FormatCache
+
+        cache = FormatCache(tmp_path / "formats.sqlite")
+        for _ in range(2):
+            spectra = ssv.utils.read_spectra_file(
+                shared_datadir / GAMA_MGC_TEST_FILENAME, format_cache=cache
+            )
+            assert len(spectra) == 2
+        assert cache.stats()["hits"] == 1
+
+class TestSpectraCache:
+    @pytest.mark.parametrize("next_to_source", [False, True])
+    def test_round_trip(self, shared_datadir, tmp_path, next_to_source):
+        import shutil
+        import numpy as np
+        from ssv.cache import SpectraCache
+
+        spectrum_file = tmp_path / GAMA_2QZ_TEST_FILENAME
+        shutil.copy(shared_datadir / GAMA_2QZ_TEST_FILENAME, spectrum_file)
+        cache = SpectraCache(tmp_path / "spectra", next_to_source=next_to_source)
+
+        expected = ssv.utils.read_spectra_file(spectrum_file, spectra_cache=cache)
+        cached = ssv.utils.read_spectra_file(spectrum_file, spectra_cache=cache)
+        assert cache.stats() == {"hits": 1, "misses": 1}
+        assert len(cached) == len(expected)
+        for spec, cached_spec in zip(expected, cached):
+            base = cached_spec.flux
+            while base.base is not None and not isinstance(base, np.memmap):
+                base = base.base
+            assert isinstance(base, np.memmap)
+            assert cached_spec.flux.unit == spec.flux.unit
+            np.testing.assert_array_equal(cached_spec.spectral_axis, spec.spectral_axis)
+            np.testing.assert_array_equal(cached_spec.flux, spec.flux)
+            assert type(cached_spec.uncertainty) == type(spec.uncertainty)
+            assert cached_spec.meta["purpose"] == spec.meta["purpose"]
+            assert cached_spec.meta["header"] == spec.meta["header"]
+
+    def test_source_change_invalidates(self, shared_datadir, tmp_path):
+        import os
+        import shutil
+        from ssv.cache import SpectraCache
+
+        spectrum_file = tmp_path / GAMA_MGC_TEST_FILENAME
+        shutil.copy(shared_datadir / GAMA_MGC_TEST_FILENAME, spectrum_file)
+        cache = SpectraCache(tmp_path / "spectra")
+        ssv.utils.read_spectra_file(spectrum_file, spectra_cache=cache)
+
+        stat = spectrum_file.stat()
+        os.utime(spectrum_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert cache.load(spectrum_file) is None
+        assert len(ssv.utils.read_spectra_file(spectrum_file, spectra_cache=cache)) == 2
+        assert cache.load(spectrum_file) is not None
+
+class TestSpectrumIndex:
+    def test_update_and_query(self, shared_datadir, tmp_path):
+        import os
+        import shutil
+        from ssv.indexer import SpectrumIndex
+
+        survey_dir = tmp_path / "survey"
+        (survey_dir / "gama").mkdir(parents=True)
+        for filename in [GAMA_MGC_TEST_FILENAME, GAMA_2QZ_TEST_FILENAME]:
+            shutil.copy(shared_datadir / filename, survey_dir / "gama" / filename)
+        shutil.copy(shared_datadir / DC_6DFGS_TEST_FILENAMES[0], survey_dir)
+        (survey_dir / "notes.txt").write_text("not a spectrum")
+
+        index = SpectrumIndex(tmp_path / "index.sqlite")
+        counts = index.update(survey_dir, workers=2)
+        assert counts["added"] == 4
+        assert counts["failed"] == 1
+        assert list(index.failed()) == [str((survey_dir / "notes.txt").resolve())]
+
+        mgc = str((survey_dir / "gama" / GAMA_MGC_TEST_FILENAME).resolve())
+        assert index.query(format="GAMA-MGC") == [mgc]
+        assert index.query(purpose="sky") == [mgc]
+        assert index.query(label="MGC%") == [mgc]
+        # H-alpha at z < 0.1
+        assert len(index.query(covers=[6563, 6563 * 1.1] * u.AA)) == 3
+        assert index.query(overlaps=(1, 2) * u.um) == []
+        assert len(index.query(directory=survey_dir / "gama")) == 2
+        assert len(ssv.utils.read_spectra_file(index.query(format="GAMA-MGC")[0])) == 2
+
+        os.remove(survey_dir / "notes.txt")
+        stat = os.stat(mgc)
+        os.utime(mgc, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        counts = index.update(survey_dir)
+        assert counts == {"added": 0, "updated": 1, "removed": 1, "unchanged": 2, "failed": 0}
+        index.close()
+
+    def test_update_subset_keeps_other_files(self, shared_datadir, tmp_path):
+        import shutil
+        from ssv.indexer import SpectrumIndex
+
+        survey_dir = tmp_path / "survey"
+        (survey_dir / "gama").mkdir(parents=True)
+        shutil.copy(shared_datadir / GAMA_MGC_TEST_FILENAME, survey_dir / "gama")
+        shutil.copy(shared_datadir / DC_6DFGS_TEST_FILENAMES[0], survey_dir)
+
+        index = SpectrumIndex(tmp_path / "index.sqlite")
+        index.update(survey_dir)
+        counts = index.update(survey_dir, pattern="*.txt", recursive=False)
+        assert counts["removed"] == 0
+        assert len(index.query(directory=survey_dir)) == 2
+        index.close()
+
+    def test_unidentified_format_recorded(self, shared_datadir, tmp_path, monkeypatch):
+        import shutil
+        import ssv.indexer
+        from ssv.indexer import SpectrumIndex
+
+        def whatformat(*args, **kwargs):
+            raise ValueError("no format")
+
+        monkeypatch.setattr(ssv.indexer, "whatformat", whatformat)
+        shutil.copy(shared_datadir / GAMA_MGC_TEST_FILENAME, tmp_path)
+        index = SpectrumIndex(tmp_path / "index.sqlite")
+        index.update(tmp_path, pattern="*.fit*")
+        path = str((tmp_path / GAMA_MGC_TEST_FILENAME).resolve())
+        assert "no format" in index.failed()[path]
+        index.close()
+
+class TestOpenOnce:
+    @pytest.mark.parametrize("filename", [
+        GAMA_2DFGRS_TEST_FILENAME,
+        GAMA_GAMA_TEST_FILENAME,
+        GAMA_MGC_TEST_FILENAME,
+        OZDES_TEST_FILENAME,
+    ])
+    def test_open_once_matches_default(self, shared_datadir, filename):
+        import numpy as np
+
+        spectra = ssv.utils.read_spectra_file(shared_datadir / filename)
+        ssv.ssvloaders.restore_registered_loaders()
+        spectra_once = ssv.utils.read_spectra_file(
+            shared_datadir / filename, open_once=True
+        )
+        ssv.ssvloaders.restore_registered_loaders()
+
+        assert len(spectra_once) == len(spectra)
+        for spectrum, spectrum_once in zip(spectra, spectra_once):
+            assert spectrum_once.meta.get("purpose") == spectrum.meta.get("purpose")
+            assert np.allclose(
+                spectrum_once.flux.value, spectrum.flux.value, equal_nan=True
+            )
+
+    def test_whatformat_hdulist(self, shared_datadir):
+        from astropy.io import fits
+
+        filename = shared_datadir / GAMA_2SLAQ_QSO_TEST_FILENAME
+        with fits.open(filename) as hdulist:
+            assert ssv.ssvloaders.whatformat(hdulist) == ssv.ssvloaders.whatformat(filename)
+
+class TestResolveFormat:
+    @pytest.fixture(autouse=True)
+    def no_low_priority_loaders(self, monkeypatch):
+        # Earlier tests mark loaders as low priority through unregister
+        monkeypatch.setattr(ssv.ssvloaders, "_low_priority_loaders", {})
+
+    def test_generic_formats_lose(self):
+        assert ssv.ssvloaders.resolve_format(["wcs1d-fits", "MARZ"]) == "MARZ"
+        assert ssv.ssvloaders.resolve_format(["GAMA-2SLAQ-QSO", "wcs1d-fits"]) == "GAMA-2SLAQ-QSO"
+        assert ssv.ssvloaders.resolve_format(["wcs1d-fits"]) == "wcs1d-fits"
+        assert ssv.ssvloaders.resolve_format([]) is None
+
+    def test_ties_go_to_last(self):
+        formats = ["2dFGRS", "6dFGS-split", "GAMA-2dFGRS"]
+        assert ssv.ssvloaders.resolve_format(formats) == "GAMA-2dFGRS"
+
+    def test_low_priority_loses(self, monkeypatch):
+        monkeypatch.setitem(ssv.ssvloaders._low_priority_loaders, "MARZ", True)
+        assert ssv.ssvloaders.resolve_format(["wcs1d-fits", "MARZ"]) == "wcs1d-fits"
+
+    def test_parallel_reads_match_serial(self, shared_datadir):
+        from concurrent.futures import ThreadPoolExecutor
+        from astropy.io import registry
+
+        filenames = [
+            GAMA_2DFGRS_TEST_FILENAME,
+            GAMA_2SLAQ_QSO_TEST_FILENAME,
+            GAMA_MGC_TEST_FILENAME,
+            OZDES_TEST_FILENAME,
+        ] * 3
+        identifiers = dict(registry._identifiers)
+
+        def read(filename):
+            spectra = ssv.utils.read_spectra_file(shared_datadir / filename)
+            return [spectrum.meta.get("purpose") for spectrum in spectra]
+
+        serial = [read(filename) for filename in filenames]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            parallel = list(executor.map(read, filenames))
+
+        assert parallel == serial
+        assert dict(registry._identifiers) == identifiers
+
+class TestHeaderRules:
+    def test_read_headers_matches_fits_open(self, shared_datadir):
+        from astropy.io import fits
+
+        filename = shared_datadir / OZDES_TEST_FILENAME
+        headers = ssv.ssvloaders.read_headers(filename, max_hdus=3)
+        with fits.open(filename) as hdulist:
+            assert len(headers) == 3
+            for header, hdu in zip(headers, hdulist):
+                assert header == hdu.header
+
+    def test_read_headers_rewinds_fileobj(self, shared_datadir):
+        with open(shared_datadir / OZDES_TEST_FILENAME, "rb") as f:
+            ssv.ssvloaders.read_headers(f, max_hdus=2)
+            assert f.tell() == 0
+
+    @pytest.mark.parametrize("filename", MARZ_TEST_FILENAMES)
+    def test_marz_rule(self, shared_datadir, filename):
+        assert ssv.ssvloaders.identify_with_header_rules(
+            shared_datadir / filename
+        ) == ["MARZ"]
+
+    def test_not_marz_rule(self, shared_datadir):
+        for filename in [GAMA_MGC_TEST_FILENAME, "marz/quasarLinearSkyAirNoHelio.json"]:
+            assert "MARZ" not in ssv.ssvloaders.identify_with_header_rules(
+                shared_datadir / filename
+            )
+
+    def test_rule_on_extension_header(self, shared_datadir, monkeypatch):
+        monkeypatch.setattr(ssv.ssvloaders, "_header_rules", {})
+        ssv.ssvloaders.register_header_rule(
+            "test-ozdes", [{(1, "EXTNAME"): ("exists", True), "NAXIS": ("==", 1)}]
+        )
+        assert ssv.ssvloaders.identify_with_header_rules(
+            shared_datadir / OZDES_TEST_FILENAME
+        ) == ["test-ozdes"]
+        with pytest.raises(ValueError):
+            ssv.ssvloaders.register_header_rule("bad", [{"NAXIS": ("~=", 1)}])
+
+    def test_identifiers_share_header_read(self, shared_datadir, monkeypatch):
+        monkeypatch.setattr(ssv.ssvloaders, "_header_rules", {})
+        ssv.ssvloaders.register_header_rule("test-ozdes", [{(1, "EXTNAME"): ("exists", True)}])
+        ssv.ssvloaders.register_header_rule("test-other", [{"NAXIS": ("==", 5)}])
+        reads = []
+        read_headers = ssv.ssvloaders.read_headers
+
+        def counted(*args, **kwargs):
+            reads.append(args[0])
+            return read_headers(*args, **kwargs)
+
+        monkeypatch.setattr(ssv.ssvloaders, "read_headers", counted)
+        identifiers = [
+            ssv.ssvloaders.header_rule_identifier(format) for format in ["test-ozdes", "test-other"]
+        ]
+        filename = shared_datadir / OZDES_TEST_FILENAME
+        with open(filename, "rb") as f:
+            assert [identifier("read", filename, f) for identifier in identifiers] == [True, False]
+        assert len(reads) == 1
+
+        assert [identifier("read", filename) for identifier in identifiers] == [True, False]
+        assert len(reads) == 2
+
+        ssv.ssvloaders.register_header_rule("test-other", [{"NAXIS": ("exists", True)}])
+        assert [identifier("read", filename) for identifier in identifiers] == [True, True]
+        assert len(reads) == 3
+
+class TestBatchLoading:
+    def test_read_spectra_files_ordered(self, shared_datadir):
+        paths = [
+            shared_datadir / GAMA_MGC_TEST_FILENAME,
+            shared_datadir / "does-not-exist.fits",
+            shared_datadir / OZDES_TEST_FILENAME,
+        ]
+        results = list(ssv.utils.read_spectra_files(paths, workers=2, max_in_flight=1))
+        assert [result.path for result in results] == paths
+        assert len(results[0].spectra) == 2 and results[0].error is None
+        assert results[1].spectra is None
+        assert isinstance(results[1].error, OSError)
+        assert len(results[2].spectra) == 5
+
+    def test_read_spectra_files_as_completed(self, shared_datadir):
+        paths = [shared_datadir / filename for filename in DC_TEST_FILENAMES[:4]]
+        results = list(ssv.utils.read_spectra_files(paths, workers=2, ordered=False))
+        assert sorted(result.path for result in results) == sorted(paths)
+        assert all(result.error is None for result in results)
+
+    def test_read_spectra_files_processes(self, shared_datadir):
+        import numpy as np
+
+        paths = [shared_datadir / GAMA_MGC_TEST_FILENAME, shared_datadir / OZDES_TEST_FILENAME]
+        serial = [ssv.utils.read_spectra_file(path) for path in paths]
+        results = list(ssv.utils.read_spectra_files(paths, workers=2, use_processes=True))
+        for spectra, result in zip(serial, results):
+            assert len(result.spectra) == len(spectra)
+            for spectrum, loaded in zip(spectra, result.spectra):
+                assert loaded.meta.get("purpose") == spectrum.meta.get("purpose")
+                assert type(loaded.uncertainty) is type(spectrum.uncertainty)
+                assert np.allclose(loaded.flux.value, spectrum.flux.value, equal_nan=True)
+                assert np.allclose(loaded.spectral_axis.value, spectrum.spectral_axis.value)
+
+class TestLazySpectraMap:
+    def _build_map(self, hdulist, lazy, wcs_cache=None):
+        from collections import defaultdict
+
+        spectra_map = defaultdict(list)
+        for hdu, purpose in zip(hdulist, ["combined_science", "combined_error_variance"]):
+            ssv.ssvloaders.add_single_spectra_to_map(
+                spectra_map,
+                header=hdu.header,
+                data=hdu.data,
+                spec_info={"purpose": purpose},
+                all_standard_units=True,
+                all_keywords=False,
+                valid_wcs=True,
+                lazy=lazy,
+                wcs_cache=wcs_cache,
+            )
+        return spectra_map
+
+    def test_lazy_matches_eager(self, shared_datadir):
+        import numpy as np
+        from astropy.io import fits
+
+        with fits.open(shared_datadir / OZDES_TEST_FILENAME, memmap=True) as hdulist:
+            eager = self._build_map(hdulist, lazy=False)["combined"][0]
+            lazy = self._build_map(hdulist, lazy=True)["combined"][0]
+
+            assert isinstance(lazy, ssv.ssvloaders.LazySpectrum)
+            assert not lazy.is_loaded
+            assert lazy.meta["purpose"] == "combined"
+            assert lazy.meta.get("uncertainty_header") is not None
+            assert not lazy.is_loaded
+
+            spectrum = ssv.ssvloaders.load_lazy_spectra([lazy])[0]
+            assert lazy.is_loaded
+            assert spectrum.flux.unit == eager.flux.unit
+            assert np.allclose(spectrum.flux.value, eager.flux.value, equal_nan=True)
+            assert np.allclose(spectrum.spectral_axis.value, eager.spectral_axis.value)
+            assert isinstance(spectrum.uncertainty, VarianceUncertainty)
+            assert np.allclose(
+                spectrum.uncertainty.array, eager.uncertainty.array, equal_nan=True
+            )
+            # attributes are forwarded to the loaded spectrum
+            assert lazy.spectral_axis.unit == u.Angstrom
+
+    @pytest.mark.parametrize("lazy", [False, True])
+    def test_shared_wcs_skips_alignment(self, shared_datadir, monkeypatch, lazy):
+        import numpy as np
+        from astropy.io import fits
+
+        with fits.open(shared_datadir / OZDES_TEST_FILENAME) as hdulist:
+            expected = self._build_map(hdulist, lazy=False)["combined"][0]
+
+            def fail(*args, **kwargs):
+                raise AssertionError("pixel_to_pixel called for identical WCS")
+
+            monkeypatch.setattr(ssv.ssvloaders, "pixel_to_pixel", fail)
+            wcs_cache = {}
+            spectrum = ssv.ssvloaders.load_lazy_spectra(
+                self._build_map(hdulist, lazy=lazy, wcs_cache=wcs_cache)["combined"]
+            )[0]
+
+            assert len(wcs_cache) == 1
+            assert spectrum.uncertainty.unit == expected.uncertainty.unit
+            assert np.allclose(
+                spectrum.uncertainty.array, expected.uncertainty.array, equal_nan=True
+            )
+
+    def test_read_spectra_file_lazy(self, shared_datadir):
+        import numpy as np
+
+        filename = shared_datadir / OZDES_TEST_FILENAME
+        eager = ssv.utils.read_spectra_file(filename)
+        lazy = ssv.utils.read_spectra_file(filename, lazy=True)
+
+        assert len(lazy) == len(eager)
+        assert all(isinstance(spectrum, ssv.ssvloaders.LazySpectrum) for spectrum in lazy)
+        assert not any(spectrum.is_loaded for spectrum in lazy)
+        assert [spectrum.meta.get("label") for spectrum in lazy] == [spectrum.meta.get("label") for spectrum in eager]
+        for spectrum, loaded in zip(eager, ssv.ssvloaders.load_lazy_spectra(lazy)):
+            assert np.allclose(loaded.flux.value, spectrum.flux.value, equal_nan=True)
+            assert np.allclose(loaded.spectral_axis.value, spectrum.spectral_axis.value)
+            assert np.allclose(loaded.uncertainty.array, spectrum.uncertainty.array, equal_nan=True)
+
+    def test_read_spectra_files_share_wcs_cache(self, shared_datadir, monkeypatch):
+        import numpy as np
+
+        paths = [shared_datadir / filename for filename in [OZDES_TEST_FILENAME, "000001.fits"]]
+        expected = [ssv.utils.read_spectra_file(path) for path in paths]
+        built = []
+        refresh_units = ssv.ssvloaders.refresh_units
+
+        def counted(wcs):
+            built.append(wcs)
+            return refresh_units(wcs)
+
+        # called once for every WCS built
+        monkeypatch.setattr(ssv.ssvloaders, "refresh_units", counted)
+        wcs_cache = {}
+        results = list(ssv.utils.read_spectra_files(paths, workers=1, wcs_cache=wcs_cache))
+        # the HDUs of each file share their WCS
+        assert len(built) == len(wcs_cache) < sum(len(spectra) for spectra in expected)
+        for spectra, result in zip(expected, results):
+            for spectrum, loaded in zip(spectra, result.spectra):
+                assert np.allclose(loaded.spectral_axis.value, spectrum.spectral_axis.value)
+
+        built.clear()
+        results = list(ssv.utils.read_spectra_files(paths, workers=1, wcs_cache=wcs_cache))
+        assert built == []
+        assert all(result.error is None for result in results)
+
+class TestDataCentralOverrides:
+    def test_flux_units_match_specutils(self, tmp_path):
+        import numpy as np
+        from astropy.io import fits
+        from specutils import SpectrumList
+        from specutils.io.default_loaders import dc_common
+
+        header = fits.Header({
+            "CTYPE1": "WAVE", "CUNIT1": "Angstrom", "CRPIX1": 1, "CRVAL1": 4000, "CDELT1": 2,
+            "BUNIT": "erg / (s cm2 Angstrom)",
+        })
+        filename = tmp_path / "bunit.fits"
+        fits.HDUList([fits.PrimaryHDU(np.ones(10), header=header)]).writeto(filename)
+        config = {
+            "hdus": {"0": {"purpose": "science"}},
+            "wcs": None,
+            "units": {"flux_unit": "count"},
+            "all_standard_units": False,
+            "all_keywords": False,
+            "valid_wcs": True,
+        }
+
+        spectrum = SpectrumList.read(filename, format=ssv.ssvloaders.SINGLE_SPLIT_LABEL, **config)[0]
+        expected = dc_common.load_single_split_file(filename, **config)[0]
+        assert spectrum.flux.unit == expected.flux.unit == u.Unit(header["BUNIT"])
+
+class TestMarzLoaderConfig:
+    def test_config_chosen_once(self):
+        expected = ssv.marz.MARZ_CONFIG_NEXT if ssv.marz.SUPPORTS_FALLBACK_HEADER else ssv.marz.MARZ_CONFIG
+        assert ssv.marz.MARZ_READ_CONFIG is expected
+
+    def test_probes_registered_reader(self, monkeypatch):
+        def reader(filename, **kwargs):
+            pass
+
+        assert ssv.marz._supports_fallback_header()
+        monkeypatch.setattr(ssv.marz.registry, "get_reader", lambda *args: reader)
+        assert not ssv.marz._supports_fallback_header()
+
+    def test_read_errors_are_not_retried(self, monkeypatch):
+        calls = []
+
+        def failing_read(*args, **kwargs):
+            calls.append(kwargs)
+            raise KeyError("CRPIX1")
+
+        monkeypatch.setattr(ssv.marz.SpectrumList, "read", failing_read)
+        with pytest.raises(KeyError):
+            ssv.marz.marz_loader("spectrum.fits")
+        assert len(calls) == 1
+        assert ("fallback_header" in calls[0]) == ssv.marz.SUPPORTS_FALLBACK_HEADER
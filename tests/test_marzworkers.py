@@ -0,0 +1,118 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from ssv.cache import RedshiftCache
+from ssv.marzworkers import (
+    marz_result, marz_result_to_dict, parse_marz_output, redshift_batch,
+)
+
+
+def fake_redshift(spectrum_json):
+    """"z" is the mean wavelength, an intensity of -2 is an error"""
+    spectrum = json.loads(spectrum_json)
+    if spectrum["intensity"][0] == -2:
+        raise ValueError("bad spectrum")
+    wavelength = spectrum["wavelength"]
+    return {"z": sum(wavelength) / len(wavelength), "template": "Fake"}
+
+
+def spectrum(z, flag=1.0):
+    return {"wavelength": [z - 1, z + 1], "intensity": [flag, 2.0]}
+
+
+class TestRedshiftBatch:
+    def test_results_in_order(self):
+        table = redshift_batch([spectrum(z) for z in range(6)], fake_redshift, workers=2)
+        assert list(table["z"]) == list(range(6))
+        assert set(table["template"]) == {"Fake"}
+        assert not any(table["cached"])
+
+    def test_no_cache_keys_without_cache(self, monkeypatch):
+        import ssv.marzworkers
+
+        def redshift_cache_key(*args):
+            raise AssertionError("cache key computed without a cache")
+
+        monkeypatch.setattr(ssv.marzworkers, "redshift_cache_key", redshift_cache_key)
+        table = redshift_batch([spectrum(1)], fake_redshift)
+        assert table["error"][0] == ""
+
+    def test_errors_are_reported_per_row(self):
+        table = redshift_batch([spectrum(1), spectrum(2, flag=-2)], fake_redshift)
+        assert table["error"][0] == ""
+        assert "bad spectrum" in table["error"][1]
+        assert np.isnan(table["z"][1])
+
+    def test_cache_only_fits_changed_spectra(self, tmp_path):
+        cache = RedshiftCache(tmp_path / "redshifts.sqlite")
+        redshift_batch([spectrum(1), spectrum(2)], fake_redshift, cache=cache)
+        table = redshift_batch([spectrum(1), spectrum(3)], fake_redshift, cache=cache)
+        assert list(table["cached"]) == [True, False]
+        assert list(table["z"]) == [1, 3]
+        other = redshift_batch(
+            [spectrum(1)], fake_redshift, cache=cache, template_signature="other"
+        )
+        assert not other["cached"][0]
+        assert cache.stats() == {"hits": 1, "misses": 4}
+
+    def test_reads_paths(self):
+        path = str(Path("./tests/data") / "OzDES-DR2_04720.fits")
+        table = redshift_batch([path], fake_redshift)
+        assert table["path"][0] == path
+        assert table["error"][0] == ""
+        assert table["z"][0] > 0
+
+
+# Hand-written, not captured from Marz: the AutoTID2/AutoTN2/AutoZ2/AutoXCor2 layout for
+# --numAutomatic is assumed and has not been checked against real Marz CLI output
+MARZ_OUTPUT = """Loading templates
+Processing 1 spectrum
+#Created using Marz version 1.2.0
+# ID,Name,RA,DEC,Mag,Type,AutoTID,AutoTN,AutoZ,AutoXCor,AutoTID2,AutoTN2,AutoZ2,AutoXCor2,FinTID,FinTN,FinZ,QOP,Comment
+1,J0001,0.1,-0.2,19.5,P,8,Late Type Emission Galaxy,0.31002,9.81,12,Quasar,1.1,4.2,0,,0,0,
+"""
+# Hand-written, not captured from Marz: a single candidate in the column layout (AutoTN at 7,
+# AutoZ at 8) the plugin has always read from the Marz CLI output
+SINGLE_CANDIDATE_OUTPUT = Path("./tests/data/marz") / "marzcli_single_candidate.txt"
+
+
+class TestMarzResult:
+    def test_parse_candidates(self):
+        result = parse_marz_output(MARZ_OUTPUT, seconds=1.5)
+        assert (result.z, result.template, result.xcor) == (0.31002, "Late Type Emission Galaxy", 9.81)
+        assert [candidate.template for candidate in result.candidates] == [
+            "Late Type Emission Galaxy", "Quasar"
+        ]
+        assert result.candidates[1].z == 1.1
+        assert result.qop == 0
+        assert result.seconds == 1.5
+        assert result.fields["Name"] == "J0001"
+
+    def test_parse_single_candidate(self):
+        output = SINGLE_CANDIDATE_OUTPUT.read_text()
+        result = parse_marz_output(output)
+        row = output.splitlines()[-1].split(",")
+        assert (result.z, result.template) == (float(row[8]), row[7])
+        assert len(result.candidates) == 1
+        assert result.xcor == 6.213
+
+    def test_parse_without_header(self):
+        row = "1,J0001,0.1,-0.2,19.5,P,8,Quasar,2.5,7.0,0,,0,0,"
+        result = parse_marz_output(["done", row])
+        assert (result.z, result.template, result.xcor) == (2.5, "Quasar", 7.0)
+
+    def test_no_result(self):
+        with pytest.raises(ValueError):
+            parse_marz_output("Error: no spectra\n")
+
+    def test_round_trip(self):
+        result = parse_marz_output(MARZ_OUTPUT, seconds=1.5)
+        assert marz_result(json.loads(json.dumps(marz_result_to_dict(result)))) == result
+
+    def test_result_dict(self):
+        result = marz_result({"z": 0.5, "template": "Quasar "}, seconds=0.1)
+        assert result.candidates[0].template == "Quasar"
+        assert np.isnan(result.xcor)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from ssv.pyramid import SpectrumPyramid
+
+
+@pytest.fixture(scope="module")
+def spectrum():
+    wavelength = np.linspace(300, 1000, 100001)
+    flux = np.random.default_rng(2).normal(size=wavelength.size)
+    flux[40000] = 80
+    flux[:100] = np.nan
+    return wavelength, flux
+
+
+class TestSpectrumPyramid:
+    def test_levels_summarise_buckets(self, spectrum):
+        wavelength, flux = spectrum
+        pyramid = SpectrumPyramid(wavelength, flux)
+        level = pyramid.levels[6]
+        buckets = np.append(flux, np.full(-len(flux) % 64, np.nan)).reshape(-1, 64)
+        assert level.minimum[10:] == pytest.approx(np.nanmin(buckets[10:], axis=1))
+        assert level.maximum[10:] == pytest.approx(np.nanmax(buckets[10:], axis=1))
+        assert level.mean[10:] == pytest.approx(np.nanmean(buckets[10:], axis=1))
+        assert flux[level.argmax[10:]] == pytest.approx(level.maximum[10:])
+        assert np.isnan(level.mean[0])
+        assert len(pyramid.levels[-1].argmin) == 1
+
+    def test_zoomed_out_view(self, spectrum):
+        wavelength, flux = spectrum
+        pyramid = SpectrumPyramid(wavelength, flux)
+        indices = pyramid.indices(max_points=400)
+        assert 100 < len(indices) <= 400
+        assert 40000 in indices
+        assert pyramid.level_for(0, len(flux), 400) == 9
+
+    def test_deep_zoom_is_full_resolution(self, spectrum):
+        wavelength, flux = spectrum
+        pyramid = SpectrumPyramid(wavelength, flux)
+        indices = pyramid.indices((500, 501), max_points=1400)
+        assert indices.tolist() == list(range(indices[0], indices[-1] + 1))
+        assert wavelength[indices[0]] < 500 <= wavelength[indices[1]]
+        assert wavelength[indices[-2]] <= 501 < wavelength[indices[-1]]
+
+    def test_unsorted_axis_uses_whole_spectrum(self):
+        pyramid = SpectrumPyramid([3, 1, 2], [1.0, 2.0, 3.0])
+        assert pyramid.indices((1, 1.5)).tolist() == [0, 1, 2]
@@ -0,0 +1,102 @@
+import json
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pytest
+import astropy.units as u
+from specutils import Spectrum1D
+
+from ssv import utils
+from ssv.redshift import CrossCorrelator, DEFAULT_TEMPLATE_FILE, TemplateBank, prepare_for_correlation
+
+TEMPLATE_FILE = Path("./tests/data/marz") / "MarzTemplates.json"
+
+
+@pytest.fixture(scope="module")
+def templates():
+    return utils.read_template_file(TEMPLATE_FILE)
+
+
+@pytest.fixture(scope="module")
+def correlator(templates):
+    return CrossCorrelator(templates)
+
+
+def inject(template, z, noise=0.3, seed=0):
+    """Observe `template` at redshift `z` on a linear 3700-8800 Angstrom grid, with noise"""
+    wavelength = np.linspace(3700, 8800, 4000)
+    flux = np.interp(wavelength / (1 + z), template.spectral_axis.value, template.flux.value)
+    rng = np.random.default_rng(seed)
+    flux += rng.normal(0, noise * np.std(flux), flux.size)
+    return Spectrum1D(spectral_axis=wavelength * u.AA, flux=flux * u.ct)
+
+
+class TestCrossCorrelator:
+    def test_template_meta(self, templates):
+        quasar = templates[-1]
+        assert quasar.meta["purpose"] == "Quasar"
+        assert (quasar.meta["z_start"], quasar.meta["z_end"]) == (0.2, 5)
+
+    def test_default_templates_shipped(self):
+        assert DEFAULT_TEMPLATE_FILE.exists()
+        assert DEFAULT_TEMPLATE_FILE.read_bytes() == TEMPLATE_FILE.read_bytes()
+
+    @pytest.mark.parametrize("name,z", [
+        ("Late Type Emission Galaxy", 0.31),
+        ("Early Type Absorption Galaxy", 0.08),
+        ("Quasar", 1.7),
+    ])
+    def test_recovers_injected_redshift(self, templates, correlator, name, z):
+        template = next(t for t in templates if t.meta["purpose"] == name)
+        best = correlator.redshift(inject(template, z))[0]
+        assert best.template == name
+        assert best.z == pytest.approx(z, abs=2e-4)
+
+    def test_candidates_sorted(self, templates, correlator):
+        candidates = correlator.redshift(inject(templates[7], 0.2), candidates=4)
+        assert len(candidates) == 4
+        values = [candidate.value for candidate in candidates]
+        assert values == sorted(values, reverse=True)
+
+    def test_marz_dict_input(self, templates, correlator):
+        spectrum = inject(templates[7], 0.45)
+        arrays = {"wavelength": spectrum.spectral_axis.value, "intensity": spectrum.flux.value}
+        assert correlator.redshift(arrays, 1) == correlator.redshift(spectrum, 1)
+
+    def test_matches_sdss_redshift(self, correlator):
+        # the pipeline redshift of this BOSS galaxy is 0.322794
+        spectra = utils.read_spectra_file(Path("./tests/data") / "spec-4444-55538-1000.fits")
+        assert correlator.redshift(spectra[0], 1)[0].z == pytest.approx(0.322794, abs=1e-4)
+
+    def test_prepare_without_data(self):
+        prepared = prepare_for_correlation(np.full((2, 50), np.nan))
+        assert not prepared.any()
+
+
+class TestTemplateBank:
+    def test_cached_bank_is_memory_mapped(self, tmp_path):
+        template_file = tmp_path / "templates.json"
+        template_file.write_bytes(TEMPLATE_FILE.read_bytes())
+        built = TemplateBank.from_file(template_file, cache_dir=tmp_path / "banks")
+        cached = TemplateBank.from_file(template_file, cache_dir=tmp_path / "banks")
+        assert cached.path == built.path
+        assert isinstance(cached.prepared, np.memmap)
+        assert isinstance(cached.template_fft, np.memmap)
+        assert cached.names == TemplateBank.from_file(template_file, cache=False).names
+
+    def test_stale_when_template_file_changes(self, tmp_path):
+        template_file = tmp_path / "templates.json"
+        template_file.write_text(json.dumps(json.loads(TEMPLATE_FILE.read_text())[:3]))
+        assert len(TemplateBank.from_file(template_file, cache_dir=tmp_path)) == 3
+        template_file.write_text(json.dumps(json.loads(TEMPLATE_FILE.read_text())[:5]))
+        assert len(TemplateBank.from_file(template_file, cache_dir=tmp_path)) == 5
+
+    def test_pickles_as_path(self, templates, tmp_path):
+        bank = TemplateBank.from_templates(templates)
+        bank.save(tmp_path / "bank", with_fft=False)
+        correlator = pickle.loads(pickle.dumps(CrossCorrelator(TemplateBank.load(tmp_path / "bank"))))
+        assert len(pickle.dumps(correlator)) < 1000
+        assert isinstance(correlator.bank.flux, np.memmap)
+        spectrum = inject(templates[7], 0.3)
+        assert correlator.redshift(spectrum, 1) == CrossCorrelator(bank).redshift(spectrum, 1)